@@ -0,0 +1,308 @@
+"""API HTTP cục bộ điều khiển lõi tải: gửi/xem/hủy job và theo dõi tiến độ qua Server-Sent Events.
+
+    GET    /api/jobs          danh sách job + thống kê hàng đợi
+    GET    /api/jobs/<id>     trạng thái một job
+    POST   /api/jobs          {"url", "format": "best|audio|mp3|<format_id>", "playlist", "save_path", "priority"}
+                              (Content-Type: application/json; save_path phải nằm trong thư mục lưu đã cấu hình)
+    DELETE /api/jobs/<id>     hủy job
+    GET    /api/events        luồng SSE (hỗ trợ Last-Event-ID để nối lại)
+    GET    /api/metrics       số đo theo job + gộp theo trang (?format=csv để lấy CSV)
+
+Mọi request phải kèm "Authorization: Bearer <token>" hoặc ?token=<token> (EventSource không gửi được header);
+không truyền token thì server tự sinh, kể cả khi chỉ nghe localhost (trang web bất kỳ trong trình duyệt cũng gọi được localhost)."""
+import hmac
+import json
+import os
+import uuid
+import threading
+import time
+from collections import deque, OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from engine import progress_fraction
+
+API_DEFAULT_PORT = 8765
+API_EVENT_BACKLOG = 1000     # Số sự kiện giữ lại cho subscriber nối lại / đọc chậm
+API_SSE_INTERVAL = 0.25      # Giây, mỗi subscriber nhận tối đa 4 lô sự kiện/giây
+API_HEARTBEAT_SEC = 15       # Gửi comment giữ kết nối khi không có sự kiện
+API_MAX_SUBSCRIBERS = 64
+API_MAX_BODY = 64 * 1024
+API_KEEP_FINISHED = 200      # Số job đã kết thúc còn giữ trong /api/jobs
+
+
+class EventHub:
+    """Phát lại sự kiện của engine cho nhiều subscriber.
+    Một bộ đệm vòng chung + Condition: subscriber ngủ tới khi có sự kiện mới (không polling),
+    publish chỉ là append nên worker tải không bị chậm dù có bao nhiêu subscriber.
+    Hub cũng giữ bảng trạng thái job cho GET /api/jobs."""
+    def __init__(self, backlog: int = API_EVENT_BACKLOG):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=backlog)
+        self._seq = 0
+        self._jobs = OrderedDict()
+        self.subscribers = 0
+        self.closed = False
+
+    @property
+    def last_seq(self):
+        with self._cond: return self._seq
+
+    def publish(self, item):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, item))
+            self._track_locked(item)
+            self._cond.notify_all()
+
+    def subscribe(self, limit: int = API_MAX_SUBSCRIBERS):
+        with self._cond:
+            if self.subscribers >= limit: return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond: self.subscribers -= 1
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _track_locked(self, item):
+        job_id = item.get('job_id')
+        if job_id is None: return
+        t = item.get('type')
+        job = self._jobs.get(job_id)
+        if job is None:
+            if t != 'queued': return  # Job có trước khi bật API
+            job = self._jobs[job_id] = {'id': job_id, 'url': item.get('url'), 'title': item.get('title'), 'state': 'queued'}
+        if t == 'status' or t == 'progress' or t == 'playlist_progress':
+            if job['state'] == 'queued': job['state'] = 'running'
+            if t == 'progress':
+                job.update(downloaded=item.get('downloaded'), total=item.get('total'), speed=item.get('speed'), eta=item.get('eta'))
+                if item.get('entry') is None: job['progress'] = progress_fraction(item)
+            elif t == 'playlist_progress':
+                job.update(done=item.get('done'), failed=item.get('failed'), entries=item.get('total'))
+                job['progress'] = (item.get('done', 0) + item.get('failed', 0)) / (item.get('total') or 1)
+        elif t == 'finished':
+            job.update(state='duplicate' if item.get('duplicate') else 'finished', filepath=item.get('filepath'), progress=1)
+        elif t == 'playlist_done':
+            failed = item.get('failed') or 0
+            job.update(done=item.get('done'), failed=failed, entries=item.get('total'), progress=1)
+            # Lỗi hết thì cả job là lỗi, lỗi một phần thì vẫn báo rõ để client không tưởng đã tải đủ
+            job['state'] = 'error' if failed and failed >= (item.get('total') or 0) else 'finished_with_errors' if failed else 'finished'
+        elif t == 'cancelled' or t == 'error':
+            job['state'] = t
+            if t == 'error': job['error'] = item.get('msg')
+        elif t == 'worker_done' and job['state'] in ('queued', 'running'):
+            job['state'] = 'postprocessing' if item.get('postprocessing') else 'finished'
+        # Bỏ bớt job đã kết thúc cũ nhất
+        if len(self._jobs) > API_KEEP_FINISHED:
+            for jid in [j for j, rec in self._jobs.items() if rec['state'] not in ('queued', 'running', 'postprocessing')][:len(self._jobs) - API_KEEP_FINISHED]:
+                del self._jobs[jid]
+
+    def jobs(self):
+        with self._cond: return [dict(rec) for rec in self._jobs.values()]
+
+    def job(self, job_id):
+        with self._cond:
+            rec = self._jobs.get(job_id)
+            return dict(rec) if rec else None
+
+    def read(self, after, timeout):
+        """Sự kiện có seq > after, chờ tối đa timeout giây nếu chưa có.
+        Progress chỉ giữ tick mới nhất cho mỗi (job, entry). Trả (events, last_seq, lost);
+        lost=True nghĩa là subscriber tụt quá xa, sự kiện cũ đã bị đẩy khỏi bộ đệm."""
+        with self._cond:
+            if self._seq <= after and not self.closed:
+                self._cond.wait(timeout)
+            if after > self._seq: after = 0  # Last-Event-ID từ phiên chạy trước
+            lost = bool(self._events) and self._events[0][0] > after + 1
+            batch = [(s, e) for s, e in self._events if s > after]
+            last = self._seq
+        seen = set()
+        out = []
+        for s, e in reversed(batch):
+            if e.get('type') == 'progress':
+                key = (e.get('job_id'), e.get('entry'))
+                if key in seen: continue
+                seen.add(key)
+            out.append((s, e))
+        out.reverse()
+        return out, last, lost
+
+
+class ControlServer:
+    """HTTP server (thread nền) điều khiển một DownloadEngine. Mỗi kết nối SSE chạy trên thread riêng
+    của ThreadingHTTPServer và chờ trên EventHub, giới hạn API_MAX_SUBSCRIBERS kết nối."""
+    def __init__(self, engine, host="127.0.0.1", port=API_DEFAULT_PORT, token="", save_path="."):
+        self.engine = engine
+        self.host = host
+        self.port = int(port)
+        self.token = token or uuid.uuid4().hex
+        self.save_path = save_path
+        self.hub = EventHub()
+        self._httpd = None
+
+    @property
+    def url(self):
+        host = self.host if self.host not in ("", "0.0.0.0") else "127.0.0.1"
+        return f"http://{host}:{self._httpd.server_address[1] if self._httpd else self.port}"
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self.engine.events.taps.append(self.hub.publish)
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if not self._httpd: return
+        try: self.engine.events.taps.remove(self.hub.publish)
+        except ValueError: pass
+        self.hub.close()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._httpd = None
+
+    def resolve_save_path(self, path):
+        """Thư mục lưu cho job gửi qua API: đường dẫn tương đối tính từ thư mục lưu đã cấu hình,
+        None nếu nằm ngoài thư mục đó (API không được ghi file ra chỗ khác)"""
+        root = os.path.realpath(self.save_path or ".")
+        target = os.path.realpath(os.path.join(root, path)) if path else root
+        return target if os.path.commonpath([root, target]) == root else None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _make_handler(server):
+    engine, hub = server.engine, server.hub
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_text(self, code, text, content_type):
+            body = text.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self):
+            parts = urlsplit(self.path)
+            self.query = parse_qs(parts.query)
+            return [p for p in parts.path.split("/") if p]
+
+        def _authorized(self):
+            header = self.headers.get("Authorization") or ""
+            given = header[7:] if header.startswith("Bearer ") else (self.query.get("token") or [""])[0]
+            if hmac.compare_digest(given.encode(), server.token.encode()): return True
+            self._send_json(401, {'error': 'unauthorized'})
+            return False
+
+        def _job_id(self, route):
+            try: return int(route[2])
+            except (IndexError, ValueError): return None
+
+        def do_GET(self):
+            route = self._route()
+            if not self._authorized(): return
+            if route == ["api", "jobs"]:
+                self._send_json(200, {'jobs': hub.jobs(), 'stats': engine.scheduler.stats()})
+            elif route[:2] == ["api", "jobs"] and len(route) == 3:
+                job = hub.job(self._job_id(route))
+                if job: self._send_json(200, job)
+                else: self._send_json(404, {'error': 'job not found'})
+            elif route == ["api", "events"]:
+                self._stream_events()
+            elif route == ["api", "metrics"]:
+                if (self.query.get("format") or [""])[0] == "csv": self._send_text(200, engine.metrics.to_csv(), "text/csv")
+                else: self._send_json(200, {'jobs': engine.metrics.snapshot(), 'sites': engine.metrics.by_site()})
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            route = self._route()
+            if not self._authorized(): return
+            if route != ["api", "jobs"]:
+                return self._send_json(404, {'error': 'not found'})
+            # Chỉ nhận JSON: form HTML / fetch "simple request" từ trang khác không gửi được Content-Type này khi không qua preflight
+            if (self.headers.get("Content-Type") or "").split(";")[0].strip().lower() != "application/json":
+                return self._send_json(415, {'error': 'Content-Type must be application/json'})
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > API_MAX_BODY: return self._send_json(413, {'error': 'body too large'})
+                req = json.loads(self.rfile.read(length) or b"{}")
+                url = str(req.get('url') or "").strip()
+            except (ValueError, AttributeError):
+                return self._send_json(400, {'error': 'invalid JSON'})
+            if not url.startswith(("http://", "https://")):
+                return self._send_json(400, {'error': 'url must be http(s)'})
+            save_path = server.resolve_save_path(str(req.get('save_path') or ""))
+            if save_path is None:
+                return self._send_json(403, {'error': 'save_path must be inside the configured output folder'})
+            job_id = engine.submit(url, str(req.get('format') or "best"), bool(req.get('playlist')),
+                                   save_path, engine.settings.get("cookies", ""),
+                                   priority=0 if req.get('priority') else 1, title=req.get('title') or url)
+            self._send_json(201, {'id': job_id})
+
+        def do_DELETE(self):
+            route = self._route()
+            if not self._authorized(): return
+            if route[:2] != ["api", "jobs"] or len(route) != 3:
+                return self._send_json(404, {'error': 'not found'})
+            if engine.scheduler.cancel(self._job_id(route)): self._send_json(202, {'cancelled': True})
+            else: self._send_json(404, {'error': 'job not found or already finished'})
+
+        def _stream_events(self):
+            if not hub.subscribe():
+                return self._send_json(503, {'error': 'too many subscribers'})
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try: after = int(self.headers.get("Last-Event-ID") or -1)
+                except ValueError: after = -1
+                if after < 0:
+                    # Subscriber mới: gửi ảnh chụp trạng thái rồi chỉ nhận sự kiện mới
+                    after = hub.last_seq
+                    self._write_event(after, 'snapshot', {'jobs': hub.jobs()})
+                while not hub.closed:
+                    events, last, lost = hub.read(after, API_HEARTBEAT_SEC)
+                    if lost: self._write_event(last, 'snapshot', {'jobs': hub.jobs(), 'resync': True})
+                    for seq, item in events:
+                        self._write_event(seq, item.get('type', 'message'), item)
+                    if not events and not lost: self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    after = last
+                    # Gom sự kiện dồn dập thành lô, giới hạn tần suất ghi ra socket
+                    time.sleep(API_SSE_INTERVAL)
+            except (BrokenPipeError, ConnectionResetError, OSError):
+                pass
+            finally:
+                hub.unsubscribe()
+
+        def _write_event(self, seq, name, data):
+            payload = json.dumps(data, ensure_ascii=False, default=str)
+            self.wfile.write(f"id: {seq}\nevent: {name}\ndata: {payload}\n\n".encode("utf-8"))
+
+    return Handler
@@ -0,0 +1,358 @@
+"""Benchmark các đường nóng của lõi tải (engine.py) trên server media cục bộ + extractor giả, kết quả in ra JSON.
+Đo: thời gian phân tích (lần đầu / trúng cache), time-to-first-byte và thông lượng tải, độ trễ progress_hook -> UI
+(EventChannel + UIPump), thời gian truy vấn/dựng lịch sử N mục, bộ nhớ khi chạy nhiều vòng liên tục.
+
+    python benchmarks/bench_engine.py --jobs 4 --size-mb 16 --out bench.json
+    python benchmarks/bench_engine.py --baseline bench.json          # so với lần trước, exit 1 nếu chậm hơn ngưỡng
+    python benchmarks/bench_engine.py --only ui_queue history --profile engine.prof
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+# benchmarks/ trong sys.path để yt-dlp nạp extractor giả trong yt_dlp_plugins/ (hustbench://)
+if BENCH_DIR not in sys.path: sys.path.insert(0, BENCH_DIR)
+
+from engine import DownloadEngine, DEFAULT_SETTINGS, EventChannel, UIPump, HistoryStore, UI_MAX_FPS, HISTORY_PAGE_SIZE  # noqa: E402
+from benchmarks.media_server import MediaServer  # noqa: E402
+
+BENCH_FILE = "media.mp4"
+MIB = 1024 * 1024
+SECTIONS = ("analyze", "download", "ui_queue", "history", "memory")
+# Chỉ số chính để so với baseline: đường dẫn trong results -> True nếu lớn hơn là tốt
+HEADLINE = {
+    ("analyze", "cold_ms", "p50"): False,
+    ("analyze", "cached_ms", "p50"): False,
+    ("download", "ttfb_ms", "p50"): False,
+    ("download", "aggregate_mib_s"): True,
+    ("ui_queue", "progress_latency_ms", "p95"): False,
+    ("ui_queue", "put_cost_us"): False,
+    ("history", "first_page_ms"): False,
+    ("history", "search_ms"): False,
+    ("memory", "growth_per_round_kib"): False,
+}
+NOISE_FLOOR = 1.0  # Chênh lệch tuyệt đối nhỏ hơn mức này (ms, KiB...) không tính là chậm đi
+
+
+def stats(values, scale=1.0):
+    """n, p50, p95, max, mean (nhân scale, vd 1000 để ra ms)"""
+    if not values: return None
+    v = sorted(values)
+    pick = lambda q: v[min(len(v) - 1, int(q * len(v)))]
+    return {'n': len(v), 'p50': round(pick(0.5) * scale, 3), 'p95': round(pick(0.95) * scale, 3),
+            'max': round(v[-1] * scale, 3), 'mean': round(sum(v) / len(v) * scale, 3)}
+
+
+def bench_url(server, video_id):
+    return f"hustbench://127.0.0.1:{server._httpd.server_address[1]}/{BENCH_FILE}?id={video_id}"
+
+
+def make_engine(tmp, **settings):
+    # Không kiểm tra trùng / nhúng metadata: mỗi job đều tải thật, dữ liệu ngẫu nhiên không phải media hợp lệ
+    return DownloadEngine(dict(DEFAULT_SETTINGS, dup_policy="off", embed_metadata=False, **settings), data_dir=os.path.join(tmp, "data"))
+
+
+def run_jobs(engine, urls, save_path, timeout=300):
+    """Gửi job rồi thu mọi sự kiện kèm mốc thời gian tới khi các job (kể cả hậu kỳ) xong.
+    Trả ({job_id: mốc submit}, [(mốc nhận, sự kiện)])."""
+    wake = threading.Event()
+    engine.events.listener = wake.set
+    submitted = {}
+    for url in urls:
+        t = time.perf_counter()
+        submitted[engine.submit(url, None, False, save_path, "", resumable=False)] = t
+    pending = set(submitted)
+    events = []
+    deadline = time.perf_counter() + timeout
+    while True:
+        if time.perf_counter() > deadline: raise TimeoutError(f"{len(pending)} job chưa xong sau {timeout}s")
+        wake.wait(0.5)
+        wake.clear()
+        busy = engine.postproc.pending()
+        now = time.perf_counter()
+        for item in engine.events.drain():
+            events.append((now, item))
+            if item.get('type') == 'error': raise RuntimeError(item.get('msg'))
+            if item.get('type') == 'worker_done': pending.discard(item.get('job_id'))
+        if not pending and not busy and not engine.postproc.pending(): break
+    engine.events.listener = None
+    return submitted, events
+
+
+def clear_dir(path):
+    for name in os.listdir(path):
+        try: os.remove(os.path.join(path, name))
+        except OSError: pass
+
+
+def bench_analyze(server, tmp, runs):
+    """run_analyze lần đầu (extract qua extractor giả) và lần hai (trúng AnalyzeCache)"""
+    engine = make_engine(tmp)
+    q = EventChannel()
+    cold, cached = [], []
+    try:
+        for i in range(runs):
+            url = bench_url(server, f"a{i}")
+            t0 = time.perf_counter()
+            engine.run_analyze(url, q)
+            cold.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            engine.run_analyze(url, q)
+            cached.append(time.perf_counter() - t0)
+        errors = [e['msg'] for e in q.drain() if e.get('type') == 'error']
+        if errors: raise RuntimeError(errors[0])
+    finally:
+        engine.close()
+    # Lần đầu gồm cả import yt-dlp + tạo session, tách riêng để không làm lệch phân phối
+    return {'runs': runs, 'first_ms': round(cold[0] * 1000, 3), 'cold_ms': stats(cold[1:] or cold, 1000), 'cached_ms': stats(cached, 1000)}
+
+
+def bench_download(server, tmp, jobs, workers, size, turbo):
+    """TTFB (submit -> progress đầu tiên, gồm chờ hàng đợi + extract + kết nối) và thông lượng từng job / tổng"""
+    out_dir = os.path.join(tmp, "download")
+    os.makedirs(out_dir, exist_ok=True)
+    engine = make_engine(tmp, max_workers=workers, turbo=turbo > 0, turbo_connections=turbo or 4)
+    requests_before = server.requests
+    try:
+        t0 = time.perf_counter()
+        submitted, events = run_jobs(engine, [bench_url(server, f"d{i}") for i in range(jobs)], out_dir)
+        wall = time.perf_counter() - t0
+    finally:
+        engine.close()
+        clear_dir(out_dir)
+    first_progress, finished = {}, {}
+    for ts, item in events:
+        if item.get('type') == 'progress': first_progress.setdefault(item['job_id'], ts)
+        elif item.get('type') == 'finished': finished[item['job_id']] = ts
+    ttfb = [first_progress[j] - submitted[j] for j in first_progress]
+    rates = [size / max(finished[j] - first_progress[j], 1e-6) for j in finished if j in first_progress]
+    return {'jobs': jobs, 'workers': workers, 'size_bytes': size, 'turbo_connections': turbo, 'wall_s': round(wall, 3),
+            'ttfb_ms': stats(ttfb, 1000), 'job_throughput_mib_s': stats(rates, 1 / MIB),
+            'aggregate_mib_s': round(size * len(finished) / wall / MIB, 2), 'http_requests': server.requests - requests_before}
+
+
+def bench_ui_queue(seconds, producers, hook_rate):
+    """Mô phỏng progress_hook bắn dày từ nhiều job: độ trễ tới lúc UIPump xả, số lần xả/giây, chi phí put_progress"""
+    ch = EventChannel()
+    latency = {'progress': [], 'fresh': [], 'control': []}
+    flushes = [0]
+    tick_ts = [[] for _ in range(producers)]  # Mốc gọi hook của từng tick, theo job
+    shown = [-1] * producers                  # Tick cuối cùng UI đã hiển thị
+
+    def flush():
+        now = time.perf_counter()
+        flushes[0] += 1
+        for item in ch.drain():
+            if item['type'] != 'progress':
+                latency['control'].append(now - item['ts'])
+                continue
+            # Tick cũ nhất bị gộp vào lần xả này là tick phải chờ lâu nhất
+            job = item['job_id']
+            latency['progress'].append(now - tick_ts[job][shown[job] + 1])
+            latency['fresh'].append(now - item['ts'])
+            shown[job] = item['downloaded']
+
+    # Chi phí một lần gọi hook (không listener) -> phần worker phải trả cho mỗi tick
+    n = 100000
+    t0 = time.perf_counter()
+    for i in range(n): ch.put_progress((0, None), {'type': 'progress', 'ts': 0.0, 'downloaded': i})
+    put_cost = (time.perf_counter() - t0) / n
+    ch.drain()
+
+    pump = UIPump(flush)
+    ch.listener = pump.notify
+    sent = [0] * producers
+
+    def produce(job):
+        interval = 1.0 / hook_rate
+        t_next = time.perf_counter()
+        end = t_next + seconds
+        while time.perf_counter() < end:
+            tick_ts[job].append(time.perf_counter())
+            ch.put_progress((job, None), {'type': 'progress', 'job_id': job, 'ts': tick_ts[job][-1], 'downloaded': sent[job]})
+            sent[job] += 1
+            if sent[job] % 50 == 0: ch.put({'type': 'log', 'job_id': job, 'ts': time.perf_counter(), 'msg': "tick"})
+            t_next += interval
+            delay = t_next - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+
+    threads = [threading.Thread(target=produce, args=(j,)) for j in range(producers)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    time.sleep(3.0 / UI_MAX_FPS)  # Chờ pump xả nốt lô cuối
+    ch.listener = None
+    total = sum(sent) + sum(s // 50 for s in sent)
+    delivered = len(latency['progress']) + len(latency['control'])
+    # progress_latency: từ tick cũ nhất chưa hiển thị tới lúc UI xả; progress_fresh: tuổi của tick được hiển thị
+    return {'seconds': seconds, 'producers': producers, 'hook_rate_hz': hook_rate, 'max_fps': UI_MAX_FPS,
+            'events_put': total, 'events_delivered': delivered, 'coalesce_ratio': round(total / max(delivered, 1), 1),
+            'flushes_per_s': round(flushes[0] / elapsed, 2), 'put_cost_us': round(put_cost * 1e6, 3),
+            'progress_latency_ms': stats(latency['progress'], 1000), 'progress_fresh_ms': stats(latency['fresh'], 1000),
+            'control_latency_ms': stats(latency['control'], 1000)}
+
+
+def bench_history(tmp, n):
+    """Lịch sử N mục: ghi hàng loạt, đếm, trang đầu, trang cuối, tìm kiếm, lọc loại; dựng dòng Flet nếu có"""
+    store = HistoryStore(os.path.join(tmp, "history_bench.db"))
+    items = [{'title': f"Video {i} - bench", 'date': f"2024-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}",
+              'path': f"/storage/emulated/0/Download/video_{i}.mp4", 'type': 'audio' if i % 5 == 0 else 'video'} for i in range(n)]
+
+    def timed(fn, repeat=5):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        return round(best * 1000, 3), result
+
+    t0 = time.perf_counter()
+    store.add_many(items)
+    insert_ms = (time.perf_counter() - t0) * 1000
+    count_ms, _ = timed(lambda: store.count())
+    first_page_ms, page = timed(lambda: store.query())
+    last_page_ms, _ = timed(lambda: store.query(offset=max(0, n - HISTORY_PAGE_SIZE)))
+    search_ms, _ = timed(lambda: store.query("Video 12"))
+    filter_ms, _ = timed(lambda: store.query(media_type="audio"))
+    result = {'entries': n, 'page_size': HISTORY_PAGE_SIZE, 'insert_ms': round(insert_ms, 3), 'count_ms': count_ms,
+              'first_page_ms': first_page_ms, 'last_page_ms': last_page_ms, 'search_ms': search_ms, 'filter_ms': filter_ms}
+    try:
+        from main import make_history_row
+        result['build_rows_ms'], _ = timed(lambda: [make_history_row(item) for item in page])
+    except ImportError as e:
+        result['build_rows_ms'] = None
+        result['build_rows_skipped'] = f"Không có Flet: {e}"
+    return result
+
+
+def bench_memory(server, tmp, rounds):
+    """Nhiều vòng phân tích + tải liên tục trên cùng engine: bộ nhớ Python (tracemalloc) sau mỗi vòng"""
+    out_dir = os.path.join(tmp, "memory")
+    os.makedirs(out_dir, exist_ok=True)
+    engine = make_engine(tmp)
+    q = EventChannel()
+    samples = []
+    tracemalloc.start()
+    try:
+        for r in range(rounds):
+            url = bench_url(server, f"m{r}")
+            engine.run_analyze(url, q)
+            run_jobs(engine, [url], out_dir)
+            q.drain()
+            clear_dir(out_dir)
+            gc.collect()
+            samples.append(tracemalloc.get_traced_memory()[0])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        engine.close()
+    # Nửa đầu là giai đoạn làm nóng (session, cache...), độ tăng tính trên nửa sau
+    tail = samples[len(samples) // 2:]
+    growth = (tail[-1] - tail[0]) / max(len(tail) - 1, 1)
+    result = {'rounds': rounds, 'traced_first_kib': round(samples[0] / 1024, 1), 'traced_last_kib': round(samples[-1] / 1024, 1),
+              'traced_peak_kib': round(peak / 1024, 1), 'growth_per_round_kib': round(growth / 1024, 2)}
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['rss_max_mib'] = round(rss / (MIB if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    return result
+
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results: return None
+        results = results[key]
+    return results if isinstance(results, (int, float)) else None
+
+
+def compare(results, baseline, tolerance):
+    """Các chỉ số chính xấu đi quá tolerance (tỉ lệ) so với baseline"""
+    regressions = []
+    for path, higher_is_better in HEADLINE.items():
+        now, before = lookup(results, path), lookup(baseline, path)
+        if now is None or before is None or abs(now - before) < NOISE_FLOOR: continue
+        worse = now < before * (1 - tolerance) if higher_is_better else now > before * (1 + tolerance)
+        if worse: regressions.append({'metric': ".".join(path), 'baseline': before, 'current': now})
+    return regressions
+
+
+def run_suite(args, tmp):
+    sections = args.only or SECTIONS
+    results = {}
+    size = int(args.size_mb * MIB)
+    with MediaServer({BENCH_FILE: size}, per_conn_bps=args.per_conn_kbps * 1024) as server:
+        if "analyze" in sections: results['analyze'] = bench_analyze(server, tmp, args.analyze_runs)
+        if "download" in sections: results['download'] = bench_download(server, tmp, args.jobs, args.workers, size, args.turbo)
+        if "ui_queue" in sections: results['ui_queue'] = bench_ui_queue(args.ui_seconds, args.jobs, args.hook_rate)
+        if "history" in sections: results['history'] = bench_history(tmp, args.history)
+        if "memory" in sections: results['memory'] = bench_memory(server, tmp, args.memory_rounds)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--only", nargs="+", choices=SECTIONS, help="chỉ chạy các phần này")
+    ap.add_argument("--size-mb", type=float, default=8, help="dung lượng file media giả lập")
+    ap.add_argument("--per-conn-kbps", type=int, default=0, help="giới hạn KiB/s mỗi kết nối của server (0 = không giới hạn)")
+    ap.add_argument("--jobs", type=int, default=4, help="số job tải / số nguồn progress giả lập")
+    ap.add_argument("--workers", type=int, default=DEFAULT_SETTINGS["max_workers"], help="số job tải song song")
+    ap.add_argument("--turbo", type=int, default=0, metavar="N", help="bật Turbo N kết nối cho phần download")
+    ap.add_argument("--analyze-runs", type=int, default=20)
+    ap.add_argument("--ui-seconds", type=float, default=3.0)
+    ap.add_argument("--hook-rate", type=int, default=200, help="số tick progress_hook mỗi giây của mỗi job")
+    ap.add_argument("--history", type=int, default=20000, help="số mục lịch sử")
+    ap.add_argument("--memory-rounds", type=int, default=30)
+    ap.add_argument("--out", help="ghi kết quả JSON ra file")
+    ap.add_argument("--baseline", help="file JSON của lần chạy trước để phát hiện chậm đi")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="mức xấu đi cho phép so với baseline (0.25 = 25%%)")
+    ap.add_argument("--profile", metavar="FILE", help="chạy dưới cProfile (thread chính), lưu stats ra FILE và in top hàm ra stderr")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="hust_bench_")
+    try:
+        if args.profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            results = profiler.runcall(run_suite, args, tmp)
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+        else:
+            results = run_suite(args, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    try:
+        import yt_dlp
+        ytdlp_version = yt_dlp.version.__version__
+    except ImportError:
+        ytdlp_version = None
+    report = {'benchmark': 'engine', 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'env': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'yt_dlp': ytdlp_version},
+              'params': {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "profile")}, 'results': results}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report['regressions'] = compare(results, json.load(f).get('results') or {}, args.tolerance)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
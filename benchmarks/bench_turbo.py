@@ -0,0 +1,77 @@
+"""So sánh thông lượng: tải 1 luồng (đường tải hiện tại) và chế độ Turbo nhiều kết nối,
+trên server cục bộ có giới hạn băng thông mỗi kết nối. Kết quả in ra dạng JSON.
+
+    python benchmarks/bench_turbo.py --size-mb 32 --per-conn-kbps 2048 --connections 1 4 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from turbo import segmented_download  # noqa: E402
+from benchmarks.media_server import MediaServer  # noqa: E402
+
+
+def single_stream(url, dest):
+    """Một kết nối đọc tuần tự như HttpFD mặc định của yt-dlp"""
+    with urllib.request.urlopen(url, timeout=30) as resp, open(dest, "wb") as f:
+        while True:
+            buf = resp.read(256 * 1024)
+            if not buf: break
+            f.write(buf)
+
+
+def yt_dlp_stream(url, dest):
+    import yt_dlp
+    opts = {'outtmpl': dest, 'quiet': True, 'no_warnings': True, 'retries': 10, 'fragment_retries': 10}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.download([url])
+
+
+def measure(name, fn, size, runs):
+    times = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp, "out.mp4")
+            t0 = time.perf_counter()
+            fn(dest)
+            times.append(time.perf_counter() - t0)
+            assert os.path.getsize(dest) == size, f"{name}: sai dung lượng"
+    best = min(times)
+    return {'name': name, 'runs': runs, 'best_s': round(best, 3), 'mean_s': round(sum(times) / len(times), 3),
+            'throughput_mib_s': round(size / best / 1024 / 1024, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--size-mb", type=int, default=32)
+    ap.add_argument("--per-conn-kbps", type=int, default=2048, help="Giới hạn KiB/s mỗi kết nối (0 = không giới hạn)")
+    ap.add_argument("--connections", type=int, nargs="+", default=[4, 8])
+    ap.add_argument("--runs", type=int, default=1)
+    args = ap.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    results = []
+    with MediaServer({"video.mp4": size}, per_conn_bps=args.per_conn_kbps * 1024) as server:
+        url = server.url("video.mp4")
+        results.append(measure("single_stream", lambda d: single_stream(url, d), size, args.runs))
+        try:
+            import yt_dlp  # noqa: F401
+            results.append(measure("yt_dlp_default", lambda d: yt_dlp_stream(url, d), size, args.runs))
+        except ImportError:
+            pass
+        for n in args.connections:
+            results.append(measure(f"turbo_{n}", lambda d, n=n: segmented_download(url, d, n, min_size=0), size, args.runs))
+
+    base = results[0]['best_s']
+    for r in results: r['speedup'] = round(base / r['best_s'], 2)
+    print(json.dumps({'benchmark': 'turbo', 'size_bytes': size, 'per_conn_kbps': args.per_conn_kbps, 'results': results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
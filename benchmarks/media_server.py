@@ -0,0 +1,91 @@
+"""HTTP server cục bộ phục vụ media giả lập (dữ liệu sinh sẵn) cho benchmark.
+Hỗ trợ Range/206 và giới hạn băng thông theo từng kết nối để mô phỏng CDN thực tế."""
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MediaServer:
+    """Chạy server trên 127.0.0.1 (cổng ngẫu nhiên) trong thread nền.
+    files: {tên: số byte}; per_conn_bps: giới hạn byte/giây mỗi kết nối (0 = không giới hạn)."""
+
+    def __init__(self, files=None, per_conn_bps=0, chunk=64 * 1024):
+        self.files = {name: os.urandom(min(size, 1024 * 1024)) * (size // min(size, 1024 * 1024) + 1)
+                      for name, size in (files or {"video.mp4": 32 * 1024 * 1024}).items()}
+        self.sizes = dict(files or {"video.mp4": 32 * 1024 * 1024})
+        self.per_conn_bps = per_conn_bps
+        self.chunk = chunk
+        self.requests = 0
+        self.first_byte_times = []
+        self._httpd = None
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/{name}"
+
+    def __enter__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _range(self, size):
+                header = self.headers.get("Range")
+                if not header or not header.startswith("bytes="):
+                    return None
+                start, _, end = header[6:].partition("-")
+                start = int(start or 0)
+                end = min(int(end) if end else size - 1, size - 1)
+                return start, end
+
+            def do_HEAD(self):
+                self._serve(head=True)
+
+            def do_GET(self):
+                self._serve(head=False)
+
+            def _serve(self, head):
+                server.requests += 1
+                name = self.path.lstrip("/").split("?")[0]
+                if name not in server.sizes:
+                    self.send_error(404); return
+                size = server.sizes[name]
+                rng = self._range(size)
+                start, end = rng if rng else (0, size - 1)
+                self.send_response(206 if rng else 200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                if rng:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                if head: return
+                data = server.files[name]
+                pos = start
+                t0 = time.monotonic()
+                sent = 0
+                try:
+                    while pos <= end:
+                        n = min(server.chunk, end - pos + 1)
+                        self.wfile.write(data[pos:pos + n])
+                        if sent == 0: server.first_byte_times.append(time.monotonic())
+                        pos += n
+                        sent += n
+                        if server.per_conn_bps:
+                            # Ngủ cho đủ thời gian tương ứng băng thông giới hạn của kết nối này
+                            ahead = sent / server.per_conn_bps - (time.monotonic() - t0)
+                            if ahead > 0: time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,19 @@
+"""Extractor giả cho benchmark: hustbench://<host:port>/<file>?id=<video_id> -> format MP4 progressive trên MediaServer.
+yt-dlp tự nạp plugin này khi thư mục benchmarks/ nằm trong sys.path (chạy script trong benchmarks/), app thường không thấy."""
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.networking import HEADRequest
+
+
+class HustBenchIE(InfoExtractor):
+    IE_NAME = 'hustbench'
+    _VALID_URL = r'hustbench://(?P<host>[^/]+)/(?P<file>[^/?#]+)\?id=(?P<id>\w+)'
+
+    def _real_extract(self, url):
+        host, name, video_id = self._match_valid_url(url).group('host', 'file', 'id')
+        media_url = f"http://{host}/{name}?id={video_id}"
+        # Một round-trip như extractor thật phải gọi API trước khi có link format
+        resp = self._request_webpage(HEADRequest(media_url), video_id, note=False)
+        size = int(resp.headers.get('Content-Length') or 0)
+        formats = [{'format_id': f"{h}p", 'url': media_url, 'ext': 'mp4', 'protocol': 'http', 'height': h, 'width': h * 16 // 9,
+                    'vcodec': 'avc1.4d401f', 'acodec': 'mp4a.40.2', 'filesize': size, 'fps': 30} for h in (360, 720)]
+        return {'id': video_id, 'title': f"Bench {video_id}", 'duration': 60, 'uploader': 'hustbench', 'formats': formats}
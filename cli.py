@@ -0,0 +1,157 @@
+"""Chế độ dòng lệnh, chạy cùng lõi tải với UI (engine.DownloadEngine), in sự kiện ra stdout dạng JSON lines.
+    python main.py --batch urls.txt --jobs N --format ...   tải một danh sách link rồi thoát
+    python main.py --serve --port 8765 --token ...           chạy API điều khiển (api.py) tới khi Ctrl+C"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from engine import DownloadEngine, DEFAULT_SETTINGS
+
+BATCH_PROGRESS_INTERVAL = 0.5  # Giây, tick progress gộp lại giữa hai lần in
+
+
+def read_urls(path):
+    """Đọc danh sách link (mỗi dòng một link, bỏ dòng trống và dòng bắt đầu bằng #); '-' = stdin"""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    finally:
+        if f is not sys.stdin: f.close()
+
+
+def add_engine_args(ap):
+    """Các option cấu hình engine dùng chung cho --batch và --serve"""
+    ap.add_argument("--jobs", type=int, default=DEFAULT_SETTINGS["max_workers"], help="số job tải song song")
+    ap.add_argument("--out", default=".", help="thư mục lưu")
+    ap.add_argument("--scratch", metavar="DIR", default="", help="thư mục tạm nhanh: tải + hậu kỳ ở đó rồi chuyển một lần sang --out")
+    ap.add_argument("--cookies", metavar="FILE", help="file cookies.txt (Netscape format)")
+    ap.add_argument("--turbo", type=int, default=0, metavar="N", help="bật Turbo với N kết nối (0 = tắt)")
+    ap.add_argument("--limit", type=int, default=0, metavar="KBPS", help="giới hạn băng thông tổng (KiB/s, 0 = không giới hạn)")
+    ap.add_argument("--max-height", type=int, default=0, metavar="H", help="độ phân giải tối đa khi tự chọn format (0 = không giới hạn)")
+    ap.add_argument("--size-budget", type=int, default=0, metavar="MB", help="dung lượng tối đa mỗi video khi tự chọn format")
+    ap.add_argument("--codec", choices=("auto", "h264", "vp9", "av1", "hevc"), default="auto", help="codec ưu tiên khi tự chọn format")
+    ap.add_argument("--dup", choices=("skip", "link", "off"), default=DEFAULT_SETTINGS["dup_policy"], help="xử lý video đã tải trước đó")
+    ap.add_argument("--data-dir", help="thư mục dữ liệu (lịch sử, chỉ mục...), mặc định dùng chung với app")
+    ap.add_argument("--no-embed", action="store_true", help="không nhúng metadata/ảnh bìa vào file")
+    ap.add_argument("--verbose", action="store_true", help="in cả log chi tiết của yt-dlp")
+
+
+def parse_args(argv):
+    ap = argparse.ArgumentParser(prog="main.py --batch", description="Tải hàng loạt không cần giao diện, tiến độ in ra dạng JSON lines")
+    ap.add_argument("--batch", metavar="FILE", required=True, help="file danh sách link ('-' để đọc từ stdin)")
+    ap.add_argument("--format", default="best", help="best (tự chọn theo --max-height/--size-budget/--codec) | audio (m4a) | mp3 | format_id của yt-dlp")
+    ap.add_argument("--playlist", action="store_true", help="tải toàn bộ playlist nếu link là playlist")
+    ap.add_argument("--metrics", metavar="FILE", help="ghi số đo từng job ra FILE khi xong (.json hoặc .csv)")
+    add_engine_args(ap)
+    return ap.parse_args(argv)
+
+
+def out(item):
+    print(json.dumps(item, ensure_ascii=False, default=str), flush=True)
+
+
+def build_engine(args):
+    settings = dict(DEFAULT_SETTINGS, max_workers=max(1, args.jobs), turbo=args.turbo > 0, turbo_connections=args.turbo or 4,
+                    bw_limit_kbps=max(0, args.limit), dup_policy=args.dup, verbose_log=args.verbose,
+                    fmt_max_height=max(0, args.max_height), fmt_size_budget_mb=max(0, args.size_budget), fmt_codec=args.codec,
+                    embed_metadata=not args.no_embed, scratch_dir=args.scratch)
+    if args.cookies:
+        with open(args.cookies, encoding="utf-8") as f: settings['cookies'] = f.read()
+    return DownloadEngine(settings, data_dir=args.data_dir)
+
+
+def batch_main(argv):
+    args = parse_args(argv)
+    try:
+        urls = read_urls(args.batch)
+        engine = build_engine(args)
+    except OSError as e:
+        out({'type': 'error', 'msg': str(e)})
+        return 2
+    settings, cookies = engine.settings, engine.settings['cookies']
+    wake = threading.Event()
+    engine.events.listener = wake.set
+    engine.log_store.listener = wake.set
+
+    # Không ghi journal: chạy lại cùng lệnh là tải tiếp (file .part + bỏ qua video đã có)
+    jobs = {engine.submit(url, args.format, args.playlist, args.out, cookies, resumable=False): url for url in urls}
+    pending = set(jobs)
+    counts = {'finished': 0, 'duplicate': 0, 'error': 0, 'cancelled': 0}
+    log_seq = 0
+    last = 0.0
+    cancelling = False
+    out({'type': 'batch_start', 'jobs': len(jobs), 'workers': settings['max_workers']})
+    while True:
+        try:
+            wake.wait(1.0)
+            busy = engine.postproc.pending()
+            delay = BATCH_PROGRESS_INTERVAL - (time.monotonic() - last)
+            if delay > 0: time.sleep(delay)
+            wake.clear()
+            last = time.monotonic()
+            for item in engine.events.drain():
+                t = item.get('type')
+                job_id = item.get('job_id')
+                if job_id in jobs: item.setdefault('url', jobs[job_id])
+                if t == 'log':
+                    item.setdefault('level', "INFO")
+                elif t == 'finished':
+                    counts['duplicate' if item.get('duplicate') else 'finished'] += 1
+                elif t in ('error', 'cancelled'):
+                    counts[t] += 1
+                elif t == 'worker_done':
+                    pending.discard(job_id)
+                out(item)
+            if args.verbose:
+                records, log_seq = engine.log_store.since(log_seq)
+                for rec in records:
+                    out({'type': 'ydl_log', 'job_id': rec['job_id'], 'level': rec['level'], 'msg': rec['msg'], 'ts': rec['ts']})
+            # Job tải xong vẫn có thể còn file đang ghép/nhúng trên pool hậu kỳ: chỉ thoát khi pool rảnh
+            # cả trước lẫn sau lần xả này (sự kiện cuối của hậu kỳ đã được in)
+            if not pending and not busy and not engine.postproc.pending(): break
+        except KeyboardInterrupt:
+            # Ctrl+C lần đầu: hủy tất cả rồi chờ các job dừng hẳn; lần hai: thoát ngay
+            if cancelling: break
+            cancelling = True
+            out({'type': 'log', 'level': "WARN", 'msg': "Đang hủy tất cả job..."})
+            engine.scheduler.cancel_all()
+            engine.postproc.shutdown()
+    engine.ydl_pool.close_all()
+    if args.metrics:
+        try: out({'type': 'metrics', 'path': engine.metrics.export(args.metrics), 'sites': engine.metrics.by_site()})
+        except OSError as e: out({'type': 'log', 'level': "WARN", 'msg': f"Không ghi được số đo: {e}"})
+    out(dict(counts, type='batch_done', total=len(jobs)))
+    return 0 if not counts['error'] and not counts['cancelled'] else 1
+
+
+def serve_main(argv):
+    from api import ControlServer, API_DEFAULT_PORT
+    ap = argparse.ArgumentParser(prog="main.py --serve", description="Chạy API điều khiển (HTTP + SSE) không cần giao diện")
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--host", default="127.0.0.1", help="0.0.0.0 để máy khác trong LAN truy cập")
+    ap.add_argument("--port", type=int, default=API_DEFAULT_PORT)
+    ap.add_argument("--token", default=None, help="token truy cập (mặc định tự sinh)")
+    add_engine_args(ap)
+    args = ap.parse_args(argv)
+    token = args.token or uuid.uuid4().hex
+    try:
+        engine = build_engine(args)
+        server = ControlServer(engine, args.host, args.port, token, args.out).start()
+    except OSError as e:
+        out({'type': 'error', 'msg': str(e)})
+        return 2
+    wake = threading.Event()
+    engine.events.listener = wake.set
+    out({'type': 'serve_start', 'url': server.url, 'token': token})
+    try:
+        while True:
+            wake.wait()
+            time.sleep(BATCH_PROGRESS_INTERVAL)
+            wake.clear()
+            for item in engine.events.drain(): out(item)
+    except KeyboardInterrupt:
+        engine.close()
+        server.stop()
+    return 0
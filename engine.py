@@ -0,0 +1,1768 @@
+"""Lõi tải của HUST Downloader: phân tích link, chọn format, tải, đổi tên, lịch sử.
+Không phụ thuộc Flet, dùng chung cho UI (main.py) và chế độ dòng lệnh (--batch)."""
+import os
+import threading
+import time
+import tempfile
+import shutil
+import re
+import json
+import heapq
+import hashlib
+import uuid
+import sqlite3
+import itertools
+import traceback
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from turbo import segmented_download, discard_partial, read_range, TurboUnsupported
+from formats import FormatPolicy, FormatPolicyStore, rank_formats, build_options, best_audio, has_video
+from postprocess import PostProcessor, PostTask, media_meta, format_timings
+from metrics import MetricsStore
+from storage import prepare_save_path, forget_writable, scratch_for, expected_size, ensure_space, NotEnoughSpace, YDL_BUFFER_SIZE
+
+# --- CẤU HÌNH ---
+PLAYLIST_WORKERS = 3   # Số video trong playlist tải song song
+PLAYLIST_RETRIES = 2   # Số lần thử lại mỗi video lỗi trong playlist
+ANALYZE_CACHE_TTL = 1800     # Giây, link video (format URL) thường hết hạn sau vài giờ
+ANALYZE_CACHE_SIZE = 100
+TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid", "igshid", "pp"}
+SESSION_IDLE_PER_KEY = 3     # Số YoutubeDL rảnh giữ lại cho mỗi bộ option (>= PLAYLIST_WORKERS)
+SESSION_IDLE_TOTAL = 8
+SESSION_IDLE_TTL = 600       # Giây, đóng session rảnh quá lâu
+LOG_CAPACITY = 2000          # Số bản ghi log giữ trong RAM (bộ đệm vòng)
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 2
+HISTORY_PAGE_SIZE = 50       # Số dòng lịch sử mỗi trang truy vấn
+HISTORY_FTS_MIN = 3          # Chỉ mục trigram chỉ tìm được chuỗi từ 3 ký tự, ngắn hơn thì quét bằng LIKE
+JOURNAL_CHECKPOINT_SEC = 5   # Khoảng ghi checkpoint tiến độ vào journal
+BW_BURST_SEC = 0.5           # Lượng "tín dụng" tối đa mỗi job được tải vượt (tính theo giây băng thông)
+BW_ACTIVE_SEC = 2.0          # Job nhận dữ liệu trong khoảng này mới được tính khi chia băng thông
+GATE_RECHECK_SEC = 30        # Chu kỳ kiểm tra lại chính sách (Wi-Fi / khung giờ) cho job đang chờ
+UI_MAX_FPS = 10              # Số lần cập nhật UI tối đa mỗi giây
+PREFETCH_MAX_ACTIVE = 2      # Số link phân tích trước (clipboard) chạy cùng lúc, thêm nữa thì chỉ giữ link mới nhất chờ
+PREFETCH_REMEMBER = 100      # Số link đã phân tích trước được nhớ để không làm lại
+PREFETCH_WAIT = 60           # Giây, bấm Phân tích khi link đang được phân tích trước thì chờ tối đa chừng này
+# Option mạng/extract chung cho phân tích và tải: giống nhau thì hai bên dùng chung session trong pool
+YDL_NET_OPTS = {
+    'quiet': True, 'no_warnings': True, 'nocheckcertificate': True, 'socket_timeout': 30,
+    'http_headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+}
+ANALYZE_OPTS = dict(YDL_NET_OPTS, extract_flat=True)
+# Chỉ các option này quyết định khóa session (cookie tính riêng), còn lại (format, outtmpl...) gắn theo từng lần mượn
+SESSION_OPTS = ('quiet', 'no_warnings', 'verbose', 'nocheckcertificate', 'socket_timeout', 'http_headers', 'proxy', 'source_address')
+
+# --- HELPER FUNCTIONS ---
+
+def format_bytes(n):
+    """Đổi số byte sang chuỗi dễ đọc (KiB, MiB...)"""
+    if n is None: return "?"
+    n = float(n)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024 or unit == "GiB": break
+        n /= 1024.0
+    return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} B"
+
+def progress_event(d):
+    """Rút gọn dict progress của yt-dlp thành các số UI cần (không parse chuỗi đã format)"""
+    return {
+        'downloaded': d.get('downloaded_bytes') or 0,
+        'total': d.get('total_bytes') or d.get('total_bytes_estimate'),
+        'speed': d.get('speed'),
+        'eta': d.get('eta'),
+        'frag': d.get('fragment_index'),
+        'frag_count': d.get('fragment_count'),
+    }
+
+def progress_fraction(ev):
+    """Tỉ lệ hoàn thành 0..1 từ progress event (theo byte, nếu không có thì theo fragment)"""
+    if ev.get('total'):
+        return min(1.0, ev['downloaded'] / ev['total'])
+    if ev.get('frag') and ev.get('frag_count'):
+        return min(1.0, ev['frag'] / ev['frag_count'])
+    return None
+
+def slugify_and_truncate(name: str, max_length: int = 100):
+    """Làm sạch tên file để tránh lỗi hệ thống Android"""
+    if not name: return "file"
+    # Chuẩn hóa Unicode
+    name = unicodedata.normalize("NFKD", name)
+    # Loại bỏ ký tự đặc biệt, chỉ giữ lại chữ, số, gạch ngang, chấm
+    name = re.sub(r'[^\w\s\.-]', '', name).strip()
+    name = re.sub(r'\s+', ' ', name)
+    
+    if len(name) <= max_length: return name
+    
+    # Cắt ngắn nhưng giữ đuôi file
+    parts = os.path.splitext(name)
+    base = parts[0][: max_length - len(parts[1]) - 1]
+    return base + parts[1]
+
+def safe_rename_downloaded_file(filepath: str, max_title_len: int = 80):
+    """Đổi tên file sau khi tải về để đảm bảo an toàn"""
+    try:
+        if not filepath or not os.path.exists(filepath): return filepath
+        folder, fname = os.path.split(filepath)
+        title, ext = os.path.splitext(fname)
+        
+        # Thử tách phần ID phía sau (thường yt-dlp thêm ID vào cuối)
+        parts = title.rsplit('-', 1)
+        if len(parts) == 2 and len(parts[1]) <= 20 and all(c.isalnum() for c in parts[1]):
+            base, idpart = parts
+            new_base = slugify_and_truncate(base, max_length=max_title_len)
+            new_name = f"{new_base}-{idpart}{ext}"
+        else:
+            new_base = slugify_and_truncate(title, max_length=max_title_len)
+            new_name = f"{new_base}{ext}"
+            
+        # Tránh ghi đè file cũ (thêm số _1, _2...), đọc danh sách thư mục một lần thay vì hỏi từng tên
+        existing = set(os.listdir(folder or "."))
+        existing.discard(fname)
+        i = 1
+        candidate_name = new_name
+        while candidate_name in existing:
+            candidate_name = f"{os.path.splitext(new_name)[0]}_{i}{ext}"
+            i += 1
+        candidate = os.path.join(folder, candidate_name)
+            
+        if candidate != filepath:
+            os.rename(filepath, candidate)
+            return candidate
+        return filepath
+    except:
+        return filepath
+
+def app_data_dir():
+    """Thư mục lưu dữ liệu riêng của app (cache, journal...)"""
+    path = os.getenv("FLET_APP_STORAGE_DATA") or os.path.join(os.path.expanduser("~"), ".hust_downloader")
+    try:
+        os.makedirs(path, exist_ok=True)
+        return path
+    except:
+        return tempfile.gettempdir()
+
+URL_IN_TEXT = re.compile(r"https?://[^\s<>\"']+")
+
+def find_url(text):
+    """Link đầu tiên trong đoạn text (clipboard thường có cả tiêu đề + link khi chia sẻ từ app)"""
+    m = URL_IN_TEXT.search(text or "")
+    return m.group(0).rstrip(".,;)") if m else None
+
+_SITE_EXTRACTORS = None
+
+def is_supported_url(url):
+    """Có extractor riêng của yt-dlp nhận link này không (không tính Generic, vốn nhận mọi link).
+    Lần gọi đầu phải dựng regex của ~1800 extractor (vài trăm ms) nên chỉ gọi trên thread nền."""
+    global _SITE_EXTRACTORS
+    if _SITE_EXTRACTORS is None:
+        from yt_dlp.extractor import gen_extractor_classes
+        _SITE_EXTRACTORS = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+    return any(ie.suitable(url) for ie in _SITE_EXTRACTORS)
+
+def normalize_url(url: str):
+    """Chuẩn hóa URL làm khóa cache (bỏ fragment, tham số tracking, tiền tố www./m.)"""
+    url = (url or "").strip()
+    try:
+        parts = urlsplit(url)
+    except:
+        return url
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix): host = host[len(prefix):]
+    path = parts.path.rstrip("/") or "/"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.startswith("utm_") and k not in TRACKING_PARAMS]
+    # youtu.be/ID và youtube.com/watch?v=ID là cùng một video
+    if host == "youtu.be" and path != "/":
+        host, path, query = "youtube.com", "/watch", [("v", path.strip("/"))] + query
+    return urlunsplit(((parts.scheme or "https").lower(), host, path, urlencode(sorted(query)), ""))
+
+def cookie_digest(cookie_content):
+    """Mã băm nội dung cookie (chuỗi rỗng nếu không có cookie) dùng làm khóa"""
+    cookie_content = (cookie_content or "").strip()
+    return hashlib.sha1(cookie_content.encode("utf-8")).hexdigest() if cookie_content else ""
+
+class AnalyzeCache:
+    """Cache kết quả phân tích theo URL chuẩn hóa (RAM + file JSON), có TTL và loại bỏ LRU.
+    Info dict đầy đủ của yt-dlp chỉ giữ trong RAM (lớn) để run_download dùng lại,
+    kèm mã cookie lúc phân tích: job dùng cookie khác thì không dùng lại info đó."""
+    MAX_INFOS = 10
+
+    def __init__(self, path=None, max_entries: int = ANALYZE_CACHE_SIZE, ttl: int = ANALYZE_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> {'ts', 'result'}
+        self._infos = OrderedDict()  # key -> (cookie_digest, info dict)
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path): return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, entry in data:
+                if now - entry.get('ts', 0) < self.ttl: self._items[key] = entry
+        except:
+            self._items.clear()
+
+    def _save_locked(self):
+        if not self.path: return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(list(self._items.items()), f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except:
+            pass
+
+    def _fresh_locked(self, key):
+        entry = self._items.get(key)
+        if not entry: return None
+        if time.time() - entry['ts'] > self.ttl:
+            self._items.pop(key, None); self._infos.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return entry
+
+    def get(self, url):
+        with self._lock:
+            entry = self._fresh_locked(normalize_url(url))
+            return entry['result'] if entry else None
+
+    def get_info(self, url, cookie_content=""):
+        key = normalize_url(url)
+        with self._lock:
+            if not self._fresh_locked(key): return None
+            cookies, info = self._infos.get(key, (None, None))
+            return info if cookies == cookie_digest(cookie_content) else None
+
+    def put(self, url, result, info=None, cookie_content=""):
+        key = normalize_url(url)
+        with self._lock:
+            self._items[key] = {'ts': time.time(), 'result': result}
+            self._items.move_to_end(key)
+            self._infos.pop(key, None)
+            if info is not None: self._infos[key] = (cookie_digest(cookie_content), info)
+            while len(self._items) > self.max_entries:
+                old, _ = self._items.popitem(last=False)
+                self._infos.pop(old, None)
+            while len(self._infos) > self.MAX_INFOS:
+                self._infos.popitem(last=False)
+            self._save_locked()
+
+class AnalyzePrefetcher:
+    """Phân tích trước link (vd bắt từ clipboard) trên thread nền để lúc bấm Phân tích kết quả đã nằm trong AnalyzeCache.
+    Mỗi link (theo URL chuẩn hóa) chỉ làm một lần; tối đa max_active lượt cùng lúc, đầy thì chỉ giữ link mới nhất chờ.
+    listener(url, result) được gọi khi có kết quả (không đi qua EventChannel: link trong clipboard không phát ra API)."""
+    def __init__(self, analyze, max_active: int = PREFETCH_MAX_ACTIVE, remember: int = PREFETCH_REMEMBER):
+        self.analyze = analyze  # analyze(url) -> result hoặc None, chạy trên thread của prefetcher
+        self.listener = None
+        self.max_active = max_active
+        self.remember = remember
+        self._lock = threading.Lock()
+        self._active = {}             # key -> Event, set khi xong
+        self._seen = OrderedDict()
+        self._waiting = None          # link chờ chỗ trống
+
+    def submit(self, url):
+        """Đưa link vào phân tích trước; False nếu đã làm / đang làm"""
+        key = normalize_url(url)
+        with self._lock:
+            if key in self._seen: return False
+            self._seen[key] = True
+            while len(self._seen) > self.remember: self._seen.popitem(last=False)
+            if len(self._active) >= self.max_active:
+                # Link chờ cũ bị thay: bỏ khỏi danh sách đã thấy để lần sau chép lại vẫn được làm
+                if self._waiting: self._seen.pop(normalize_url(self._waiting), None)
+                self._waiting = url
+                return True
+            self._start_locked(url, key)
+        return True
+
+    def _start_locked(self, url, key):
+        self._active[key] = threading.Event()
+        threading.Thread(target=self._run, args=(url, key), daemon=True).start()
+
+    def _run(self, url, key):
+        try:
+            result = self.analyze(url)
+            if result is not None and self.listener: self.listener(url, result)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._active.pop(key).set()
+                if self._waiting and len(self._active) < self.max_active:
+                    url, self._waiting = self._waiting, None
+                    self._start_locked(url, normalize_url(url))
+
+    def wait(self, url, timeout=PREFETCH_WAIT):
+        """Chờ lượt phân tích trước của link (nếu đang chạy) xong"""
+        with self._lock: evt = self._active.get(normalize_url(url))
+        if evt: evt.wait(timeout)
+
+    def forget(self, url):
+        with self._lock: self._seen.pop(normalize_url(url), None)
+
+class YDLSessionPool:
+    """Giữ các YoutubeDL 'ấm' theo cookie + option mạng (SESSION_OPTS) để dùng lại
+    extractor đã khởi tạo, cookie đã parse và kết nối HTTP đã mở giữa các lần gọi.
+    Option riêng của job (format, outtmpl, noplaylist...) được gắn vào ydl.params khi mượn và gỡ khi trả.
+    Mỗi instance chỉ được một thread dùng tại một thời điểm (acquire/release)."""
+
+    def __init__(self, idle_per_key: int = SESSION_IDLE_PER_KEY, idle_total: int = SESSION_IDLE_TOTAL, idle_ttl: int = SESSION_IDLE_TTL):
+        self.idle_per_key = idle_per_key
+        self.idle_total = idle_total
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()  # (key, id) -> (ydl, thời điểm trả về)
+        self._meta = {}             # id(ydl) -> {'slot', 'cookie_file', 'params', 'selector'}
+
+    @staticmethod
+    def make_key(opts, cookie_content=""):
+        net = {k: opts[k] for k in SESSION_OPTS if k in opts}
+        return cookie_digest(cookie_content) + "|" + json.dumps(net, sort_keys=True, default=str)
+
+    def _create(self, opts, cookie_content):
+        import yt_dlp
+        opts = {k: opts[k] for k in SESSION_OPTS if k in opts}
+        cookie_file = None
+        if cookie_content:
+            tf = tempfile.NamedTemporaryFile(mode="w", delete=False, prefix="hust_", suffix=".txt")
+            tf.write(cookie_content)
+            tf.flush(); tf.close()
+            cookie_file = tf.name
+            opts['cookiefile'] = cookie_file
+        ydl = yt_dlp.YoutubeDL(opts)
+        # Hook cố định chuyển tiếp tới hook của job đang mượn instance
+        slot = {'hook': None}
+        def dispatch(d):
+            if slot['hook']: slot['hook'](d)
+        ydl.add_progress_hook(dispatch)
+        # Params gốc (chưa gắn option của job nào) để trả instance về đúng trạng thái này
+        self._meta[id(ydl)] = {'slot': slot, 'cookie_file': cookie_file, 'params': dict(ydl.params), 'selector': ydl.format_selector}
+        return ydl
+
+    def _lend(self, ydl, opts, hook):
+        """Gắn hook + option riêng của job vào instance vừa mượn"""
+        meta = self._meta[id(ydl)]
+        meta['slot']['hook'] = hook
+        for k, v in opts.items():
+            if k in SESSION_OPTS: continue
+            if k == 'outtmpl' and not isinstance(v, dict): v = dict(meta['params']['outtmpl'], default=v)
+            ydl.params[k] = v
+        if opts.get('format'): ydl.format_selector = ydl.build_format_selector(opts['format'])
+
+    def _restore(self, ydl):
+        meta = self._meta.get(id(ydl))
+        if not meta: return
+        meta['slot']['hook'] = None
+        ydl.params.clear(); ydl.params.update(meta['params'])
+        ydl.format_selector = meta['selector']
+
+    def _close(self, ydl):
+        meta = self._meta.pop(id(ydl), None) or {}
+        try: ydl.close()
+        except: pass
+        cookie_file = meta.get('cookie_file')
+        if cookie_file and os.path.exists(cookie_file):
+            try: os.remove(cookie_file)
+            except: pass
+
+    def _sweep_locked(self, now):
+        expired = []
+        for k, (ydl, ts) in list(self._idle.items()):
+            if now - ts > self.idle_ttl:
+                expired.append(ydl); del self._idle[k]
+        while len(self._idle) > self.idle_total:
+            _, (ydl, _) = self._idle.popitem(last=False)
+            expired.append(ydl)
+        return expired
+
+    def acquire(self, opts, cookie_content=""):
+        cookie_content = (cookie_content or "").strip()
+        key = self.make_key(opts, cookie_content)
+        ydl = None
+        with self._lock:
+            expired = self._sweep_locked(time.time())
+            # Lấy instance rảnh dùng gần nhất (kết nối còn nóng)
+            for k in reversed(self._idle):
+                if k[0] == key:
+                    ydl, _ = self._idle.pop(k)
+                    break
+        for old in expired: self._close(old)
+        if ydl is None: ydl = self._create(opts, cookie_content)
+        return key, ydl
+
+    def release(self, key, ydl, reusable=True):
+        self._restore(ydl)
+        if not reusable:
+            self._close(ydl); return
+        with self._lock:
+            same = [k for k in self._idle if k[0] == key]
+            if len(same) >= self.idle_per_key:
+                self._close(ydl); return
+            self._idle[(key, id(ydl))] = (ydl, time.time())
+            expired = self._sweep_locked(time.time())
+        for old in expired: self._close(old)
+
+    @contextmanager
+    def session(self, opts, cookie_content="", hook=None):
+        key, ydl = self.acquire(opts, cookie_content)
+        reusable = True
+        try:
+            self._lend(ydl, opts, hook)
+            yield ydl
+        except BaseException:
+            # Instance vừa lỗi/bị hủy giữa chừng: không đưa lại vào pool
+            reusable = False
+            raise
+        finally:
+            self.release(key, ydl, reusable)
+
+    def close_all(self):
+        with self._lock:
+            items = list(self._idle.values()); self._idle.clear()
+        for ydl, _ in items: self._close(ydl)
+
+# --- EVENT CHANNEL ---
+
+class EventChannel:
+    """Kênh sự kiện worker -> UI, báo cho listener mỗi khi có dữ liệu mới.
+    - Control event (finished/error/cancelled/worker_done...) vào queue không giới hạn, không bao giờ bị bỏ.
+    - Progress được gộp theo khóa (job, entry): chỉ giữ tick mới nhất chưa hiển thị,
+      nên kênh luôn nhỏ dù yt-dlp bắn hook dày đặc.
+    - taps: các hàm nhận bản sao mọi sự kiện ngay khi phát sinh (vd API HTTP), không ảnh hưởng drain()."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._control = []
+        self._progress = {}
+        self._seq = itertools.count()
+        self.listener = None
+        self.taps = []
+
+    def put(self, item):
+        with self._lock:
+            self._control.append((next(self._seq), item))
+        for tap in self.taps: tap(item)
+        if self.listener: self.listener()
+
+    def put_progress(self, key, item):
+        with self._lock:
+            self._progress[key] = (next(self._seq), item)
+        for tap in self.taps: tap(item)
+        if self.listener: self.listener()
+
+    def drain(self):
+        """Lấy hết sự kiện đang chờ, theo đúng thứ tự phát sinh"""
+        with self._lock:
+            items = self._control + list(self._progress.values())
+            self._control = []
+            self._progress = {}
+        items.sort(key=lambda x: x[0])
+        return [item for _, item in items]
+
+class UIPump:
+    """Gom tín hiệu từ worker rồi gọi flush trên một thread riêng, tối đa max_fps lần/giây.
+    Không có sự kiện thì thread ngủ hẳn, không đánh thức CPU."""
+    def __init__(self, flush, max_fps: int = UI_MAX_FPS):
+        self._flush = flush
+        self._interval = 1.0 / max(1, max_fps)
+        self._event = threading.Event()
+        self._event.set()  # Xả các message đã có trước khi pump chạy
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def notify(self):
+        self._event.set()
+
+    def _loop(self):
+        last = 0.0
+        while True:
+            self._event.wait()
+            # Chờ hết khung hình hiện tại để gom các sự kiện đến dồn dập
+            delay = self._interval - (time.monotonic() - last)
+            if delay > 0: time.sleep(delay)
+            self._event.clear()
+            last = time.monotonic()
+            try:
+                self._flush()
+            except Exception:
+                traceback.print_exc()
+
+# --- BANDWIDTH ---
+
+def network_is_unmetered():
+    """Đoán đang dùng Wi-Fi/Ethernet qua /sys/class/net. None = không xác định được"""
+    try:
+        names = os.listdir("/sys/class/net")
+    except:
+        return None
+    found = False
+    for name in names:
+        if not name.startswith(("wlan", "wl", "eth", "en")): continue
+        found = True
+        try:
+            with open(f"/sys/class/net/{name}/operstate") as f:
+                if f.read().strip() == "up": return True
+        except:
+            return None
+    return False if found else None
+
+def in_time_window(start_hour: int, end_hour: int, now=None):
+    """Giờ hiện tại có nằm trong khung [start, end) không (hỗ trợ khung qua nửa đêm, vd 22-6)"""
+    hour = (now or datetime.now()).hour
+    if start_hour == end_hour: return True
+    if start_hour < end_hour: return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+class BandwidthScheduler:
+    """Giới hạn băng thông toàn cục (byte/s) chia đều cho các job đang tải.
+    Worker gọi consume() sau mỗi block dữ liệu; job tải vượt phần của mình thì ngủ cho đủ.
+    Job đã đăng ký nhưng chưa/không nhận dữ liệu (đang extract, kiểm tra trùng, chờ thử lại) không chiếm phần.
+    Đổi giới hạn bằng set_limit() có hiệu lực ngay với cả job đang chạy."""
+    def __init__(self, limit_bps: int = 0):
+        self._lock = threading.Lock()
+        self.limit = max(0, int(limit_bps or 0))
+        self._jobs = {}
+
+    def set_limit(self, limit_bps):
+        with self._lock:
+            self.limit = max(0, int(limit_bps or 0))
+            now = time.monotonic()
+            for j in self._jobs.values(): j['debt'] = 0.0; j['ts'] = now
+
+    def register(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._jobs.setdefault(key, {'debt': 0.0, 'ts': now, 'rate': 0.0, 'win_start': now, 'win_bytes': 0, 'last': float('-inf')})
+
+    def unregister(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _share_locked(self, now):
+        active = sum(1 for j in self._jobs.values() if now - j['last'] < BW_ACTIVE_SEC)
+        return self.limit / max(1, active)
+
+    def _settle_locked(self, j, now):
+        # Trả dần "nợ" theo phần băng thông của job kể từ lần gọi trước
+        if not self.limit:
+            j['debt'] = 0.0
+        else:
+            share = self._share_locked(now)
+            j['debt'] = max(-share * BW_BURST_SEC, j['debt'] - (now - j['ts']) * share)
+        j['ts'] = now
+
+    def consume(self, key, nbytes):
+        if nbytes <= 0: return
+        with self._lock:
+            j = self._jobs.get(key)
+            if not j: return
+            now = time.monotonic()
+            j['win_bytes'] += nbytes; j['last'] = now
+            if now - j['win_start'] >= 1.0:
+                j['rate'] = j['win_bytes'] / (now - j['win_start'])
+                j['win_start'] = now; j['win_bytes'] = 0
+            self._settle_locked(j, now)
+            j['debt'] += nbytes
+        while True:
+            with self._lock:
+                j = self._jobs.get(key)
+                if not j: return
+                now = time.monotonic()
+                self._settle_locked(j, now)
+                if j['debt'] <= 0: return
+                # Ngủ từng nhịp ngắn để giới hạn mới / số job thay đổi được áp dụng ngay
+                wait = min(j['debt'] / self._share_locked(now), 0.5)
+            time.sleep(wait)
+
+    def total_rate(self):
+        """Tổng tốc độ thực tế (byte/s) của các job còn đang nhận dữ liệu"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(j['rate'] for j in self._jobs.values() if now - j['last'] < 3)
+
+# --- LOG STORE ---
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+LOG_CONTEXT = threading.local()  # LOG_CONTEXT.job_id: job đang chạy trên thread hiện tại
+
+class LogStore:
+    """Bộ đệm vòng dung lượng cố định chứa các bản ghi log (thời gian, mức, job, nội dung).
+    Ghi từ thread nào cũng được; tùy chọn ghi thêm ra file có xoay vòng theo dung lượng."""
+    def __init__(self, capacity: int = LOG_CAPACITY, path=None, max_bytes: int = LOG_FILE_MAX_BYTES, backups: int = LOG_FILE_BACKUPS):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=capacity)
+        self._seq = 0
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file_enabled = False
+        self.listener = None
+
+    def add(self, msg, level="INFO", job_id=None):
+        if job_id is None: job_id = getattr(LOG_CONTEXT, 'job_id', None)
+        with self._lock:
+            self._seq += 1
+            rec = {'seq': self._seq, 'ts': time.time(), 'level': level, 'job_id': job_id, 'msg': str(msg)}
+            self._records.append(rec)
+            if self.file_enabled and self.path: self._write_locked(rec)
+        if self.listener: self.listener()
+        return rec
+
+    @staticmethod
+    def format(rec):
+        job = f"#{rec['job_id']} " if rec['job_id'] is not None else ""
+        return f"{datetime.fromtimestamp(rec['ts']).strftime('%H:%M:%S')} {rec['level'][0]} | {job}{rec['msg']}"
+
+    def _write_locked(self, rec):
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                for i in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{i}"): os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(self.format(rec) + "\n")
+        except OSError:
+            self.file_enabled = False
+
+    def since(self, seq, min_level="DEBUG"):
+        """Các bản ghi mới hơn seq (đạt mức tối thiểu) và seq mới nhất"""
+        threshold = LOG_LEVELS.get(min_level, 0)
+        with self._lock:
+            out = []
+            for rec in reversed(self._records):
+                if rec['seq'] <= seq: break
+                if LOG_LEVELS.get(rec['level'], 20) >= threshold: out.append(rec)
+            return out[::-1], self._seq
+
+    @property
+    def last_seq(self):
+        with self._lock: return self._seq
+
+    def tail(self, n, min_level="DEBUG"):
+        records, _ = self.since(0, min_level)
+        return records[-n:]
+
+RETRY_LOG = re.compile(r"Got error: .*Retrying( fragment)?")  # Dòng yt-dlp báo thử lại (retries / fragment_retries)
+
+class YDLLogger:
+    """Logger truyền cho yt-dlp: đếm số lần thử lại cho job (on_retry(job_id, fragment)),
+    khi bật log chi tiết thì đưa mọi dòng vào LogStore.
+    job_id=None thì lấy job của thread hiện tại (LOG_CONTEXT); job tải dùng bản for_job() vì yt-dlp
+    gọi logger cả từ thread tải fragment, nơi không có LOG_CONTEXT của worker."""
+    def __init__(self, store, settings=None, on_retry=None, job_id=None):
+        self.store = store
+        self.settings = settings if settings is not None else {}
+        self.on_retry = on_retry
+        self.job_id = job_id
+
+    def for_job(self, job_id):
+        return YDLLogger(self.store, self.settings, self.on_retry, job_id)
+
+    def debug(self, msg):
+        m = self.on_retry and RETRY_LOG.search(msg)
+        if m: self.on_retry(self.job_id if self.job_id is not None else getattr(LOG_CONTEXT, 'job_id', None), bool(m.group(1)))
+        if not self.settings.get("verbose_log"): return
+        # yt-dlp gửi cả thông báo thường qua debug(), chỉ dòng "[debug]" mới thật sự là DEBUG
+        self.store.add(msg, "DEBUG" if msg.startswith("[debug]") else "INFO", self.job_id)
+
+    def info(self, msg):
+        if self.settings.get("verbose_log"): self.store.add(msg, "INFO", self.job_id)
+
+    def warning(self, msg):
+        if self.settings.get("verbose_log"): self.store.add(msg, "WARN", self.job_id)
+
+    def error(self, msg):
+        if self.settings.get("verbose_log"): self.store.add(msg, "ERROR", self.job_id)
+
+# --- HISTORY STORE ---
+
+class HistoryStore:
+    """Lịch sử tải lưu trong SQLite (không giới hạn số dòng), có index theo ngày/loại.
+    Tìm theo tiêu đề (chuỗi con) dùng bảng FTS5 trigram nếu SQLite hỗ trợ, không thì LIKE quét bảng.
+    UI chỉ truy vấn từng trang nên mở tab với hàng nghìn dòng vẫn nhanh."""
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            try: self._db.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.DatabaseError: pass
+            self._db.execute("""CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL DEFAULT '',
+                date TEXT NOT NULL DEFAULT '',
+                path TEXT,
+                type TEXT NOT NULL DEFAULT 'video',
+                url TEXT)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_history_date ON history(date)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_history_type ON history(type, date)")
+            # B-tree trên title không phục vụ được LIKE '%...%'
+            self._db.execute("DROP INDEX IF EXISTS idx_history_title")
+        self.fts = self._init_fts()
+
+    def _init_fts(self):
+        """Bảng FTS5 trigram (external content, đồng bộ bằng trigger); False nếu SQLite không có FTS5/trigram"""
+        try:
+            with self._db:
+                exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone()
+                self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(title, content='history', content_rowid='id', tokenize='trigram')")
+                self._db.execute("""CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+                    INSERT INTO history_fts(rowid, title) VALUES (new.id, new.title); END""")
+                self._db.execute("""CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+                    INSERT INTO history_fts(history_fts, rowid, title) VALUES ('delete', old.id, old.title); END""")
+                self._db.execute("""CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF title ON history BEGIN
+                    INSERT INTO history_fts(history_fts, rowid, title) VALUES ('delete', old.id, old.title);
+                    INSERT INTO history_fts(rowid, title) VALUES (new.id, new.title); END""")
+                # DB có từ trước khi có bảng FTS -> lập chỉ mục các dòng cũ
+                if not exists: self._db.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def add(self, item):
+        with self._lock, self._db:
+            cur = self._db.execute("INSERT INTO history(title, date, path, type, url) VALUES (?, ?, ?, ?, ?)",
+                                   (item.get('title') or '', item.get('date') or '', item.get('path'), item.get('type') or 'video', item.get('url')))
+            return cur.lastrowid
+
+    def add_many(self, items):
+        """Nhập một loạt (vd chuyển lịch sử cũ từ client_storage), items mới nhất đứng đầu"""
+        rows = [(i.get('title') or '', i.get('date') or '', i.get('path'), i.get('type') or 'video', i.get('url'))
+                for i in reversed(items) if isinstance(i, dict)]
+        with self._lock, self._db:
+            self._db.executemany("INSERT INTO history(title, date, path, type, url) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _where(self, search="", media_type=None):
+        clauses, args = [], []
+        if search and self.fts and len(search) >= HISTORY_FTS_MIN:
+            # Cụm trong ngoặc kép = chuỗi con liên tiếp, không phân biệt hoa thường
+            clauses.append("id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+            args.append('"' + search.replace('"', '""') + '"')
+        elif search:
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            args.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if media_type:
+            clauses.append("type = ?"); args.append(media_type)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def query(self, search="", media_type=None, offset=0, limit=HISTORY_PAGE_SIZE):
+        where, args = self._where(search, media_type)
+        with self._lock:
+            rows = self._db.execute(f"SELECT * FROM history{where} ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+                                    args + [limit, offset]).fetchall()
+        return [dict(r) for r in rows]
+
+    def count(self, search="", media_type=None):
+        where, args = self._where(search, media_type)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM history{where}", args).fetchone()[0]
+
+    def matches(self, item, search="", media_type=None):
+        """Dòng mới có lọt bộ lọc hiện tại không (để chèn thẳng vào list, khỏi truy vấn lại).
+        Hỏi lại DB theo id với cùng điều kiện của query/count để kết quả khớp hệt (FTS trigram / LIKE)."""
+        if not search and not media_type: return True
+        if item.get('id') is None: return False  # Không ghi được vào DB thì query cũng không thấy
+        where, args = self._where(search, media_type)
+        with self._lock:
+            return self._db.execute(f"SELECT 1 FROM history{where} AND id = ?", args + [item['id']]).fetchone() is not None
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM history")
+
+# --- MEDIA INDEX ---
+
+AUDIO_EXTS = {".m4a", ".mp3", ".opus", ".aac", ".ogg", ".flac", ".wav"}
+MEDIA_EXTS = AUDIO_EXTS | {".mp4", ".webm", ".mkv", ".mov", ".flv", ".3gp"}
+
+def quick_hash(path, block: int = 64 * 1024):
+    """Dấu vân tay nội dung nhanh: sha1(dung lượng + 64KiB đầu + 64KiB cuối), không đọc cả file GB"""
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            h.update(f.read(block))
+    return h.hexdigest()
+
+def remote_quick_hash(url, headers=None, block: int = 64 * 1024):
+    """quick_hash của file trên server chỉ bằng 2 request Range (đầu + cuối file), None nếu không lấy được"""
+    try:
+        head, size = read_range(url, 0, block - 1, headers)
+        h = hashlib.sha1(str(size).encode())
+        h.update(head[:block])
+        if size > block:
+            tail, _ = read_range(url, max(block, size - block), size - 1, headers)
+            h.update(tail)
+        return h.hexdigest()
+    except Exception:
+        return None
+
+class MediaIndex:
+    """Chỉ mục file đã tải, khóa theo extractor + video id (+ loại audio/video) và dấu vân tay nội dung.
+    Dùng để phát hiện video đã có trước khi tải lại; lưu kèm format/độ phân giải để phân biệt các bản khác chất lượng."""
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY,
+                extractor TEXT NOT NULL DEFAULT '',
+                video_id TEXT,
+                type TEXT NOT NULL DEFAULT 'video',
+                stem TEXT,
+                size INTEGER,
+                hash TEXT,
+                format_id TEXT,
+                height INTEGER)""")
+            # DB tạo từ bản cũ chưa có cột chất lượng
+            cols = {row['name'] for row in self._db.execute("PRAGMA table_info(media)")}
+            for col, kind in (('format_id', 'TEXT'), ('height', 'INTEGER')):
+                if col not in cols: self._db.execute(f"ALTER TABLE media ADD COLUMN {col} {kind}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_media_key ON media(video_id, extractor)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_media_hash ON media(hash, size)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS scanned_dirs (path TEXT PRIMARY KEY, ts REAL)")
+
+    def add(self, extractor, video_id, media_type, path, content_hash=None, format_id=None, height=None):
+        path = os.path.abspath(path)
+        try: size = os.path.getsize(path)
+        except OSError: return
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO media(path, extractor, video_id, type, stem, size, hash, format_id, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (path, extractor or '', video_id, media_type, stem, size, content_hash, format_id, height))
+
+    def remove(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM media WHERE path = ?", (path,))
+
+    def lookup(self, extractor, video_id, media_type, format_id=None, height=None):
+        """File đã có của video này (còn tồn tại trên đĩa) hoặc None.
+        format_id: chất lượng người dùng chọn rõ -> chỉ tính là trùng nếu file đã có cùng format hoặc cùng độ phân giải
+        (file quét từ thư mục không rõ chất lượng thì không tính)"""
+        if not video_id: return None
+        escaped = video_id.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._lock:
+            # File quét từ thư mục chưa biết extractor/id: so khớp theo đuôi tên "-<id>", có thể kèm "_N" do đổi tên tránh ghi đè
+            rows = self._db.execute(
+                "SELECT path, video_id, stem, format_id, height FROM media WHERE type = ? AND ((video_id = ? AND extractor IN (?, '')) OR (video_id IS NULL AND stem LIKE ? ESCAPE '\\'))",
+                (media_type, video_id, extractor or '', "%-" + escaped + "%")).fetchall()
+        scanned = re.compile("-" + re.escape(video_id) + r"(?:_\d+)?$")
+        for row in rows:
+            if row['video_id'] is None and not scanned.search(row['stem']): continue
+            if format_id and row['format_id'] != format_id and not (height and row['height'] == height): continue
+            if os.path.exists(row['path']): return row['path']
+            self.remove(row['path'])
+        return None
+
+    def lookup_hash(self, content_hash, exclude_path=None):
+        """File đã có cùng dấu vân tay (quick_hash đã gồm dung lượng) còn tồn tại trên đĩa, hoặc None"""
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM media WHERE hash = ? AND path != ?",
+                                    (content_hash, exclude_path or '')).fetchall()
+        for row in rows:
+            if os.path.exists(row['path']): return row['path']
+        return None
+
+    def ensure_scanned(self, folder):
+        """Quét thư mục tải một lần duy nhất bằng một lần liệt kê (scandir), không hỏi tồn tại từng file"""
+        folder = os.path.abspath(folder or ".")
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM scanned_dirs WHERE path = ?", (folder,)).fetchone(): return 0
+        rows = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext.lower() not in MEDIA_EXTS or not entry.is_file(): continue
+                    media_type = 'audio' if ext.lower() in AUDIO_EXTS else 'video'
+                    rows.append((entry.path, media_type, stem, entry.stat().st_size))
+        except OSError:
+            return 0
+        with self._lock, self._db:
+            # Không ghi đè bản ghi đã có extractor/id chính xác
+            self._db.executemany("INSERT OR IGNORE INTO media(path, type, stem, size) VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO scanned_dirs(path, ts) VALUES (?, ?)", (folder, time.time()))
+        return len(rows)
+
+# --- JOB JOURNAL ---
+
+class JobJournal:
+    """Nhật ký các job chưa xong (file JSON), ghi theo checkpoint.
+    Nếu app bị Android kill, lần mở sau đọc lại để tiếp tục tải từ file .part."""
+    def __init__(self, path, checkpoint_interval: float = JOURNAL_CHECKPOINT_SEC):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._last_flush = {}
+        self._holds = {}         # key -> số tác vụ hậu kỳ còn chờ trong pool
+        self._finished = set()   # Worker tải đã xong, chờ hậu kỳ xong mới xóa
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict): self._jobs = data
+        except:
+            pass
+
+    def _flush_locked(self):
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._jobs, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except:
+            pass
+
+    def add(self, url, quality_id, is_playlist, save_path, title=""):
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[key] = {
+                'url': url, 'quality_id': quality_id, 'is_playlist': bool(is_playlist),
+                'save_path': save_path, 'title': title, 'state': 'queued',
+                'created': datetime.now().strftime("%Y-%m-%d %H:%M"),
+                'outtmpl': None, 'format': None, 'partial': None,
+                'downloaded': 0, 'total': None, 'done_entries': []
+            }
+            self._flush_locked()
+        return key
+
+    def get(self, key):
+        with self._lock:
+            rec = self._jobs.get(key)
+            return dict(rec) if rec else None
+
+    def update(self, key, **fields):
+        with self._lock:
+            if key not in self._jobs: return
+            self._jobs[key].update(fields)
+            self._flush_locked()
+
+    def checkpoint(self, key, d):
+        """Ghi file tạm và số byte đã tải, tối đa mỗi checkpoint_interval giây một lần"""
+        with self._lock:
+            rec = self._jobs.get(key)
+            if not rec: return
+            rec['partial'] = d.get('tmpfilename') or d.get('filename') or rec.get('partial')
+            rec['downloaded'] = d.get('downloaded_bytes') or 0
+            rec['total'] = d.get('total_bytes') or d.get('total_bytes_estimate')
+            now = time.monotonic()
+            if now - self._last_flush.get(key, 0) >= self.checkpoint_interval:
+                self._last_flush[key] = now
+                self._flush_locked()
+
+    def mark_entry(self, key, idx):
+        with self._lock:
+            rec = self._jobs.get(key)
+            if not rec: return
+            rec.setdefault('done_entries', []).append(idx)
+            self._flush_locked()
+
+    def remove(self, key):
+        with self._lock:
+            self._holds.pop(key, None); self._finished.discard(key)
+            if self._jobs.pop(key, None) is None: return
+            self._last_flush.pop(key, None)
+            self._flush_locked()
+
+    def hold(self, key):
+        """Giữ bản ghi khi hậu kỳ của job còn chờ trong pool: app bị kill lúc đó thì lần sau tải (file đã có) + hậu kỳ lại"""
+        with self._lock:
+            if key in self._jobs: self._holds[key] = self._holds.get(key, 0) + 1
+
+    def release(self, key):
+        with self._lock:
+            n = self._holds.get(key, 0) - 1
+            if n > 0:
+                self._holds[key] = n
+                return
+            self._holds.pop(key, None)
+            if key not in self._finished: return
+        self.remove(key)
+
+    def finish(self, key):
+        """Worker tải đã xong job (xong/lỗi/hủy): xóa bản ghi ngay, hoặc khi tác vụ hậu kỳ cuối cùng xong"""
+        with self._lock:
+            if self._holds.get(key):
+                self._finished.add(key)
+                return
+        self.remove(key)
+
+    def pending(self):
+        with self._lock:
+            return [(k, dict(v)) for k, v in self._jobs.items()]
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear(); self._last_flush.clear(); self._holds.clear(); self._finished.clear()
+            self._flush_locked()
+
+# --- JOB SCHEDULER ---
+
+class DownloadJob:
+    """Thông tin một job tải (mỗi job có ID và cờ hủy riêng)"""
+    def __init__(self, job_id, url, quality_id=None, is_playlist=False, save_path=".", cookie_content="", priority=0, meta=None):
+        self.job_id = job_id
+        self.url = url
+        self.quality_id = quality_id
+        self.is_playlist = is_playlist
+        self.save_path = save_path
+        self.cookie_content = cookie_content
+        self.priority = priority
+        self.meta = meta or {}
+        self.cancel_event = threading.Event()
+        self.state = "queued"  # queued -> running -> done / cancelled
+        self.created = time.monotonic()
+
+class JobScheduler:
+    """Hàng đợi job dùng chung với pool worker giới hạn (N job tải song song).
+    Job ưu tiên thấp hơn (số nhỏ hơn) chạy trước, cùng ưu tiên thì theo FIFO."""
+    def __init__(self, runner, q, max_workers: int = 2, gate=None, on_discard=None):
+        self.runner = runner  # runner(job) chạy trên thread worker
+        self.q = q
+        self.gate = gate      # gate() -> False: tạm chưa cho job mới bắt đầu (chính sách mạng/khung giờ)
+        self.on_discard = on_discard  # on_discard(job): job bị hủy khi còn trong hàng đợi, không qua runner
+        self.max_workers = max(1, int(max_workers))
+        self._cond = threading.Condition()
+        self._heap = []
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._workers = 0
+        self._running = 0
+
+    def submit(self, url, quality_id=None, is_playlist=False, save_path=".", cookie_content="", priority=0, meta=None):
+        with self._cond:
+            job_id = next(self._ids)
+            job = DownloadJob(job_id, url, quality_id, is_playlist, save_path, cookie_content, priority, meta)
+            self._jobs[job_id] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job_id))
+            self._spawn_locked()
+            self._cond.notify()
+        self.q.put({'type': 'queued', 'job_id': job_id, 'url': url, 'title': (meta or {}).get('title')})
+        return job_id
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.state != "queued" and job.state != "running": return False
+            job.cancel_event.set()
+            was_queued = job.state == "queued"
+            if was_queued:
+                # Job chưa chạy: bỏ luôn, worker sẽ bỏ qua khi lấy ra khỏi heap
+                job.state = "cancelled"
+                self._jobs.pop(job_id, None)
+        if was_queued:
+            if self.on_discard: self.on_discard(job)
+            self.q.put({'type': 'cancelled', 'job_id': job_id})
+            self.q.put({'type': 'worker_done', 'job_id': job_id})
+        return True
+
+    def cancel_all(self):
+        with self._cond:
+            ids = list(self._jobs.keys())
+        for job_id in ids: self.cancel(job_id)
+
+    def set_max_workers(self, n: int):
+        with self._cond:
+            self.max_workers = max(1, int(n))
+            self._spawn_locked()
+            # Đánh thức worker thừa để chúng tự thoát
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            queued = sum(1 for j in self._jobs.values() if j.state == "queued")
+            gated = bool(queued and self.gate and not self.gate())
+            return {'queued': queued, 'running': self._running, 'workers': self._workers, 'gated': gated}
+
+    def wake(self):
+        """Đánh thức worker để kiểm tra lại gate (vd vừa đổi chính sách trong Cài đặt)"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _spawn_locked(self):
+        while self._workers < self.max_workers:
+            self._workers += 1
+            threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def _pop_locked(self):
+        while self._heap:
+            _, _, job_id = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job and job.state == "queued": return job
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._workers > self.max_workers:
+                        self._workers -= 1
+                        return
+                    if self.gate and self._heap and not self.gate():
+                        self._cond.wait(GATE_RECHECK_SEC)
+                        continue
+                    job = self._pop_locked()
+                    if job: break
+                    self._cond.wait()
+                job.state = "running"
+                self._running += 1
+            try:
+                self.runner(job)
+            except Exception as e:
+                self.q.put({'type': 'error', 'job_id': job.job_id, 'msg': str(e)})
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    job.state = "cancelled" if job.cancel_event.is_set() else "done"
+                    self._jobs.pop(job.job_id, None)
+
+# --- ENGINE ---
+
+DEFAULT_SETTINGS = {"cookies": "", "max_workers": 2, "turbo": False, "turbo_connections": 4,
+                    "bw_limit_kbps": 0, "bw_policy": "always", "offpeak_start": 0, "offpeak_end": 6, "dup_policy": "skip",
+                    "verbose_log": False, "log_to_file": False, "fmt_max_height": 0, "fmt_size_budget_mb": 0, "fmt_codec": "auto",
+                    "embed_metadata": True, "scratch_dir": ""}
+AUDIO_QUALITIES = {"audio": "m4a", "audio_mp3": "mp3"}  # quality_id audio -> định dạng đích của bước hậu kỳ
+QUALITY_ALIASES = {"best": None, "m4a": "audio", "mp3": "audio_mp3"}  # Tên ngắn cho CLI/API
+
+@contextmanager
+def format_override(ydl, spec):
+    """Tạm dùng format spec khác cho một instance YoutubeDL mượn từ pool (không đổi khóa pool)"""
+    if not spec:
+        yield
+        return
+    saved = ydl.format_selector
+    ydl.format_selector = ydl.build_format_selector(spec)
+    try:
+        yield
+    finally:
+        ydl.format_selector = saved
+
+@contextmanager
+def outtmpl_override(ydl, outtmpl):
+    """Tạm dùng mẫu tên file khác cho một instance YoutubeDL mượn từ pool"""
+    saved = ydl.params['outtmpl']
+    ydl.params['outtmpl'] = dict(saved, default=outtmpl)
+    try:
+        yield
+    finally:
+        ydl.params['outtmpl'] = saved
+
+def quality_outtmpl(outtmpl, info):
+    """Mẫu tên có nhãn chất lượng (..._1080p-<id>) cho bản khác chất lượng của video đã có:
+    tên mặc định trùng file cũ thì yt-dlp coi là đã tải, còn bước ghép sẽ ghi đè lên nó"""
+    height = info.get('height')
+    label = f"{height}p" if height else re.sub(r"[^A-Za-z0-9]", "", str(info.get('format_id') or "")) or "alt"
+    return os.path.join(os.path.dirname(outtmpl), f"%(title).50s_{label}-%(id)s.%(ext)s")
+
+def quality_key(info):
+    """(format_id của phần video, độ phân giải) của info đã chọn format, để ghi vào chỉ mục"""
+    fmt = (info or {}).get('format_id')
+    return (str(fmt).split('+')[0] if fmt else None), (info or {}).get('height')
+
+SELECTION_KEYS = ('format_id', 'format', 'format_note', 'url', 'manifest_url', 'protocol', 'ext', 'filesize', 'filesize_approx')  # Trường của format đã chọn
+
+def reusable_info(info):
+    """Bản sao info đã qua chọn format (vd lúc phân tích) để chọn format lại như info thô.
+    Phải bỏ kết quả lần chọn trước: process_ie_result giữ nguyên requested_formats cũ khi format mới là một file,
+    và process_info thấy requested_formats là tải + ghép đúng cặp mặc định lúc phân tích."""
+    import yt_dlp
+    raw = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    for key in SELECTION_KEYS: raw.pop(key, None)
+    return raw
+
+def downloaded_path(info):
+    """File yt-dlp ghi ra (sau cả bước ghép nội bộ nếu có) từ kết quả process_ie_result(download=True)"""
+    downloads = (info or {}).get('requested_downloads') or []
+    return downloads[-1].get('filepath') if downloads else None
+
+class DownloadEngine:
+    """Gom các thành phần tải (cache phân tích, pool YoutubeDL, hàng đợi job, băng thông,
+    journal, chỉ mục file, lịch sử, log) và phát sự kiện vào một EventChannel.
+    settings là dict cấu hình dùng chung với bên gọi, đọc lại mỗi khi job bắt đầu."""
+    def __init__(self, settings=None, events=None, data_dir=None):
+        self.settings = settings if settings is not None else dict(DEFAULT_SETTINGS)
+        self.events = events or EventChannel()
+        if data_dir: os.makedirs(data_dir, exist_ok=True)
+        else: data_dir = app_data_dir()
+        self.log_store = LogStore(path=os.path.join(data_dir, "app.log"))
+        self.log_store.file_enabled = bool(self.settings.get("log_to_file", False))
+        self.metrics = MetricsStore()
+        self.events.taps.append(self.metrics.observe)
+        self.ydl_logger = YDLLogger(self.log_store, self.settings, on_retry=self.metrics.retry)
+        self.history = HistoryStore(os.path.join(data_dir, "history.db"))
+        self.analyze_cache = AnalyzeCache(os.path.join(data_dir, "analyze_cache.json"))
+        self.prefetcher = AnalyzePrefetcher(self.prefetch_analyze)
+        self.ydl_pool = YDLSessionPool()
+        self.media_index = MediaIndex(os.path.join(data_dir, "media_index.db"))
+        self.bw = BandwidthScheduler(int(self.settings.get("bw_limit_kbps", 0) or 0) * 1024)
+        self.journal = JobJournal(os.path.join(data_dir, "jobs_journal.json"))
+        self.format_policies = FormatPolicyStore(os.path.join(data_dir, "format_policies.json"))
+        self.postproc = PostProcessor(rename=safe_rename_downloaded_file)
+        self.scheduler = JobScheduler(self.run_job, self.events, max_workers=self.settings.get("max_workers", 2),
+                                      gate=self.policy_allows_start, on_discard=lambda job: self.journal.remove(job.meta.get('journal_key')))
+
+    def submit(self, url, quality_id=None, is_playlist=False, save_path=".", cookie_content="", priority=1, title=None, journal_key=None, resumable=True):
+        """Đưa job vào hàng đợi; resumable=True thì ghi journal để khôi phục nếu app bị kill"""
+        quality_id = QUALITY_ALIASES.get(quality_id, quality_id)
+        if journal_key is None and resumable:
+            journal_key = self.journal.add(url, quality_id, is_playlist, save_path, title or url)
+        return self.scheduler.submit(url, quality_id, is_playlist, save_path, cookie_content, priority=priority, meta={'journal_key': journal_key, 'title': title or url})
+
+    def close(self):
+        self.scheduler.cancel_all()
+        self.postproc.shutdown()
+        self.ydl_pool.close_all()
+
+    def verbose_opts(self, always_log=False, job_id=None):
+        """Option yt-dlp khi bật log chi tiết (logger gắn theo lần mượn session, không nằm trong khóa pool).
+        always_log: job tải luôn gắn logger để đếm số lần thử lại cho bảng Thống kê; job_id: logger gắn cố định với job"""
+        logger = self.ydl_logger.for_job(job_id) if job_id is not None else self.ydl_logger
+        if not self.settings.get("verbose_log"): return {'logger': logger} if always_log else {}
+        return {'logger': logger, 'verbose': True, 'noprogress': True}
+
+    def format_policy(self, extractor):
+        """Chính sách chọn format: Cài đặt chung + lựa chọn đã nhớ cho extractor"""
+        return FormatPolicy.from_settings(self.settings, self.format_policies.get(extractor))
+
+    def policy_format(self, info, extractor, has_ffmpeg):
+        """Lựa chọn tốt nhất theo chính sách cho một video (info chưa chọn format), None nếu không xếp hạng được"""
+        if not isinstance(info, dict) or not info.get('formats'): return None
+        ranked = rank_formats(info['formats'], self.format_policy(extractor), has_ffmpeg, info.get('duration'))
+        return ranked[0] if ranked else None
+
+    def record_history(self, title, path, media_type):
+        """Ghi một file vừa tải vào lịch sử, trả về bản ghi (kèm id) để UI chèn dòng"""
+        item = {"title": title or 'Unknown', "date": datetime.now().strftime("%Y-%m-%d %H:%M"), "path": path or "file", "type": media_type or 'video'}
+        try: item['id'] = self.history.add(item)
+        except sqlite3.Error: pass
+        return item
+
+    def analyze(self, url, cookie_content=None):
+        """Phân tích link (dùng cache nếu còn hạn), trả (result, cached).
+        Phân tích bằng cookie của job (mặc định cookie trong Cài đặt) để session được làm ấm chính là session lúc tải"""
+        if cookie_content is None: cookie_content = self.settings.get("cookies", "")
+        cached = self.analyze_cache.get(url)
+        if cached: return cached, True
+
+        # Kiểm tra FFmpeg để lọc video câm
+        has_ffmpeg = shutil.which("ffmpeg") is not None
+        
+        with self.ydl_pool.session(dict(ANALYZE_OPTS, **self.verbose_opts()), cookie_content) as ydl:
+            info = ydl.extract_info(url, download=False)
+            
+            is_playlist = False
+            entry_count = 0
+            if isinstance(info, dict) and 'entries' in info:
+                is_playlist = True
+                try:
+                    entry_count = len(info['entries'])
+                except: pass
+                try:
+                    first = info['entries'][0]
+                    sub = first.get('url') or first.get('id')
+                    info = ydl.extract_info(sub, download=False)
+                except: pass 
+            
+            options, recommended = build_options(info, self.format_policy(info.get('extractor_key')), has_ffmpeg, format_bytes)
+            result = {'options': options, 'recommended': recommended, 'title': info.get('title', 'Unknown'), 'is_playlist': is_playlist, 'entry_count': entry_count}
+            # Chỉ giữ info của video đơn; với playlist info ở đây là của entry đầu tiên
+            self.analyze_cache.put(url, result, info=None if is_playlist else reusable_info(info), cookie_content=cookie_content)
+            return result, False
+
+    def run_analyze(self, url, q=None, cookie_content=None):
+        q = q or self.events
+        # Link đang được phân tích trước (clipboard) -> chờ xong rồi lấy từ cache, không extract hai lần
+        self.prefetcher.wait(url)
+        try:
+            result, cached = self.analyze(url, cookie_content)
+            item = dict(result, type='analyze_done', url=url)
+            if cached: item['cached'] = True
+            q.put(item)
+        except Exception as e:
+            q.put({'type': 'error', 'msg': f"Lỗi phân tích: {e}", 'url': url})
+
+    def prefetch_analyze(self, url):
+        """Phân tích nền cho AnalyzePrefetcher (kết quả vào AnalyzeCache), trả result hoặc None nếu lỗi"""
+        try:
+            return self.analyze(url)[0]
+        except Exception as e:
+            # Lỗi (mạng chập chờn...) -> quên link để lần chép sau thử lại; bấm Phân tích sẽ extract như thường
+            self.prefetcher.forget(url)
+            self.log_store.add(f"Phân tích trước lỗi: {e}", "DEBUG")
+            return None
+
+    def run_download(self, url, quality_id, is_playlist, save_path, cookie_content, cancel_evt, q=None, job_id=None, journal_key=None):
+        q = q or self.events
+        last_filepath = None
+        handed_off = False
+        cookie_content = (cookie_content or "").strip()
+
+        def emit(item):
+            # Gắn ID job vào mọi message để UI biết cập nhật dòng nào
+            item['job_id'] = job_id
+            if item.get('type') == 'progress':
+                q.put_progress((job_id, item.get('entry')), item)
+            else:
+                q.put(item)
+
+        try:
+            import yt_dlp
+            from yt_dlp.utils import DownloadError
+            
+            ok, msg = prepare_save_path(save_path)
+            if not ok:
+                emit({'type': 'error', 'msg': f"Lỗi thư mục: {msg}"})
+                return
+
+            has_ffmpeg = shutil.which("ffmpeg") is not None
+            if not has_ffmpeg: emit({'type': 'log', 'msg': 'Không có FFmpeg -> Chế độ tương thích.'})
+
+            # Có thư mục tạm (bộ nhớ trong nhanh) thì tải + hậu kỳ ở đó, xong mới chuyển một lần sang thư mục lưu
+            work_dir = scratch_for(save_path, self.settings.get("scratch_dir")) or save_path
+
+            # [FIX] Tên file ngắn + Mạng trâu bò (Retries)
+            outtmpl = os.path.join(work_dir, "%(title).50s-%(id)s.%(ext)s")
+            
+            opts = dict(YDL_NET_OPTS, **{
+                'outtmpl': outtmpl,
+                'noprogress': True,  # Tiến độ đã đi qua hook, không in thanh tiến độ ra stdout
+                'restrictfilenames': True,
+                'noplaylist': not bool(is_playlist),
+                # [FIX QUAN TRỌNG] Tự động thử lại khi rớt mạng
+                'retries': 10, 
+                'fragment_retries': 10,
+                # Tải tiếp từ file .part nếu có (job được khôi phục từ journal)
+                'continuedl': True,
+                'buffersize': YDL_BUFFER_SIZE
+            })
+            opts.update(self.verbose_opts(always_log=True, job_id=job_id))
+
+            media_type = 'video'
+            if quality_id in AUDIO_QUALITIES:
+                opts['format'] = 'bestaudio[ext=m4a]/bestaudio/best'
+                media_type = 'audio'
+            elif quality_id:
+                if has_ffmpeg:
+                    opts['format'] = f"{quality_id}+bestaudio/best"
+                else:
+                    opts['format'] = f"{quality_id}/best[ext=mp4]/best"
+            else:
+                opts['format'] = "best[ext=mp4]/best"
+
+            turbo_on = bool(self.settings.get("turbo"))
+            connections = int(self.settings.get("turbo_connections") or 4)
+            if turbo_on:
+                # DASH/HLS: tải nhiều fragment cùng lúc
+                opts['concurrent_fragment_downloads'] = connections
+
+            if journal_key: self.journal.update(journal_key, state='running', outtmpl=outtmpl, format=opts['format'])
+
+            if is_playlist:
+                self.download_playlist(url, opts, cookie_content, media_type, cancel_evt, emit, journal_key, job_id, quality_id=quality_id, save_path=save_path)
+                if cancel_evt.is_set(): raise DownloadError("HUST_CANCELLED")
+                return
+
+            def progress_hook(d):
+                # Hook cho UI/journal; đường yt-dlp dùng bản bọc throttled() để giới hạn băng thông
+                nonlocal last_filepath
+                if cancel_evt.is_set(): raise DownloadError("HUST_CANCELLED")
+                if d.get('status') == 'finished':
+                    last_filepath = d.get('filename')
+                elif d.get('status') == 'downloading':
+                    emit(dict(progress_event(d), type='progress'))
+                    if journal_key: self.journal.checkpoint(journal_key, d)
+
+            emit({'type': 'status', 'msg': 'Đang kết nối Server...'})
+            
+            # Dùng lại info đã phân tích để bỏ qua lần extract thứ hai.
+            # Info chỉ được dùng lại khi lúc phân tích cũng dùng đúng cookie của job.
+            cached_info = self.analyze_cache.get_info(url, cookie_content)
+
+            dup_policy = self.settings.get("dup_policy", "skip")
+            if dup_policy != "off":
+                n = self.media_index.ensure_scanned(save_path)
+                if n: emit({'type': 'log', 'msg': f"Đã lập chỉ mục {n} file có sẵn trong {save_path}"})
+
+            with self.ydl_pool.session(opts, cookie_content, hook=self.throttled(job_id, progress_hook)) as ydl:
+                # Lấy info thô trước (từ cache hoặc extract, chưa chọn format) để biết extractor + id,
+                # chọn format theo chính sách rồi kiểm tra trùng, sau đó mới tải
+                t0 = time.monotonic()
+                raw = reusable_info(cached_info) if cached_info else None
+                from_cache = raw is not None
+                if raw is None: raw = ydl.extract_info(url, download=False, process=False)
+                extractor = raw.get('extractor_key') or raw.get('extractor')
+                self.metrics.extracted(job_id, extractor, time.monotonic() - t0, cache_hit=from_cache)
+                pick = None if quality_id else self.policy_format(raw, extractor, has_ffmpeg)
+                if pick:
+                    emit({'type': 'log', 'msg': f"Tự chọn format {pick['format']['height']}p ({pick['spec']}) theo chính sách"})
+
+                # Video-only + audio: tải riêng từng phần, việc ghép để cho pool hậu kỳ.
+                # process_ie_result sửa info tại chỗ nên mỗi lần xử lý dùng một bản sao của info thô
+                split = self.plan_parts(raw, quality_id, pick, has_ffmpeg)
+                with format_override(ydl, pick and pick['spec']):
+                    try:
+                        info = ydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(raw) if split else raw, download=False)
+                    except Exception:
+                        if not from_cache: raise
+                        from_cache = False
+                        raw = ydl.extract_info(url, download=False, process=False)
+                        info = ydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(raw) if split else raw, download=False)
+
+                    wanted = quality_id if quality_id not in AUDIO_QUALITIES else None
+                    if dup_policy != "off":
+                        existing = self.media_index.lookup(extractor, info.get('id'), media_type, wanted, info.get('height'))
+                        note = "Đã có sẵn"
+                        if not existing:
+                            # Khác id (link khác, bản đăng lại...) nhưng cùng nội dung với file đã tải
+                            existing = self.content_duplicate(info, AUDIO_QUALITIES.get(quality_id))
+                            note = "Nội dung trùng file đã có"
+                        if existing:
+                            reused = self.reuse_existing(existing, save_path, dup_policy)
+                            emit({'type': 'log', 'msg': f"{note}, không tải lại: {reused}"})
+                            emit({'type': 'finished', 'title': os.path.basename(reused), 'filepath': reused, 'media_type': media_type, 'duplicate': True})
+                            return
+                    if wanted and self.media_index.lookup(extractor, info.get('id'), media_type):
+                        # Đã có bản chất lượng khác của video này -> tải sang tên riêng, giữ bản cũ
+                        opts = dict(opts, outtmpl=quality_outtmpl(opts['outtmpl'], info))
+                        emit({'type': 'log', 'msg': "Đã có bản chất lượng khác, tải thêm bản mới"})
+
+                    self.check_space(work_dir, save_path, expected_size(raw, split) if split else expected_size(info), has_ffmpeg)
+                    turbo = (connections, progress_hook, lambda n: self.bw.consume(job_id, n), lambda: self.metrics.retry(job_id, True)) if turbo_on else None
+                    self.metrics.update(job_id, turbo=turbo_on)
+                    session_hook = self.throttled(job_id, progress_hook)
+                    with outtmpl_override(ydl, opts['outtmpl']):
+                        try:
+                            files = self.fetch_media(ydl, raw if split else info, split, opts, cookie_content, session_hook, cancel_evt, emit, turbo)
+                        except Exception as ex:
+                            if cancel_evt.is_set() or not from_cache: raise
+                            # Link format trong info cache có thể đã hết hạn -> extract lại từ đầu
+                            emit({'type': 'log', 'msg': f"Info cache lỗi, tải lại từ đầu: {ex}"})
+                            raw = ydl.extract_info(url, download=False, process=False)
+                            info = ydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(raw) if split else raw, download=False)
+                            files = self.fetch_media(ydl, raw if split else info, split, opts, cookie_content, session_hook, cancel_evt, emit, turbo)
+
+                # Người dùng tự chọn chất lượng -> nhớ cho các job tự động (batch/API/playlist) cùng trang
+                if quality_id and quality_id not in AUDIO_QUALITIES:
+                    chosen = next((f for f in raw.get('formats') or [] if isinstance(f, dict) and f.get('format_id') == quality_id), None)
+                    if chosen: self.format_policies.remember(extractor, chosen)
+
+            if not files and last_filepath: files = [last_filepath]
+            handed_off = self.finish_media(files, info, extractor, media_type, AUDIO_QUALITIES.get(quality_id), cancel_evt, emit,
+                                           dest=save_path if work_dir != save_path else None, journal_key=journal_key)
+
+        except Exception as e:
+            text = str(e)
+            if 'HUST_CANCELLED' in text or 'Cancelled' in text:
+                emit({'type': 'cancelled'})
+            else:
+                # Lỗi có thể do thư mục (thẻ nhớ bị rút, hết quyền) -> job sau ghi thử lại
+                forget_writable(save_path)
+                emit({'type': 'error', 'msg': text})
+        finally:
+            # postprocessing=True: job đã tải xong, kết quả (finished/error) sẽ đến từ pool hậu kỳ
+            emit({'type': 'worker_done', 'postprocessing': handed_off})
+
+    def reuse_existing(self, existing, save_path, dup_policy):
+        """Dùng lại file đã tải: 'link' tạo hard link trong thư mục lưu hiện tại (nếu khác thư mục)"""
+        if dup_policy != "link" or os.path.dirname(os.path.abspath(existing)) == os.path.abspath(save_path):
+            return existing
+        target = os.path.join(save_path, os.path.basename(existing))
+        if os.path.exists(target): return target
+        try:
+            os.link(existing, target)
+            return target
+        except OSError:
+            # Bộ nhớ ngoài Android (FAT/sdcardfs) không hỗ trợ hard link -> trỏ về file cũ
+            return existing
+
+    def content_duplicate(self, info, audio_format=None):
+        """File đã có cùng nội dung với format sắp tải (so quick_hash qua 2 request Range trước khi tải), None nếu không có.
+        Chỉ áp dụng cho format một file qua http/https; file đã có phải cùng đuôi với file job này sẽ tạo ra."""
+        if not isinstance(info, dict) or info.get('requested_formats') or info.get('protocol') not in ('http', 'https') or not info.get('url'):
+            return None
+        content_hash = remote_quick_hash(info['url'], info.get('http_headers'))
+        same = content_hash and self.media_index.lookup_hash(content_hash)
+        ext = "." + (audio_format or info.get('ext') or "")
+        return same if same and same.lower().endswith(ext.lower()) else None
+
+    def register_media(self, extractor, video_id, media_type, path, emit, format_id=None, height=None, content_hash=None):
+        """Ghi file vừa tải (kèm format/độ phân giải) vào chỉ mục; báo nếu nội dung trùng một file khác đã có.
+        content_hash: dấu vân tay file lúc vừa tải (trước hậu kỳ), không có thì tính từ file cuối"""
+        try:
+            content_hash = content_hash or quick_hash(path)
+            same = self.media_index.lookup_hash(content_hash, os.path.abspath(path))
+            if same: emit({'type': 'log', 'msg': f"Nội dung trùng với file đã có: {same}"})
+            self.media_index.add(extractor, video_id, media_type, path, content_hash, format_id, height)
+        except OSError:
+            pass
+
+    def check_space(self, work_dir, save_path, need, has_ffmpeg):
+        """Kiểm tra dung lượng trống trước khi tải (need=None: trang không báo dung lượng thì bỏ qua).
+        Hậu kỳ FFmpeg ghi thêm một bản đầy đủ (file .pp) trước khi thay file cũ nên thư mục tải cần gấp đôi."""
+        if not need: return
+        ensure_space(work_dir, need * (2 if has_ffmpeg else 1))
+        if work_dir != save_path: ensure_space(save_path, need)
+
+    def plan_parts(self, raw, quality_id, pick, has_ffmpeg):
+        """[video_id, audio_id] nếu format chọn là video-only cần ghép tiếng (tải riêng từng phần), None nếu tải một file là đủ"""
+        if not has_ffmpeg or quality_id in AUDIO_QUALITIES: return None
+        if pick: return [pick['format']['format_id'], pick['audio']['format_id']] if pick['audio'] else None
+        if not quality_id: return None
+        formats = [f for f in raw.get('formats') or [] if isinstance(f, dict)]
+        video = next((f for f in formats if f.get('format_id') == quality_id), None)
+        if not video or not has_video(video) or video.get('acodec') not in ('none', None): return None
+        audio = best_audio(formats, video.get('ext'), raw.get('duration'))
+        return [quality_id, audio['format_id']] if audio else None
+
+    def fetch_media(self, ydl, info, split, opts, cookie_content, hook, cancel_evt, emit, turbo=None):
+        """Tải một video, trả danh sách file đã ghi. info: info đã xử lý (chọn format) để tải một file;
+        có split thì là info thô, mỗi format trong split được xử lý từ một bản sao và tải riêng về file .f<format_id> (chưa ghép).
+        turbo: (connections, progress_hook, throttle, on_retry) để thử tải nhiều kết nối trước khi giao cho yt-dlp."""
+        import yt_dlp
+        from yt_dlp.utils import DownloadError
+
+        def fetch(session, item):
+            path = turbo and self.turbo_download(session, item, turbo[0], cancel_evt, turbo[1], emit, throttle=turbo[2], on_retry=turbo[3])
+            if not path:
+                # Tải thường: file tạm Turbo dở của lần trước (đã cấp phát đủ dung lượng) không dùng lại được
+                try: discard_partial(session.prepare_filename(item))
+                except: pass
+            return path or downloaded_path(session.process_ie_result(item, download=True))
+
+        if not split:
+            path = fetch(ydl, info)
+            return [path] if path else []
+        part_opts = dict(opts, outtmpl=os.path.splitext(opts['outtmpl'])[0] + ".f%(format_id)s.%(ext)s")
+        files = []
+        with self.ydl_pool.session(part_opts, cookie_content, hook=hook) as pydl:
+            for format_id in split:
+                if cancel_evt.is_set(): raise DownloadError("HUST_CANCELLED")
+                with format_override(pydl, format_id):
+                    path = fetch(pydl, pydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(info), download=False))
+                if not path: raise DownloadError(f"Không tải được format {format_id}")
+                files.append(path)
+        return files
+
+    def finish_media(self, files, info, extractor, media_type, audio_format, cancel_evt, emit, entry=None, dest=None, journal_key=None):
+        """Hậu kỳ file vừa tải (ghép, chuyển audio, nhúng metadata, đổi tên) rồi ghi chỉ mục + lịch sử.
+        Có bước FFmpeg -> giao cho pool hậu kỳ và trả True để thread tải nhận job tiếp; chỉ đổi tên thì chạy luôn.
+        entry: số thứ tự mục playlist (kết quả là entry_finished, lỗi chỉ cảnh báo).
+        dest: thư mục lưu khi tải vào thư mục tạm (bước cuối chuyển file sang đó).
+        journal_key: bản ghi journal được giữ tới khi hậu kỳ xong; mục playlist chỉ được đánh dấu xong lúc đó."""
+        has_ffmpeg = self.postproc.ffmpeg is not None
+        stages = ['merge'] if len(files) > 1 else []
+        if audio_format and files and has_ffmpeg and not files[0].lower().endswith("." + audio_format): stages.append('audio')
+        if files and has_ffmpeg and self.settings.get("embed_metadata", True): stages.append('embed')
+        stages.append('rename')
+        if dest: stages.append('move')
+        task = PostTask(files, stages, audio_format, media_meta(info), media_type, cancel_evt, dest=dest)
+        label = f"mục {entry + 1}" if entry is not None else "file"
+        # Dấu vân tay file đúng như trên server (trước khi hậu kỳ sửa nội dung): lần sau so được trước khi tải
+        source_hash = None
+        if len(files) == 1:
+            try: source_hash = quick_hash(files[0])
+            except OSError: pass
+
+        def done(path, task, error):
+            if task.timings:
+                emit({'type': 'log', 'msg': f"Hậu kỳ {label}: {format_timings(task.timings)}"})
+            for warning in task.warnings: emit({'type': 'log', 'level': 'WARN', 'msg': warning})
+            if error:
+                text = str(error)
+                if entry is not None: emit({'type': 'log', 'level': 'WARN', 'msg': f"Hậu kỳ {label} lỗi: {text}"})
+                elif 'HUST_CANCELLED' in text: emit({'type': 'cancelled'})
+                else: emit({'type': 'error', 'msg': f"Lỗi hậu kỳ: {text}"})
+            else:
+                if path: self.register_media(extractor, (info or {}).get('id'), media_type, path, emit, *quality_key(info), content_hash=source_hash)
+                title = os.path.basename(path) if path else (f"#{entry + 1}" if entry is not None else 'Done')
+                emit({'type': 'entry_finished' if entry is not None else 'finished', 'title': title, 'filepath': path,
+                      'media_type': media_type, 'history': self.record_history(title, path, media_type), 'post': dict(task.timings)})
+            if journal_key and entry is not None: self.journal.mark_entry(journal_key, entry)
+            if task.heavy:
+                emit({'type': 'postprocess_done', 'entry': entry, 'ok': error is None})
+                if journal_key: self.journal.release(journal_key)
+
+        if task.heavy:
+            if entry is None: emit({'type': 'status', 'msg': f"Đang hậu kỳ ({'/'.join(s for s in stages if s != 'rename')})..."})
+            if journal_key: self.journal.hold(journal_key)
+            try:
+                self.postproc.submit(task, done)
+            except Exception:
+                if journal_key: self.journal.release(journal_key)
+                raise
+            return True
+        try: done(self.postproc.run(task), task, None)
+        except Exception as e: done(None, task, e)
+        return False
+
+    def throttled(self, job_key, hook):
+        """Bọc progress hook: tính số byte mới nhận và nhường băng thông theo BandwidthScheduler"""
+        seen = {}
+        def wrapped(d):
+            hook(d)
+            if d.get('status') == 'downloading':
+                fname = d.get('tmpfilename') or d.get('filename')
+                got = d.get('downloaded_bytes') or 0
+                prev = seen.get(fname, 0)
+                seen[fname] = got
+                self.bw.consume(job_key, got - prev if got >= prev else got)
+        return wrapped
+
+    def turbo_download(self, ydl, info, connections, cancel_evt, hook, emit, throttle=None, on_retry=None):
+        """Tải format progressive (http/https, không cần ghép) bằng nhiều kết nối Range, trả đường dẫn file.
+        Trả False nếu không áp dụng được để gọi yt-dlp tải như bình thường."""
+        if not isinstance(info, dict) or info.get('requested_formats') or info.get('_type', 'video') != 'video':
+            return False
+        if info.get('protocol') not in ('http', 'https') or not info.get('url'):
+            return False
+        filename = ydl.prepare_filename(info)
+        if os.path.exists(filename): return False  # File đã có: để yt-dlp tự xử lý
+        t0 = time.perf_counter()
+        try:
+            segmented_download(info['url'], filename, connections, headers=info.get('http_headers'), cancel_evt=cancel_evt, progress_cb=hook, throttle=throttle, on_retry=on_retry)
+        except TurboUnsupported as ex:
+            emit({'type': 'log', 'msg': f"Turbo không áp dụng ({ex}) -> tải thường"})
+            return False
+        size = os.path.getsize(filename)
+        elapsed = time.perf_counter() - t0
+        emit({'type': 'log', 'msg': f"Turbo {connections} kết nối: {format_bytes(size)} trong {elapsed:.1f}s ({format_bytes(size / max(elapsed, 1e-6))}/s)"})
+        return filename
+
+    def download_playlist(self, url, base_opts, cookie_content, media_type, cancel_evt, emit, journal_key, job_id, quality_id=None, save_path=None):
+        """Tải playlist: lấy danh sách entry (extract_flat) rồi chia cho pool thread giới hạn.
+        Job không chọn chất lượng -> mỗi mục tự chọn format theo chính sách; file xong được đưa qua hậu kỳ"""
+        import yt_dlp
+        from yt_dlp.utils import DownloadError
+        from concurrent.futures import ThreadPoolExecutor
+
+        emit({'type': 'status', 'msg': 'Đang lấy danh sách Playlist...'})
+        work_dir = os.path.dirname(base_opts['outtmpl'])
+        save_path = save_path or work_dir
+        if self.settings.get("dup_policy", "skip") != "off": self.media_index.ensure_scanned(save_path)
+        flat_opts = dict(base_opts, extract_flat='in_playlist', noplaylist=False)
+        t0 = time.monotonic()
+        with self.ydl_pool.session(flat_opts, cookie_content) as ydl:
+            info = ydl.extract_info(url, download=False) or {}
+        self.metrics.extracted(job_id, info.get('extractor_key') or info.get('extractor'), time.monotonic() - t0)
+        self.metrics.update(job_id, turbo=bool(self.settings.get("turbo")))
+        entries = [e for e in (info.get('entries') or []) if isinstance(e, dict)]
+        targets = [(e, e.get('url') or e.get('webpage_url') or e.get('id')) for e in entries]
+        targets = [(e, t) for e, t in targets if t]
+        total = len(targets)
+        if not total: raise DownloadError("Playlist trống hoặc không đọc được danh sách")
+
+        lock = threading.Lock()
+        # Job khôi phục từ journal: bỏ qua các mục đã tải xong trước khi app bị kill
+        skip = set((self.journal.get(journal_key) or {}).get('done_entries') or []) if journal_key else set()
+        counts = {'done': len(skip), 'failed': 0}
+        emit({'type': 'playlist_progress', 'done': counts['done'], 'failed': 0, 'total': total})
+
+        dup_policy = self.settings.get("dup_policy", "skip")
+        has_ffmpeg = shutil.which("ffmpeg") is not None
+
+        def download_entry(idx, entry, entry_url):
+            LOG_CONTEXT.job_id = job_id  # Thread của pool -> gắn log yt-dlp về đúng job
+            last = None
+            extractor = entry.get('ie_key') or entry.get('extractor_key')
+            wanted = quality_id if quality_id not in AUDIO_QUALITIES else None
+            if dup_policy != "off":
+                existing = self.media_index.lookup(extractor, entry.get('id'), media_type, wanted)
+                if existing:
+                    reused = self.reuse_existing(existing, save_path, dup_policy)
+                    with lock:
+                        counts['done'] += 1
+                        snapshot = dict(counts)
+                    if journal_key: self.journal.mark_entry(journal_key, idx)
+                    emit({'type': 'log', 'msg': f"Mục {idx + 1}/{total} đã có sẵn: {reused}"})
+                    emit({'type': 'playlist_progress', 'done': snapshot['done'], 'failed': snapshot['failed'], 'total': total})
+                    return
+
+            def hook(d):
+                nonlocal last
+                if cancel_evt.is_set(): raise DownloadError("HUST_CANCELLED")
+                if d.get('status') == 'finished':
+                    last = d.get('filename')
+                elif d.get('status') == 'downloading':
+                    emit(dict(progress_event(d), type='progress', entry=idx, entries=total))
+
+            opts = dict(base_opts, noplaylist=True)
+            session_hook = self.throttled(job_id, hook)
+            error = None
+            files, info = [], entry
+            for attempt in range(PLAYLIST_RETRIES + 1):
+                if cancel_evt.is_set(): return
+                try:
+                    with self.ydl_pool.session(opts, cookie_content, hook=session_hook) as ydl:
+                        raw = ydl.extract_info(entry_url, download=False, process=False)
+                        pick = None if quality_id else self.policy_format(raw, raw.get('extractor_key') or extractor, has_ffmpeg)
+                        split = self.plan_parts(raw, quality_id, pick, has_ffmpeg)
+                        with format_override(ydl, pick and pick['spec']):
+                            info = ydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(raw) if split else raw, download=False)
+                            self.check_space(work_dir, save_path, expected_size(raw, split) if split else expected_size(info), has_ffmpeg)
+                            # Đã có bản chất lượng khác của mục này -> tải sang tên riêng, giữ bản cũ
+                            other = dup_policy != "off" and wanted and self.media_index.lookup(extractor, info.get('id'), media_type)
+                            entry_opts = dict(opts, outtmpl=quality_outtmpl(opts['outtmpl'], info)) if other else opts
+                            with outtmpl_override(ydl, entry_opts['outtmpl']):
+                                files = self.fetch_media(ydl, raw if split else info, split, entry_opts, cookie_content, session_hook, cancel_evt, emit)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if cancel_evt.is_set(): return
+                    if isinstance(e, NotEnoughSpace): break
+                    if attempt < PLAYLIST_RETRIES:
+                        emit({'type': 'log', 'level': 'WARN', 'msg': f"Thử lại mục {idx + 1}/{total} (lần {attempt + 1}): {e}"})
+                        cancel_evt.wait(2 * (attempt + 1))
+
+            with lock:
+                counts['failed' if error else 'done'] += 1
+                snapshot = dict(counts)
+            if error:
+                emit({'type': 'log', 'level': 'WARN', 'msg': f"Bỏ qua mục {idx + 1}/{total}: {error}"})
+            else:
+                if not files and last: files = [last]
+                self.finish_media(files, info, extractor, media_type, AUDIO_QUALITIES.get(quality_id), cancel_evt, emit, entry=idx,
+                                  dest=save_path if work_dir != save_path else None, journal_key=journal_key)
+            emit({'type': 'playlist_progress', 'done': snapshot['done'], 'failed': snapshot['failed'], 'total': total})
+
+        with ThreadPoolExecutor(max_workers=min(PLAYLIST_WORKERS, total)) as pool:
+            for idx, (entry, entry_url) in enumerate(targets):
+                if idx not in skip: pool.submit(download_entry, idx, entry, entry_url)
+
+        if not cancel_evt.is_set():
+            emit({'type': 'playlist_done', 'done': counts['done'], 'failed': counts['failed'], 'total': total})
+
+    def run_job(self, job):
+        journal_key = job.meta.get('journal_key')
+        self.bw.register(job.job_id)
+        LOG_CONTEXT.job_id = job.job_id
+        self.metrics.begin(job.job_id, queued_t=job.created, url=job.url, title=job.meta.get('title'))
+        try:
+            self.run_download(job.url, job.quality_id, job.is_playlist, job.save_path, job.cookie_content, job.cancel_event, job_id=job.job_id, journal_key=journal_key)
+        finally:
+            self.bw.unregister(job.job_id)
+            LOG_CONTEXT.job_id = None
+            # Job đã kết thúc (xong/lỗi/hủy) -> không cần khôi phục nữa, trừ khi hậu kỳ còn chờ trong pool
+            if journal_key: self.journal.finish(journal_key)
+
+    def policy_allows_start(self):
+        """Chính sách cho job trong hàng đợi: luôn / chỉ Wi-Fi / chỉ trong khung giờ"""
+        policy = self.settings.get("bw_policy", "always")
+        if policy == "wifi":
+            return network_is_unmetered() is not False
+        if policy == "offpeak":
+            return in_time_window(int(self.settings.get("offpeak_start", 0)), int(self.settings.get("offpeak_end", 6)))
+        return True
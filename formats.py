@@ -0,0 +1,175 @@
+"""Xếp hạng format theo chính sách người dùng (độ phân giải tối đa, ngân sách dung lượng, codec ưu tiên).
+Dùng cho danh sách chất lượng khi phân tích và để tự chọn format cho job không chọn tay (batch/API/playlist)."""
+import json
+import os
+import threading
+
+# Codec có giải mã phần cứng phổ biến hơn được ưu tiên khi không chỉ định codec
+HW_DECODE_RANK = {"h264": 4, "hevc": 3, "vp9": 2, "av1": 1, "vp8": 1}
+CODEC_PREFIXES = (("avc", "h264"), ("h264", "h264"), ("hvc", "hevc"), ("hev", "hevc"), ("h265", "hevc"),
+                  ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"), ("av01", "av1"), ("av1", "av1"))
+AUDIO_FOR_EXT = {"mp4": "m4a", "webm": "webm"}
+
+
+def codec_family(vcodec):
+    vcodec = (vcodec or "").lower()
+    for prefix, family in CODEC_PREFIXES:
+        if vcodec.startswith(prefix): return family
+    return None
+
+
+def estimate_size(f, duration=None):
+    """Dung lượng (byte) của format: filesize > filesize_approx > bitrate * thời lượng, không rõ thì None"""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size: return int(size)
+    if f.get('tbr') and duration: return int(f['tbr'] * duration * 125)
+    return None
+
+
+def has_video(f):
+    return f.get('vcodec') != 'none' and bool(f.get('height'))
+
+
+def best_audio(formats, video_ext=None, duration=None):
+    """Audio-only tốt nhất, ưu tiên container ghép được với video (m4a cho mp4, webm cho webm)"""
+    audios = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in ('none', None)]
+    want = AUDIO_FOR_EXT.get(video_ext)
+    audios.sort(key=lambda f: (f.get('ext') == want, f.get('abr') or f.get('tbr') or 0, estimate_size(f, duration) or 0), reverse=True)
+    return audios[0] if audios else None
+
+
+class FormatPolicy:
+    """Chính sách chọn format (các giá trị 0/"auto" = không ràng buộc)."""
+    def __init__(self, max_height: int = 0, size_budget: int = 0, codec: str = "auto", ext: str = None):
+        self.max_height = int(max_height or 0)    # 0 = không giới hạn
+        self.size_budget = int(size_budget or 0)  # byte, 0 = không giới hạn
+        self.codec = codec or "auto"
+        self.ext = ext                             # container ưu tiên (học từ lựa chọn trước), None = mp4
+
+    @classmethod
+    def from_settings(cls, settings, learned=None):
+        """Chính sách chung trong Cài đặt, kết hợp lựa chọn đã nhớ cho extractor (nếu có)"""
+        policy = cls(settings.get("fmt_max_height", 0), int(settings.get("fmt_size_budget_mb", 0) or 0) * 1024 * 1024,
+                     settings.get("fmt_codec", "auto"))
+        if learned:
+            heights = [h for h in (policy.max_height, learned.get('max_height')) if h]
+            policy.max_height = min(heights) if heights else 0
+            if policy.codec == "auto": policy.codec = learned.get('codec') or "auto"
+            policy.ext = learned.get('ext')
+        return policy
+
+    def __repr__(self):
+        return f"FormatPolicy(max_height={self.max_height}, size_budget={self.size_budget}, codec={self.codec}, ext={self.ext})"
+
+    def score(self, height, size, codec, fps, ext, muxed, tbr):
+        """Khóa sắp xếp (lớn hơn = tốt hơn): trong giới hạn độ phân giải > vừa ngân sách > cao hơn > codec > fps..."""
+        fits_h = not self.max_height or height <= self.max_height
+        fits_size = not self.size_budget or size is None or size <= self.size_budget
+        # Vượt giới hạn thì chọn cái "vượt ít nhất": thấp hơn / nhỏ hơn
+        first = (height if fits_h else -height) if fits_size else -size
+        codec_rank = (codec == self.codec if self.codec != "auto" else True, HW_DECODE_RANK.get(codec, 0))
+        return (fits_h, fits_size, first, codec_rank, fps or 0, muxed, ext == (self.ext or "mp4"), tbr or 0)
+
+
+def rank_formats(formats, policy, has_ffmpeg=True, duration=None):
+    """Các lựa chọn video xếp từ tốt tới kém theo policy. Mỗi mục: format, audio ghép kèm (nếu cần),
+    spec truyền cho yt-dlp, dung lượng ước tính. Không có FFmpeg thì chỉ xét format đã ghép sẵn tiếng."""
+    formats = [f for f in formats or [] if isinstance(f, dict) and f.get('format_id')]
+    audio_cache = {}
+    ranked = []
+    for f in formats:
+        if not has_video(f) or f.get('height') < 144: continue
+        muxed = f.get('acodec') not in ('none', None)
+        audio = None
+        if not muxed:
+            if not has_ffmpeg: continue
+            ext = f.get('ext')
+            if ext not in audio_cache: audio_cache[ext] = best_audio(formats, ext, duration)
+            audio = audio_cache[ext]
+        size = estimate_size(f, duration)
+        if size is not None and audio is not None:
+            audio_size = estimate_size(audio, duration)
+            size = size + audio_size if audio_size else size
+        codec = codec_family(f.get('vcodec'))
+        ranked.append({
+            'format': f, 'audio': audio, 'size': size, 'codec': codec,
+            'spec': f"{f['format_id']}+{audio['format_id']}" if audio else f['format_id'],
+            'key': policy.score(f['height'], size, codec, f.get('fps'), f.get('ext'), muxed, f.get('tbr')),
+        })
+    ranked.sort(key=lambda r: r['key'], reverse=True)
+    return ranked
+
+
+def build_options(info, policy, has_ffmpeg=True, format_bytes=str):
+    """Danh sách chất lượng cho dropdown: Audio (M4A, MP3 nếu có FFmpeg) + mỗi độ phân giải một lựa chọn tốt nhất theo policy,
+    kèm dung lượng ước tính. Trả (options, recommended_key)."""
+    formats = [f for f in info.get('formats') or [] if isinstance(f, dict)]
+    duration = info.get('duration')
+    ranked = rank_formats(formats, policy, has_ffmpeg, duration)
+
+    def size_text(size):
+        return f" ~{format_bytes(size)}" if size else ""
+
+    audio = best_audio(formats, "mp4", duration)
+    options = [{"key": "audio", "text": "🎵 Audio M4A (Nhạc)" + size_text(audio and estimate_size(audio, duration))}]
+    if has_ffmpeg: options.append({"key": "audio_mp3", "text": "🎵 Audio MP3 (chuyển bằng FFmpeg)"})
+    best_per_height = {}
+    for r in ranked:
+        best_per_height.setdefault(r['format']['height'], r)
+    recommended = ranked[0]['format']['format_id'] if ranked else None
+    for h in sorted(best_per_height, reverse=True):
+        r = best_per_height[h]
+        f = r['format']
+        fps = f"{int(f['fps'])}" if (f.get('fps') or 0) > 30 else ""
+        details = " · ".join(x for x in (f.get('ext'), r['codec']) if x)
+        star = "⭐ " if f['format_id'] == recommended else ""
+        over = " ⚠ vượt giới hạn" if not (r['key'][0] and r['key'][1]) else ""
+        options.append({"key": f['format_id'], "text": f"{star}🎬 Video {h}p{fps} ({details}){size_text(r['size'])}{over}"})
+    return options, recommended
+
+
+def learned_policy(f):
+    """Chính sách rút ra từ format người dùng tự chọn: dùng lại cho job tự động cùng extractor"""
+    return {'max_height': f.get('height') or 0, 'codec': codec_family(f.get('vcodec')), 'ext': f.get('ext')}
+
+
+class FormatPolicyStore:
+    """Lựa chọn format đã nhớ theo extractor (JSON trong thư mục dữ liệu app).
+    Job batch/API/playlist không có UI chọn chất lượng sẽ theo lựa chọn gần nhất của người dùng trên cùng trang."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._data = data if isinstance(data, dict) else {}
+        except Exception:
+            self._data = {}
+
+    def get(self, extractor):
+        with self._lock: return self._data.get(extractor or "")
+
+    def remember(self, extractor, f):
+        if not extractor or not has_video(f): return
+        learned = learned_policy(f)
+        with self._lock:
+            if self._data.get(extractor) == learned: return
+            self._data[extractor] = learned
+            self._save_locked()
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._save_locked()
+
+    def __len__(self):
+        with self._lock: return len(self._data)
+
+    def _save_locked(self):
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
@@ -1,15 +1,20 @@
+import sys
+import time
+
+APP_START = time.perf_counter()  # Mốc đo thời gian khởi động, trước mọi import nặng (flet, engine)
+
+if __name__ == "__main__" and ("--batch" in sys.argv[1:] or "--serve" in sys.argv[1:]):
+    # Chế độ dòng lệnh: chạy lõi tải không cần giao diện (không import flet)
+    from cli import batch_main, serve_main
+    sys.exit(batch_main(sys.argv[1:]) if "--batch" in sys.argv[1:] else serve_main(sys.argv[1:]))
+
 import flet as ft
 import os
 import threading
-import time
-import queue
-import tempfile
-import shutil
-import sys
-import traceback
-import re
-import unicodedata
-from datetime import datetime
+import uuid
+from api import ControlServer, API_DEFAULT_PORT
+from engine import (EventChannel, UIPump, LogStore, DownloadEngine, DEFAULT_SETTINGS, ANALYZE_OPTS,
+                    format_bytes, progress_fraction, prepare_save_path, find_url, is_supported_url)
 
 # --- CẤU HÌNH ---
 VERSION = "v8.2 Enterprise (Final Auto-Fix)"
@@ -17,72 +22,40 @@ COLOR_PRIMARY = "#d32f2f"
 COLOR_BG = "#121212"
 HISTORY_KEY = "hust_history_v1"
 SETTINGS_KEY = "hust_settings_v1"
+LOG_VIEW_LINES = 200         # Số dòng log hiển thị trên UI
+HISTORY_PAGE_SIZE = 50       # Số dòng lịch sử dựng mỗi lần (cuộn tới cuối thì tải thêm)
+HISTORY_SEARCH_DELAY = 0.3   # Giây, ngừng gõ chừng này mới tìm (không đếm + truy vấn theo từng phím)
+STATS_VIEW_ROWS = 50         # Số job gần nhất hiện trong tab Thống kê (file xuất có đủ)
+STARTUP_BUDGET_MS = 1500     # Ngưỡng cảnh báo thời gian hiện UI khi khởi động
+CLIPBOARD_POLL_SEC = 1.5     # Chu kỳ đọc clipboard khi bật Tự động bắt Link
+
+# --- UI ---
+
+def make_history_row(item):
+    """Một dòng trong tab Lịch sử (ở mức module để benchmark đo được thời gian dựng)"""
+    icon = ft.icons.MUSIC_NOTE if item.get('type') == 'audio' else ft.icons.VIDEO_FILE
+    return ft.Container(
+        content=ft.Row([
+            ft.Icon(icon, color="orange"),
+            ft.Column([
+                ft.Text(item.get('title',''), weight="bold", no_wrap=True, max_lines=1, width=200),
+                ft.Text(f"{item.get('date')} | {item.get('path')}", size=10, color="grey")
+            ], spacing=2),
+            ft.Icon(ft.icons.CHECK_CIRCLE, color="green", size=16)
+        ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+        bgcolor="#1e1e1e", padding=10, border_radius=10
+    )
 
-# --- HELPER FUNCTIONS ---
+def fmt_secs(v):
+    return f"{v:.2f}s" if v is not None else "--"
 
-def safe_put(q, item):
-    """Đẩy dữ liệu vào queue an toàn, tránh tràn bộ nhớ"""
-    try:
-        q.put_nowait(item)
-    except queue.Full:
-        try:
-            q.get_nowait()
-            q.put_nowait(item)
-        except:
-            pass
-
-def slugify_and_truncate(name: str, max_length: int = 100):
-    """Làm sạch tên file để tránh lỗi hệ thống Android"""
-    if not name: return "file"
-    # Chuẩn hóa Unicode
-    name = unicodedata.normalize("NFKD", name)
-    # Loại bỏ ký tự đặc biệt, chỉ giữ lại chữ, số, gạch ngang, chấm
-    name = re.sub(r'[^\w\s\.-]', '', name).strip()
-    name = re.sub(r'\s+', ' ', name)
-    
-    if len(name) <= max_length: return name
-    
-    # Cắt ngắn nhưng giữ đuôi file
-    parts = os.path.splitext(name)
-    base = parts[0][: max_length - len(parts[1]) - 1]
-    return base + parts[1]
-
-def safe_rename_downloaded_file(filepath: str, max_title_len: int = 80):
-    """Đổi tên file sau khi tải về để đảm bảo an toàn"""
-    try:
-        if not filepath or not os.path.exists(filepath): return filepath
-        folder, fname = os.path.split(filepath)
-        title, ext = os.path.splitext(fname)
-        
-        # Thử tách phần ID phía sau (thường yt-dlp thêm ID vào cuối)
-        parts = title.rsplit('-', 1)
-        if len(parts) == 2 and len(parts[1]) <= 20 and all(c.isalnum() for c in parts[1]):
-            base, idpart = parts
-            new_base = slugify_and_truncate(base, max_length=max_title_len)
-            new_name = f"{new_base}-{idpart}{ext}"
-        else:
-            new_base = slugify_and_truncate(title, max_length=max_title_len)
-            new_name = f"{new_base}{ext}"
-            
-        new_path = os.path.join(folder, new_name)
-        
-        # Tránh ghi đè file cũ (thêm số _1, _2...)
-        i = 1
-        candidate = new_path
-        while os.path.exists(candidate) and candidate != filepath:
-            candidate = os.path.join(folder, f"{os.path.splitext(new_name)[0]}_{i}{ext}")
-            i += 1
-            
-        if candidate != filepath:
-            os.rename(filepath, candidate)
-            return candidate
-        return filepath
-    except:
-        return filepath
+def make_stats_row(cells):
+    return ft.DataRow(cells=[ft.DataCell(ft.Text(str(c), size=11)) for c in cells])
 
 # --- MAIN APP ---
 
 def main(page: ft.Page):
+    t_main = time.perf_counter()
     # 1. CẤU HÌNH PAGE
     page.title = "HUST Downloader Ultimate"
     page.theme_mode = ft.ThemeMode.DARK
@@ -101,43 +74,31 @@ def main(page: ft.Page):
     ctrl_width = min(760, max(360, int(win_w * 0.9)))
 
     # State Management
-    progress_queue = queue.Queue(maxsize=2000)
-    cancel_event = threading.Event()
+    progress_queue = EventChannel()
     
     # Load Data
-    default_settings = {"smart_clipboard": True, "cookies": "", "theme_color": "red"}
+    default_settings = dict(DEFAULT_SETTINGS, smart_clipboard=True, theme_color="red",
+                            api_enabled=False, api_lan=False, api_port=API_DEFAULT_PORT, api_token="")
     raw_settings = page.client_storage.get(SETTINGS_KEY)
     user_settings = raw_settings if isinstance(raw_settings, dict) else default_settings
-    
+
+    # Lõi tải dùng chung với chế độ --batch; UI chỉ đọc sự kiện từ progress_queue
+    engine = DownloadEngine(user_settings, progress_queue)
+    scheduler, journal, bw, history, log_store = engine.scheduler, engine.journal, engine.bw, engine.history, engine.log_store
+    # Chuyển lịch sử cũ (tối đa 50 dòng trong client_storage) sang SQLite một lần
     raw_history = page.client_storage.get(HISTORY_KEY)
-    download_history = raw_history if isinstance(raw_history, list) else []
+    if isinstance(raw_history, list) and raw_history:
+        history.add_many(raw_history)
+        page.client_storage.remove(HISTORY_KEY)
 
     # --- HELPERS ---
-    def add_log(msg: str):
-        now = datetime.now().strftime("%H:%M:%S")
-        new = f"{now} | {msg}\n"
-        # Giới hạn log tránh tràn RAM
-        log_field.value = (new + log_field.value)[:10000]
+    def add_log(msg: str, level: str = "INFO", job_id=None):
+        # Chỉ ghi vào bộ đệm vòng; UI tự lấy phần đuôi mới khi xả sự kiện
+        log_store.add(msg, level, job_id)
 
-    def prepare_save_path(path: str):
-        try:
-            if not path: path = "."
-            os.makedirs(path, exist_ok=True)
-            # Test quyền ghi
-            testfile = os.path.join(path, ".hust_write_test")
-            with open(testfile, "w") as f: f.write("ok")
-            os.remove(testfile)
-            return True, path
-        except Exception as ex:
-            return False, str(ex)
-
-    def save_history(item):
-        nonlocal download_history
-        if not isinstance(item, dict): return
-        download_history.insert(0, item)
-        download_history = download_history[:50]
-        page.client_storage.set(HISTORY_KEY, download_history)
-        update_history_tab()
+    def show_history(item):
+        # Engine đã ghi vào DB; tab Lịch sử chưa mở lần nào thì chưa cần dựng, đã mở thì chỉ chèn đúng một dòng
+        if isinstance(item, dict) and lazy_built.get(1): insert_history_row(item)
 
     def detect_default_path():
         candidates = [
@@ -160,151 +121,111 @@ def main(page: ft.Page):
     lbl_info = ft.Text("", color="grey", size=12)
     prg_bar = ft.ProgressBar(width=ctrl_width, color="orange", bgcolor="#333333", visible=False, value=0)
     lbl_status = ft.Text("Sẵn sàng", size=14, color="green", text_align="center")
-    log_field = ft.TextField(label="Nhật ký (Logs)", multiline=True, read_only=True, expand=True, height=150, value="", text_size=10, bgcolor="black", color="#00FF00")
+    lv_log = ft.ListView(height=150, spacing=0, auto_scroll=True)
+    dd_log_level = ft.Dropdown(width=120, dense=True, value="INFO", text_size=11,
+                               options=[ft.dropdown.Option(key=k, text=k) for k in ("DEBUG", "INFO", "WARN", "ERROR")])
+    log_panel = ft.Container(content=ft.Column([
+        ft.Row([ft.Text("Nhật ký (Logs)", size=12, color="grey"), dd_log_level], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+        lv_log
+    ], spacing=2), bgcolor="black", padding=6, border_radius=6, width=ctrl_width)
 
     btn_analyze = ft.ElevatedButton("PHÂN TÍCH LINK", icon=ft.icons.ANALYTICS, bgcolor="blue", color="white", width=180)
     btn_download = ft.ElevatedButton("TẢI XUỐNG", icon=ft.icons.DOWNLOAD, bgcolor="green", color="white", width=180, visible=False)
-    btn_cancel = ft.ElevatedButton("HỦY", icon=ft.icons.CANCEL, bgcolor="red", color="white", visible=False, disabled=True)
+    btn_cancel = ft.ElevatedButton("HỦY TẤT CẢ", icon=ft.icons.CANCEL, bgcolor="red", color="white", visible=False, disabled=True)
+    cb_priority = ft.Checkbox(label="Ưu tiên (tải trước các job đang chờ)", value=False, visible=False)
+    lv_jobs = ft.Column(spacing=5, width=ctrl_width)
+    lbl_resume = ft.Text("", size=12)
+    btn_resume = ft.TextButton("TIẾP TỤC", icon=ft.icons.PLAY_ARROW)
+    btn_resume_skip = ft.TextButton("BỎ QUA", icon=ft.icons.CLOSE)
+    box_resume = ft.Container(content=ft.Row([ft.Icon(ft.icons.RESTORE, color="orange"), lbl_resume, btn_resume, btn_resume_skip], wrap=True),
+                              bgcolor="#2a1e00", padding=8, border_radius=8, width=ctrl_width, visible=False)
     
     txt_cookies = ft.TextField(label="Cookies (Netscape format)", multiline=True, min_lines=3, max_lines=5, hint_text="Dán nội dung cookies.txt", text_size=12, value=user_settings.get("cookies", ""))
     sw_smart_clip = ft.Switch(label="Tự động bắt Link", value=user_settings.get("smart_clipboard", True))
+    sw_verbose_log = ft.Switch(label="Log chi tiết của yt-dlp (debug)", value=user_settings.get("verbose_log", False))
+    sw_log_file = ft.Switch(label="Ghi log ra file (app.log, xoay vòng)", value=user_settings.get("log_to_file", False))
+    sw_embed_meta = ft.Switch(label="Nhúng tiêu đề, kênh và ảnh bìa vào file (cần FFmpeg)", value=user_settings.get("embed_metadata", True))
+    txt_scratch_dir = ft.TextField(label="Thư mục tạm (bộ nhớ trong, để trống = tải thẳng vào thư mục lưu)", text_size=12,
+                                   value=user_settings.get("scratch_dir", ""), hint_text="Tải + hậu kỳ ở đây rồi chuyển một lần sang thẻ nhớ")
+    dd_workers = ft.Dropdown(label="Số job tải song song", width=200, value=str(user_settings.get("max_workers", 2)),
+                             options=[ft.dropdown.Option(str(n)) for n in range(1, 6)])
+    dd_bw_limit = ft.Dropdown(label="Giới hạn băng thông (tất cả job)", width=260, value=str(user_settings.get("bw_limit_kbps", 0)),
+                              options=[ft.dropdown.Option(key=str(k), text=t) for k, t in
+                                       ((0, "Không giới hạn"), (256, "256 KiB/s"), (512, "512 KiB/s"), (1024, "1 MiB/s"), (2048, "2 MiB/s"), (5120, "5 MiB/s"))])
+    dd_bw_policy = ft.Dropdown(label="Bắt đầu job trong hàng đợi", width=260, value=user_settings.get("bw_policy", "always"),
+                               options=[ft.dropdown.Option(key="always", text="Luôn luôn"),
+                                        ft.dropdown.Option(key="wifi", text="Chỉ khi dùng Wi-Fi"),
+                                        ft.dropdown.Option(key="offpeak", text="Chỉ trong khung giờ")])
+    hour_options = [ft.dropdown.Option(str(h)) for h in range(24)]
+    dd_offpeak_start = ft.Dropdown(label="Từ giờ", width=120, value=str(user_settings.get("offpeak_start", 0)), options=hour_options)
+    dd_offpeak_end = ft.Dropdown(label="Đến giờ", width=120, value=str(user_settings.get("offpeak_end", 6)), options=hour_options)
+    dd_dup_policy = ft.Dropdown(label="Khi video đã tải trước đó", width=260, value=user_settings.get("dup_policy", "skip"),
+                                options=[ft.dropdown.Option(key="skip", text="Bỏ qua, dùng file cũ"),
+                                         ft.dropdown.Option(key="link", text="Tạo liên kết tới file cũ"),
+                                         ft.dropdown.Option(key="off", text="Vẫn tải lại")])
+    dd_fmt_height = ft.Dropdown(label="Độ phân giải tối đa", width=200, value=str(user_settings.get("fmt_max_height", 0)),
+                                options=[ft.dropdown.Option(key=str(h), text=f"{h}p" if h else "Không giới hạn") for h in (0, 360, 480, 720, 1080, 1440, 2160)])
+    dd_fmt_budget = ft.Dropdown(label="Dung lượng tối đa mỗi video", width=200, value=str(user_settings.get("fmt_size_budget_mb", 0)),
+                                options=[ft.dropdown.Option(key=str(m), text=f"{m} MB" if m else "Không giới hạn") for m in (0, 50, 100, 250, 500, 1000, 2000)])
+    dd_fmt_codec = ft.Dropdown(label="Codec ưu tiên", width=200, value=user_settings.get("fmt_codec", "auto"),
+                               options=[ft.dropdown.Option(key="auto", text="Tự động (giải mã phần cứng)"), ft.dropdown.Option(key="h264", text="H.264"),
+                                        ft.dropdown.Option(key="vp9", text="VP9"), ft.dropdown.Option(key="av1", text="AV1"), ft.dropdown.Option(key="hevc", text="HEVC")])
+    btn_fmt_forget = ft.TextButton("Quên lựa chọn đã nhớ theo trang", icon=ft.icons.DELETE_SWEEP)
+    sw_turbo = ft.Switch(label="Chế độ Turbo (tải nhiều kết nối)", value=bool(user_settings.get("turbo", False)))
+    dd_turbo_conn = ft.Dropdown(label="Số kết nối Turbo", width=200, value=str(user_settings.get("turbo_connections", 4)),
+                                options=[ft.dropdown.Option(str(n)) for n in (2, 4, 8, 16)])
+    sw_api = ft.Switch(label="Bật API điều khiển (HTTP + SSE)", value=bool(user_settings.get("api_enabled", False)))
+    sw_api_lan = ft.Switch(label="Cho phép máy khác trong LAN truy cập", value=bool(user_settings.get("api_lan", False)))
+    txt_api_port = ft.TextField(label="Cổng API", width=140, value=str(user_settings.get("api_port", API_DEFAULT_PORT)), keyboard_type=ft.KeyboardType.NUMBER)
+    lbl_api = ft.Text("API đang tắt", size=11, color="grey", selectable=True)
     btn_save_settings = ft.ElevatedButton("LƯU CÀI ĐẶT", icon=ft.icons.SAVE, bgcolor=COLOR_PRIMARY, color="white")
 
-    # --- WORKERS (LOGIC) ---
-
-    def run_analyze(url, q):
-        try:
-            import yt_dlp
-            # Kiểm tra FFmpeg để lọc video câm
-            has_ffmpeg = shutil.which("ffmpeg") is not None
-            
-            opts = {
-                'quiet': True, 'no_warnings': True, 'extract_flat': True,
-                'http_headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-            }
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                is_playlist = False
-                if isinstance(info, dict) and 'entries' in info:
-                    is_playlist = True
-                    try:
-                        first = info['entries'][0]
-                        sub = first.get('url') or first.get('id')
-                        info = ydl.extract_info(sub, download=False)
-                    except: pass 
-                
-                formats = info.get('formats', [])
-                formats = [f for f in formats if isinstance(f, dict)]
-                formats.sort(key=lambda x: x.get('height') or 0, reverse=True)
-                
-                options = []
-                options.append({"key": "audio", "text": "🎵 Audio M4A (Nhạc)"})
-                seen = set()
-                
-                for f in formats:
-                    fid = f.get('format_id')
-                    h = f.get('height')
-                    ext = f.get('ext')
-                    acodec = f.get('acodec') # Codec âm thanh
-                    
-                    if h and ext in ['mp4', 'webm'] and h >= 144:
-                        # [FIX QUAN TRỌNG] Nếu không có FFmpeg VÀ video này không có tiếng (acodec='none') -> BỎ QUA
-                        # Để tránh người dùng tải về file chỉ có hình
-                        if not has_ffmpeg and acodec == 'none':
-                            continue
-
-                        if h not in seen:
-                            seen.add(h)
-                            note = ""
-                            if acodec == 'none': note = " (🔇 Không tiếng)"
-                            options.append({"key": fid, "text": f"🎬 Video {h}p ({ext}){note}"})
-                            
-                q.put({'type': 'analyze_done', 'options': options, 'title': info.get('title', 'Unknown'), 'is_playlist': is_playlist})
-        except Exception as e:
-            safe_put(q, {'type': 'error', 'msg': f"Lỗi phân tích: {e}"})
-
-    def run_download(url, quality_id, is_playlist, save_path, cookie_content, cancel_evt, q):
-        cookie_file = None
-        last_filepath = None
-        try:
-            import yt_dlp
-            from yt_dlp.utils import DownloadError
-            
-            ok, msg = prepare_save_path(save_path)
-            if not ok:
-                safe_put(q, {'type': 'error', 'msg': f"Lỗi thư mục: {msg}"})
-                return
-
-            if cookie_content and cookie_content.strip():
-                tf = tempfile.NamedTemporaryFile(mode="w", delete=False, prefix="hust_", suffix=".txt")
-                tf.write(cookie_content)
-                tf.flush(); tf.close()
-                cookie_file = tf.name
-
-            def progress_hook(d):
-                nonlocal last_filepath
-                if cancel_evt.is_set(): raise DownloadError("HUST_CANCELLED")
-                if d.get('status') == 'finished':
-                    last_filepath = d.get('filename')
-                safe_put(q, {'type': 'progress', 'd': d})
-
-            has_ffmpeg = shutil.which("ffmpeg") is not None
-            if not has_ffmpeg: safe_put(q, {'type': 'log', 'msg': 'Không có FFmpeg -> Chế độ tương thích.'})
-
-            # [FIX] Tên file ngắn + Mạng trâu bò (Retries)
-            outtmpl = os.path.join(save_path, "%(title).50s-%(id)s.%(ext)s")
-            
-            opts = {
-                'outtmpl': outtmpl,
-                'quiet': True, 'no_warnings': True, 'nocheckcertificate': True,
-                'restrictfilenames': True,
-                'progress_hooks': [progress_hook],
-                'http_headers': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'},
-                'noplaylist': not bool(is_playlist),
-                # [FIX QUAN TRỌNG] Tự động thử lại khi rớt mạng
-                'socket_timeout': 30, 
-                'retries': 10, 
-                'fragment_retries': 10
-            }
-            if cookie_file: opts['cookiefile'] = cookie_file
-
-            media_type = 'video'
-            if quality_id == "audio":
-                opts['format'] = 'bestaudio[ext=m4a]/bestaudio/best'
-                media_type = 'audio'
-            elif quality_id:
-                if has_ffmpeg:
-                    opts['format'] = f"{quality_id}+bestaudio/best"
-                else:
-                    opts['format'] = f"{quality_id}/best[ext=mp4]/best"
-            else:
-                opts['format'] = "best[ext=mp4]/best"
-
-            safe_put(q, {'type': 'status', 'msg': 'Đang kết nối Server...'})
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                ydl.download([url])
-                
-                # [FIX] Đổi tên file an toàn sau khi tải xong
-                final_path = last_filepath
-                if last_filepath:
-                    final_path = safe_rename_downloaded_file(last_filepath)
-                
-                safe_put(q, {'type': 'finished', 'title': os.path.basename(final_path) if final_path else 'Done', 'filepath': final_path, 'media_type': media_type})
-
-        except Exception as e:
-            text = str(e)
-            if 'HUST_CANCELLED' in text or 'Cancelled' in text:
-                safe_put(q, {'type': 'cancelled'})
-            else:
-                safe_put(q, {'type': 'error', 'msg': text})
-        finally:
-            if cookie_file and os.path.exists(cookie_file):
-                try: os.remove(cookie_file)
-                except: pass
-            safe_put(q, {'type': 'worker_done'})
+    job_rows = {}  # job_id -> controls của dòng job trong lv_jobs
+    current_title = ""
+    MAX_JOB_ROWS = 30
+
+    def add_job_row(job_id, title):
+        # Job từ API hiện dòng qua sự kiện 'queued', job từ UI thì ngay khi bấm -> không thêm trùng
+        if job_id in job_rows: return
+        lbl = ft.Text("Đang chờ...", size=11, color="grey")
+        bar = ft.ProgressBar(value=0, color="orange", bgcolor="#333333")
+        btn = ft.IconButton(ft.icons.CLOSE, icon_color="red", tooltip="Hủy job", on_click=lambda e, jid=job_id: cancel_job_click(jid))
+        row = ft.Container(
+            content=ft.Row([
+                ft.Column([
+                    ft.Text(f"#{job_id} {title}", size=12, weight="bold", no_wrap=True, max_lines=1),
+                    lbl, bar
+                ], spacing=2, expand=True),
+                btn
+            ]),
+            bgcolor="#1e1e1e", padding=8, border_radius=8
+        )
+        job_rows[job_id] = {'row': row, 'lbl': lbl, 'bar': bar, 'btn': btn, 'done': False}
+        lv_jobs.controls.insert(0, row)
+        # Chỉ giữ lại các dòng mới nhất, bỏ bớt dòng job đã xong
+        if len(lv_jobs.controls) > MAX_JOB_ROWS:
+            for jid in [j for j, r in job_rows.items() if r['done']][:len(lv_jobs.controls) - MAX_JOB_ROWS]:
+                lv_jobs.controls.remove(job_rows.pop(jid)['row'])
+
+    def finish_job_row(job_id, text, color):
+        r = job_rows.get(job_id)
+        if not r: return
+        r['lbl'].value = text; r['lbl'].color = color
+        r['btn'].visible = False
+
+    def refresh_summary():
+        st = scheduler.stats()
+        active = st['running'] + st['queued']
+        post = engine.postproc.pending()
+        btn_cancel.visible = active > 0; btn_cancel.disabled = active == 0
+        if active:
+            text = f"Đang tải: {st['running']} | Đang chờ: {st['queued']} | ⇣ {format_bytes(bw.total_rate())}/s"
+            if bw.limit: text += f" (giới hạn {format_bytes(bw.limit)}/s)"
+            if st.get('gated'): text += " | ⏸ Chờ Wi-Fi/khung giờ"
+            if post: text += f" | Hậu kỳ: {post}"
+            lbl_status.value = text; lbl_status.color = "orange"
+        elif post:
+            lbl_status.value = f"Đang hậu kỳ {post} file (ghép/nhúng)..."; lbl_status.color = "orange"
 
     # --- UI EVENT HANDLERS ---
 
@@ -317,8 +238,9 @@ def main(page: ft.Page):
         lbl_status.value = "Đang phân tích..."; lbl_status.color = "yellow"
         prg_bar.visible = True; prg_bar.value = None
         dd_quality.visible = False; btn_download.visible = False; sw_playlist.visible = False
+        cb_priority.visible = False
         page.update()
-        threading.Thread(target=run_analyze, args=(url, progress_queue), daemon=True).start()
+        threading.Thread(target=engine.run_analyze, args=(url, None, txt_cookies.value), daemon=True).start()
 
     def download_click(e):
         url = txt_url.value.strip()
@@ -328,23 +250,27 @@ def main(page: ft.Page):
         
         ok, msg = prepare_save_path(save_path)
         if not ok:
-            add_log(f"Lỗi Path: {msg}")
+            add_log(f"Lỗi Path: {msg}", "ERROR")
             lbl_status.value = "Thư mục lỗi"; lbl_status.color = "red"; page.update()
             return
 
-        btn_download.visible = False; btn_analyze.visible = False
-        btn_cancel.visible = True; btn_cancel.disabled = False
-        dd_quality.disabled = True
-        lbl_status.value = "Đang khởi động..."; prg_bar.visible = True; prg_bar.value = 0
+        # Không khóa UI: người dùng có thể phân tích link tiếp theo trong lúc job này tải
+        priority = 0 if cb_priority.value else 1
+        job_id = engine.submit(url, quality_id, is_playlist, save_path, txt_cookies.value, priority=priority, title=current_title or url)
+        add_job_row(job_id, current_title or url)
+        add_log(f"Thêm job #{job_id}: {url}")
+        refresh_summary()
         page.update()
-        
-        cancel_event.clear()
-        threading.Thread(target=run_download, args=(url, quality_id, is_playlist, save_path, txt_cookies.value, cancel_event, progress_queue), daemon=True).start()
+
+    def cancel_job_click(job_id):
+        if scheduler.cancel(job_id):
+            r = job_rows.get(job_id)
+            if r: r['lbl'].value = "Đang dừng..."; r['btn'].disabled = True
+            page.update()
 
     def cancel_click_handler(e):
-        if not cancel_event.is_set():
-            cancel_event.set()
-            lbl_status.value = "Đang dừng..."; page.update()
+        scheduler.cancel_all()
+        lbl_status.value = "Đang dừng..."; page.update()
 
     btn_analyze.on_click = analyze_click
     btn_download.on_click = download_click
@@ -358,42 +284,156 @@ def main(page: ft.Page):
 
     # Save Settings
     def save_settings_click(e):
-        new_settings = {"cookies": txt_cookies.value, "smart_clipboard": sw_smart_clip.value, "theme_color": "red"}
+        try: max_workers = int(dd_workers.value or 2)
+        except: max_workers = 2
+        try: turbo_connections = int(dd_turbo_conn.value or 4)
+        except: turbo_connections = 4
+        try: offpeak = (int(dd_offpeak_start.value or 0), int(dd_offpeak_end.value or 6))
+        except: offpeak = (0, 6)
+        try: api_port = int(txt_api_port.value or API_DEFAULT_PORT)
+        except: api_port = API_DEFAULT_PORT
+        try: fmt_limits = (int(dd_fmt_height.value or 0), int(dd_fmt_budget.value or 0))
+        except: fmt_limits = (0, 0)
+        new_settings = {"cookies": txt_cookies.value, "smart_clipboard": sw_smart_clip.value, "theme_color": "red", "max_workers": max_workers,
+                        "turbo": sw_turbo.value, "turbo_connections": turbo_connections,
+                        "bw_limit_kbps": int(dd_bw_limit.value or 0), "bw_policy": dd_bw_policy.value or "always",
+                        "offpeak_start": offpeak[0], "offpeak_end": offpeak[1], "dup_policy": dd_dup_policy.value or "skip",
+                        "verbose_log": sw_verbose_log.value, "log_to_file": sw_log_file.value, "embed_metadata": sw_embed_meta.value,
+                        "scratch_dir": (txt_scratch_dir.value or "").strip(),
+                        "api_enabled": sw_api.value, "api_lan": sw_api_lan.value, "api_port": api_port,
+                        "api_token": user_settings.get("api_token") or uuid.uuid4().hex,
+                        "fmt_max_height": fmt_limits[0], "fmt_size_budget_mb": fmt_limits[1], "fmt_codec": dd_fmt_codec.value or "auto"}
         page.client_storage.set(SETTINGS_KEY, new_settings)
+        log_store.file_enabled = bool(sw_log_file.value)
+        # Job bắt đầu sau đó đọc cấu hình mới (Turbo...)
+        user_settings.update(new_settings)
+        scheduler.set_max_workers(max_workers)
+        scheduler.wake()
+        update_clipboard_watch()
+        apply_api()
         page.show_snack_bar(ft.SnackBar(content=ft.Text("Đã lưu cài đặt!"), bgcolor="green"))
     btn_save_settings.on_click = save_settings_click
 
+    def fmt_forget_click(e):
+        n = len(engine.format_policies)
+        engine.format_policies.clear()
+        page.show_snack_bar(ft.SnackBar(content=ft.Text(f"Đã quên lựa chọn của {n} trang")))
+    btn_fmt_forget.on_click = fmt_forget_click
+
+    # API điều khiển: bật/tắt/đổi cổng theo cài đặt, dùng chung hàng đợi job với UI
+    api_state = {'server': None}
+
+    def apply_api():
+        srv = api_state['server']
+        host = "0.0.0.0" if user_settings.get("api_lan") else "127.0.0.1"
+        port = int(user_settings.get("api_port") or API_DEFAULT_PORT)
+        if srv and (not user_settings.get("api_enabled") or srv.host != host or srv.port != port):
+            srv.stop(); srv = api_state['server'] = None
+        if user_settings.get("api_enabled") and not srv:
+            if not user_settings.get("api_token"):
+                # Cài đặt cũ / chưa bấm Lưu: sinh token và giữ lại để client không phải đổi mỗi lần mở app
+                user_settings["api_token"] = uuid.uuid4().hex
+                page.client_storage.set(SETTINGS_KEY, user_settings)
+            try:
+                srv = api_state['server'] = ControlServer(engine, host, port, user_settings.get("api_token"), txt_save_path.value.strip() or ".").start()
+                add_log(f"API điều khiển: {srv.url}")
+            except OSError as ex:
+                add_log(f"Không mở được API ở cổng {port}: {ex}", "ERROR")
+        if srv: srv.save_path = txt_save_path.value.strip() or "."
+        lbl_api.value = f"{srv.url}/api  |  Token: {srv.token}" if srv else "API đang tắt"
+
+    # Giới hạn băng thông áp dụng ngay cho cả job đang tải, không cần bấm Lưu
+    def bw_limit_change(e):
+        try: kbps = int(dd_bw_limit.value or 0)
+        except: kbps = 0
+        bw.set_limit(kbps * 1024)
+        user_settings["bw_limit_kbps"] = kbps
+        add_log(f"Giới hạn băng thông: {format_bytes(kbps * 1024) + '/s' if kbps else 'không giới hạn'}")
+        refresh_summary(); page.update()
+    dd_bw_limit.on_change = bw_limit_change
+
     # --- TABS & LAYOUT ---
 
-    # History List
-    lv_history = ft.ListView(expand=True, spacing=10)
+    # History List (phân trang: chỉ dựng các dòng đã cuộn tới)
+    lv_history = ft.ListView(expand=True, spacing=10, on_scroll_interval=200)
+    txt_history_search = ft.TextField(label="Tìm theo tiêu đề", prefix_icon=ft.icons.SEARCH, dense=True, expand=True, text_size=12)
+    dd_history_type = ft.Dropdown(width=130, dense=True, value="", options=[
+        ft.dropdown.Option(key="", text="Tất cả"), ft.dropdown.Option(key="video", text="Video"), ft.dropdown.Option(key="audio", text="Audio")])
+    lbl_history_count = ft.Text("", size=11, color="grey")
+    btn_history_more = ft.TextButton("Tải thêm...", icon=ft.icons.EXPAND_MORE)
+    history_view = {'search': "", 'type': None, 'loaded': 0, 'total': 0, 'timer': None, 'request': None}
+
+    def refresh_history_footer():
+        v = history_view
+        lbl_history_count.value = f"{v['loaded']}/{v['total']} mục"
+        if btn_history_more in lv_history.controls: lv_history.controls.remove(btn_history_more)
+        if v['loaded'] < v['total']: lv_history.controls.append(btn_history_more)
+        elif not v['total']: lv_history.controls.append(ft.Text("Chưa có lịch sử", italic=True, text_align="center"))
+
+    def load_history_page():
+        v = history_view
+        rows = history.query(v['search'], v['type'], offset=v['loaded'])
+        if btn_history_more in lv_history.controls: lv_history.controls.remove(btn_history_more)
+        lv_history.controls.extend(make_history_row(item) for item in rows)
+        v['loaded'] += len(rows)
+        refresh_history_footer()
+
     def update_history_tab():
+        history_view.update({'search': (txt_history_search.value or "").strip(), 'type': dd_history_type.value or None, 'loaded': 0})
+        history_view['total'] = history.count(history_view['search'], history_view['type'])
         lv_history.controls.clear()
-        if not download_history:
-            lv_history.controls.append(ft.Text("Chưa có lịch sử", italic=True, text_align="center"))
-        else:
-            for item in download_history:
-                icon = ft.icons.MUSIC_NOTE if item.get('type') == 'audio' else ft.icons.VIDEO_FILE
-                lv_history.controls.append(
-                    ft.Container(
-                        content=ft.Row([
-                            ft.Icon(icon, color="orange"),
-                            ft.Column([
-                                ft.Text(item.get('title',''), weight="bold", no_wrap=True, max_lines=1, width=200),
-                                ft.Text(f"{item.get('date')} | {item.get('path')}", size=10, color="grey")
-                            ], spacing=2),
-                            ft.Icon(ft.icons.CHECK_CIRCLE, color="green", size=16)
-                        ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
-                        bgcolor="#1e1e1e", padding=10, border_radius=10
-                    )
-                )
-        page.update()
+        load_history_page()
+
+    # Danh sách Lịch sử chỉ được sửa trên thread xả sự kiện (cùng chỗ chèn dòng vừa tải xong):
+    # handler của ô tìm / bộ lọc / cuộn chỉ ghi yêu cầu rồi đánh thức UIPump
+    def request_history(kind):
+        if history_view['request'] != 'refresh': history_view['request'] = kind
+        pump.notify()
+
+    def sync_history():
+        """Thực hiện yêu cầu đang chờ ('refresh' dựng lại từ đầu, 'more' tải trang kế tiếp); gọi từ drain_queue"""
+        kind, history_view['request'] = history_view['request'], None
+        if kind == 'refresh': update_history_tab()
+        elif kind == 'more' and history_view['loaded'] < history_view['total']: load_history_page()
+        else: return False
+        return True
+
+    def history_search_change(e):
+        if history_view['timer']: history_view['timer'].cancel()
+        timer = history_view['timer'] = threading.Timer(HISTORY_SEARCH_DELAY, request_history, args=('refresh',))
+        timer.daemon = True
+        timer.start()
+
+    def insert_history_row(item):
+        v = history_view
+        if not history.matches(item, v['search'], v['type']): return
+        if not v['total']: lv_history.controls.clear()
+        lv_history.controls.insert(0, make_history_row(item))
+        v['loaded'] += 1; v['total'] += 1
+        refresh_history_footer()
+
+    def history_scroll(e):
+        # Gần cuối danh sách thì tự tải trang kế tiếp
+        try:
+            if e.max_scroll_extent and e.pixels >= e.max_scroll_extent - 300: request_history('more')
+        except AttributeError:
+            pass
+
+    def clear_history_click(e):
+        history.clear()
+        request_history('refresh')
+
+    lv_history.on_scroll = history_scroll
+    btn_history_more.on_click = lambda e: request_history('more')
+    txt_history_search.on_change = history_search_change
+    dd_history_type.on_change = lambda e: request_history('refresh')
 
     tab_home = ft.Container(
         content=ft.Column([
             ft.Icon(ft.icons.ROCKET_LAUNCH_ROUNDED, size=60, color=COLOR_PRIMARY),
             ft.Text("HUST DOWNLOADER", size=24, weight="bold"),
             ft.Text(VERSION, size=12, color="grey"),
+            box_resume,
             ft.Container(height=10),
             txt_url,
             ft.Container(height=5),
@@ -402,59 +442,253 @@ def main(page: ft.Page):
             lbl_info,
             sw_playlist,
             dd_quality,
+            cb_priority,
             ft.Container(height=10),
             ft.Row([btn_analyze, btn_download, btn_cancel], alignment=ft.MainAxisAlignment.CENTER),
             ft.Container(height=10),
             lbl_status,
             prg_bar,
+            lv_jobs,
             ft.Container(height=10),
-            log_field
-        ], horizontal_alignment=ft.CrossAxisAlignment.CENTER),
+            log_panel
+        ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, scroll=ft.ScrollMode.AUTO),
         padding=10
     )
 
-    tab_history = ft.Container(content=ft.Column([
-        ft.Text("Lịch sử", size=20, weight="bold"),
-        ft.ElevatedButton("Xóa lịch sử", icon=ft.icons.DELETE, on_click=lambda e: (download_history.clear(), page.client_storage.remove(HISTORY_KEY), update_history_tab()), bgcolor="red"),
-        ft.Divider(), lv_history
-    ]), padding=10)
+    # Stats: số đo theo job (engine.metrics) và gộp theo trang, để biết thời gian đi đâu / trang nào chậm
+    tbl_stats_sites = ft.DataTable(column_spacing=14, rows=[], columns=[ft.DataColumn(ft.Text(c, size=11)) for c in
+                                   ("Trang", "Job", "Lỗi", "Retry", "Phân tích", "Kết nối", "Tốc độ TB", "Dung lượng")])
+    tbl_stats_jobs = ft.DataTable(column_spacing=14, rows=[], columns=[ft.DataColumn(ft.Text(c, size=11)) for c in
+                                  ("#", "Trang", "Trạng thái", "Chờ", "Phân tích", "Kết nối", "Tải", "Dung lượng", "TB / Đỉnh", "Retry", "Hậu kỳ")])
+    lbl_stats = ft.Text("", size=11, color="grey")
+    stats_view = {'version': -1}
+
+    def update_stats_tab(e=None):
+        metrics = engine.metrics
+        stats_view['version'] = metrics.version
+        tbl_stats_sites.rows = [make_stats_row((s['site'], s['jobs'], s['errors'], s['retries'], fmt_secs(s['extract_s']), fmt_secs(s['connect_s']),
+                                                f"{format_bytes(s['avg_bps'])}/s" if s['avg_bps'] else "--", format_bytes(s['bytes'])))
+                                for s in metrics.by_site()]
+        jobs = metrics.snapshot()
+        tbl_stats_jobs.rows = [make_stats_row((r['job_id'], r.get('site') or "?", r['state'], fmt_secs(r.get('queue_s')), fmt_secs(r.get('extract_s')),
+                                               fmt_secs(r.get('connect_s')), fmt_secs(r.get('download_s')), format_bytes(r['bytes']),
+                                               f"{format_bytes(r.get('avg_bps'))} / {format_bytes(r['peak_bps'])}",
+                                               f"{r['retries']}+{r['fragment_retries']}", fmt_secs(r['post_s'] or None)))
+                               for r in jobs[:STATS_VIEW_ROWS]]
+        lbl_stats.value = f"{len(jobs)} job (hiện {min(len(jobs), STATS_VIEW_ROWS)} gần nhất) | Retry = tải lại + fragment"
+        if e is not None: page.update()
+
+    def export_stats(fmt):
+        folder = txt_save_path.value.strip() or "."
+        try:
+            path = engine.metrics.export(os.path.join(folder, f"hust_metrics_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}"))
+            page.show_snack_bar(ft.SnackBar(content=ft.Text(f"Đã xuất: {path}"), bgcolor="green"))
+        except OSError as ex:
+            page.show_snack_bar(ft.SnackBar(content=ft.Text(f"Không xuất được: {ex}"), bgcolor="red"))
 
-    tab_settings = ft.Container(content=ft.Column([
-        ft.Text("Cấu hình", size=20, weight="bold"),
-        ft.Container(height=10), sw_smart_clip, ft.Divider(),
-        ft.Text("Quản lý Cookie:", weight="bold"), txt_cookies,
-        ft.Container(height=20), btn_save_settings
-    ]), padding=10)
+    # Tab Lịch sử / Cài đặt / Thống kê chỉ dựng khi người dùng chọn lần đầu
+    def build_history_tab():
+        update_history_tab()
+        return ft.Container(content=ft.Column([
+            ft.Text("Lịch sử", size=20, weight="bold"),
+            ft.ElevatedButton("Xóa lịch sử", icon=ft.icons.DELETE, on_click=clear_history_click, bgcolor="red"),
+            ft.Row([txt_history_search, dd_history_type]), lbl_history_count,
+            ft.Divider(), lv_history
+        ]), padding=10)
+
+    def build_settings_tab():
+        return ft.Container(content=ft.Column([
+            ft.Text("Cấu hình", size=20, weight="bold"),
+            ft.Container(height=10), sw_smart_clip, dd_workers, dd_dup_policy, ft.Divider(),
+            ft.Text("Chọn chất lượng tự động:", weight="bold"), ft.Row([dd_fmt_height, dd_fmt_budget, dd_fmt_codec], wrap=True), btn_fmt_forget, ft.Divider(),
+            sw_turbo, dd_turbo_conn, sw_embed_meta, ft.Divider(),
+            ft.Text("Lưu trữ:", weight="bold"), txt_scratch_dir, ft.Divider(),
+            ft.Text("API điều khiển:", weight="bold"), sw_api, ft.Row([txt_api_port, sw_api_lan]), lbl_api, ft.Divider(),
+            ft.Text("Băng thông:", weight="bold"), dd_bw_limit, dd_bw_policy,
+            ft.Row([dd_offpeak_start, dd_offpeak_end]), ft.Divider(),
+            ft.Text("Nhật ký:", weight="bold"), sw_verbose_log, sw_log_file, ft.Divider(),
+            ft.Text("Quản lý Cookie:", weight="bold"), txt_cookies,
+            ft.Container(height=20), btn_save_settings
+        ]), padding=10)
+
+    def build_stats_tab():
+        update_stats_tab()
+        return ft.Container(content=ft.Column([
+            ft.Text("Thống kê", size=20, weight="bold"),
+            ft.Row([ft.ElevatedButton("Làm mới", icon=ft.icons.REFRESH, on_click=update_stats_tab),
+                    ft.ElevatedButton("Xuất CSV", icon=ft.icons.TABLE_CHART, on_click=lambda e: export_stats("csv")),
+                    ft.ElevatedButton("Xuất JSON", icon=ft.icons.DATA_OBJECT, on_click=lambda e: export_stats("json"))], wrap=True),
+            lbl_stats,
+            ft.Text("Theo trang:", weight="bold"), ft.Row([tbl_stats_sites], scroll=ft.ScrollMode.AUTO),
+            ft.Text("Theo job:", weight="bold"), ft.Row([tbl_stats_jobs], scroll=ft.ScrollMode.AUTO)
+        ], scroll=ft.ScrollMode.AUTO), padding=10)
+
+    lazy_builders = {1: build_history_tab, 2: build_settings_tab, 3: build_stats_tab}
+    lazy_built = {}
+
+    def tabs_change(e):
+        idx = tabs.selected_index
+        if idx in lazy_builders and not lazy_built.get(idx):
+            t0 = time.perf_counter()
+            lazy_built[idx] = True
+            tabs.tabs[idx].content = lazy_builders[idx]()
+            add_log(f"Dựng tab {tabs.tabs[idx].text}: {(time.perf_counter() - t0) * 1000:.0f} ms")
+            page.update()
+        elif idx == 3 and stats_view['version'] != engine.metrics.version:
+            update_stats_tab(e)
 
     tabs = ft.Tabs(selected_index=0, animation_duration=300, tabs=[
         ft.Tab(text="Tải xuống", icon=ft.icons.DOWNLOAD),
         ft.Tab(text="Lịch sử", icon=ft.icons.HISTORY),
-        ft.Tab(text="Cài đặt", icon=ft.icons.SETTINGS)
-    ], expand=1)
+        ft.Tab(text="Cài đặt", icon=ft.icons.SETTINGS),
+        ft.Tab(text="Thống kê", icon=ft.icons.INSIGHTS)
+    ], expand=1, on_change=tabs_change)
     
     tabs.tabs[0].content = tab_home
-    tabs.tabs[1].content = tab_history
-    tabs.tabs[2].content = tab_settings
+    tabs.tabs[1].content = ft.Container()
+    tabs.tabs[2].content = ft.Container()
+    tabs.tabs[3].content = ft.Container()
     page.add(tabs)
-    update_history_tab()
+    t_ui = time.perf_counter()
 
-    # Smart Clipboard
-    if user_settings.get("smart_clipboard"):
+    # Import yt_dlp + khởi tạo extractor trên thread nền, không chặn UI và lần bấm Phân tích đầu tiên
+    def preload_engine():
+        t0 = time.perf_counter()
         try:
-            clip = page.get_clipboard()
-            if clip and "http" in clip and clip != txt_url.value:
-                txt_url.value = clip; page.show_snack_bar(ft.SnackBar(content=ft.Text("Đã bắt link!")))
-        except: pass
+            with engine.ydl_pool.session(ANALYZE_OPTS, engine.settings.get("cookies", "")):
+                pass
+            t_ready = time.perf_counter()
+            report = (f"Khởi động: main() {(t_main - APP_START) * 1000:.0f} ms | UI {(t_ui - t_main) * 1000:.0f} ms"
+                      f" | yt-dlp {(t_ready - t0) * 1000:.0f} ms (sẵn sàng sau {(t_ready - APP_START) * 1000:.0f} ms)")
+            progress_queue.put({'type': 'log', 'msg': report})
+            if (t_ui - APP_START) * 1000 > STARTUP_BUDGET_MS:
+                progress_queue.put({'type': 'log', 'level': 'WARN', 'msg': f"Cảnh báo: hiện UI chậm hơn ngưỡng {STARTUP_BUDGET_MS} ms"})
+        except Exception as ex:
+            progress_queue.put({'type': 'log', 'level': 'ERROR', 'msg': f"Nạp trước yt-dlp lỗi: {ex}"})
+    threading.Thread(target=preload_engine, daemon=True).start()
+
+    # Khôi phục job dở dang từ journal (app bị kill giữa chừng)
+    def resume_click(e):
+        for key, rec in pending_jobs:
+            job_id = engine.submit(rec['url'], rec.get('quality_id'), rec.get('is_playlist'), rec.get('save_path') or ".", txt_cookies.value, journal_key=key)
+            add_job_row(job_id, rec.get('title') or rec['url'])
+            add_log(f"Tiếp tục job #{job_id}: {rec['url']} ({format_bytes(rec.get('downloaded'))} đã tải)")
+        box_resume.visible = False
+        refresh_summary()
+        page.update()
 
-    # --- QUEUE POLLING ---
-    last_percent = 0.0
-    last_ui_time = 0.0
+    def resume_skip_click(e):
+        # Chỉ bỏ các job dở từ phiên trước, không đụng tới job mới thêm
+        for key, _ in pending_jobs: journal.remove(key)
+        box_resume.visible = False; page.update()
+
+    btn_resume.on_click = resume_click
+    btn_resume_skip.on_click = resume_skip_click
+    pending_jobs = journal.pending()
+    if pending_jobs:
+        lbl_resume.value = f"Có {len(pending_jobs)} job chưa tải xong"
+        box_resume.visible = True
+        page.update()
+
+    if user_settings.get("api_enabled"): apply_api()
+
+    # Smart Clipboard: thread nền đọc clipboard, link mới thì điền sẵn; link của trang yt-dlp hỗ trợ thì phân tích trước
+    # để bấm PHÂN TÍCH LINK là có kết quả từ cache. Không đi qua EventChannel (API không thấy nội dung clipboard).
+    # Chỉ đọc clipboard khi bật cài đặt và app đang hiện; ngoài ra thread ngủ hẳn trên clip_wake
+    clip_state = {'last': None, 'link': None, 'auto': None, 'ready': None, 'foreground': True, 'stop': None}
+    clip_wake = threading.Event()
+
+    def clipboard_loop(stop):
+        while not stop.is_set():
+            clip_wake.wait()
+            if stop.is_set(): break
+            try: clip = page.get_clipboard()
+            except: clip = None
+            if clip and clip != clip_state['last']:
+                clip_state['last'] = clip
+                url = find_url(clip)
+                if url:
+                    clip_state['link'] = url
+                    pump.notify()
+                    try:
+                        # Phân tích trước cũng tốn mạng -> theo chính sách tải (chỉ Wi-Fi / khung giờ)
+                        if is_supported_url(url) and engine.policy_allows_start(): engine.prefetcher.submit(url)
+                    except Exception as ex:
+                        log_store.add(f"Không kiểm tra được link: {ex}", "DEBUG")
+            stop.wait(CLIPBOARD_POLL_SEC)
+
+    def update_clipboard_watch():
+        if user_settings.get("smart_clipboard") and clip_state['foreground']: clip_wake.set()
+        else: clip_wake.clear()
+
+    def start_clipboard_watch(e=None):
+        if clip_state['stop'] and not clip_state['stop'].is_set(): return
+        stop = clip_state['stop'] = threading.Event()
+        update_clipboard_watch()
+        threading.Thread(target=clipboard_loop, args=(stop,), daemon=True).start()
+
+    def stop_clipboard_watch(e=None):
+        if clip_state['stop']: clip_state['stop'].set()
+        clip_wake.set()  # Đánh thức để thread thấy stop và thoát
+
+    def app_lifecycle_change(e):
+        # Android/iOS: app xuống nền (hide/inactive/pause) thì ngừng đọc clipboard, hiện lại thì đọc ngay
+        state = str(e.data or "").lower()
+        if state in ("hide", "inactive", "pause", "detach"): clip_state['foreground'] = False
+        elif state in ("show", "resume", "restart"): clip_state['foreground'] = True
+        update_clipboard_watch()
+
+    def prefetch_ready(url, result):
+        clip_state['ready'] = (url, result.get('title'))
+        pump.notify()
+
+    def sync_clipboard():
+        """Áp link mới bắt được / kết quả phân tích trước lên UI (gọi từ drain_queue)"""
+        changed = False
+        url, clip_state['link'] = clip_state['link'], None
+        current = txt_url.value.strip()
+        # Chỉ ghi đè ô link khi đang trống hoặc vẫn là link tự điền lần trước (người dùng chưa sửa)
+        if url and url != current and (not current or current == clip_state['auto']):
+            txt_url.value = clip_state['auto'] = url
+            page.show_snack_bar(ft.SnackBar(content=ft.Text("Đã bắt link!")))
+            changed = True
+        ready, clip_state['ready'] = clip_state['ready'], None
+        if ready and ready[0] == txt_url.value.strip() and not btn_analyze.disabled:
+            lbl_status.value = f"⚡ Đã phân tích sẵn: {ready[1]}"; lbl_status.color = "blue"
+            changed = True
+        return changed
+
+    # --- LOG VIEW ---
+    LOG_COLORS = {"DEBUG": "grey", "INFO": "#00FF00", "WARN": "orange", "ERROR": "red"}
+    log_view = {'seq': 0}
+
+    def log_line(rec):
+        return ft.Text(LogStore.format(rec), size=10, color=LOG_COLORS.get(rec['level'], "#00FF00"), selectable=True, no_wrap=False)
+
+    def sync_log_view():
+        """Chỉ thêm các dòng log mới kể từ lần vẽ trước, giữ tối đa LOG_VIEW_LINES dòng"""
+        records, log_view['seq'] = log_store.since(log_view['seq'], dd_log_level.value or "INFO")
+        if not records: return False
+        for rec in records[-LOG_VIEW_LINES:]:
+            lv_log.controls.append(log_line(rec))
+        if len(lv_log.controls) > LOG_VIEW_LINES:
+            del lv_log.controls[:len(lv_log.controls) - LOG_VIEW_LINES]
+        return True
+
+    def log_level_change(e):
+        # Đổi mức lọc -> vẽ lại từ phần đuôi của bộ đệm
+        lv_log.controls = [log_line(rec) for rec in log_store.tail(LOG_VIEW_LINES, dd_log_level.value or "INFO")]
+        log_view['seq'] = log_store.last_seq
+        lv_log.update()
+    dd_log_level.on_change = log_level_change
+
+    # --- UI UPDATE (EVENT-DRIVEN) ---
     
-    def poll_queue(evt):
-        nonlocal last_percent, last_ui_time
+    def drain_queue():
+        nonlocal current_title
         any_update = False
-        while not progress_queue.empty():
-            item = progress_queue.get_nowait()
+        progress_seen = False
+        for item in progress_queue.drain():
             t = item.get('type')
             
             if t == 'analyze_done':
@@ -463,70 +697,137 @@ def main(page: ft.Page):
                     try: opts.append(ft.dropdown.Option(key=opt['key'], text=opt['text']))
                     except: continue
                 dd_quality.options = opts
-                if opts: dd_quality.value = opts[0].key
+                # Mặc định chọn sẵn lựa chọn xếp hạng cao nhất theo chính sách format
+                if opts: dd_quality.value = item.get('recommended') or opts[0].key
                 
-                lbl_info.value = f"Tiêu đề: {item.get('title','')}"
+                current_title = item.get('title', '')
+                lbl_info.value = f"Tiêu đề: {current_title}"
                 if item.get('is_playlist'):
                     sw_playlist.visible = True; sw_playlist.value = False
-                    lbl_info.value += " (Playlist)"
+                    lbl_info.value += f" (Playlist: {item.get('entry_count')} video)" if item.get('entry_count') else " (Playlist)"
                 
-                dd_quality.visible = True; btn_download.visible = True
+                dd_quality.visible = True; btn_download.visible = True; cb_priority.visible = True
                 btn_analyze.disabled = False; prg_bar.visible = False
-                lbl_status.value = "Đã phân tích xong!"; lbl_status.color = "blue"
+                lbl_status.value = "Đã phân tích xong! (cache)" if item.get('cached') else "Đã phân tích xong!"; lbl_status.color = "blue"
                 any_update = True
                 
+            elif t == 'queued':
+                if item.get('job_id') not in job_rows:
+                    add_job_row(item.get('job_id'), item.get('title') or item.get('url'))
+                    refresh_summary()
+                    any_update = True
+
+            elif t == 'status':
+                r = job_rows.get(item.get('job_id'))
+                if r: r['lbl'].value = item.get('msg'); any_update = True
+
             elif t == 'progress':
-                d = item.get('d', {})
-                if d.get('status') == 'downloading':
-                    try:
-                        p = float(str(d.get('_percent_str', '0%')).replace('%','').strip())/100.0
-                    except: p = 0.0
-                    now = time.time()
-                    if abs(p - last_percent) >= 0.005 or (now - last_ui_time) > 0.2:
-                        last_percent = p; last_ui_time = now
-                        prg_bar.value = p
-                        lbl_status.value = f"Đang tải: {d.get('_percent_str')} | {d.get('_speed_str')}"
-                        any_update = True
+                # Tick đã được gộp phía worker, mỗi lần xả chỉ còn tick mới nhất của mỗi job
+                r = job_rows.get(item.get('job_id'))
+                if r and not r['done']:
+                    p = progress_fraction(item)
+                    pct = f"{p * 100:.1f}%" if p is not None else format_bytes(item.get('downloaded'))
+                    speed = f"{format_bytes(item['speed'])}/s" if item.get('speed') else "--"
+                    eta = f" | còn {int(item['eta'])}s" if item.get('eta') is not None else ""
+                    if item.get('entry') is not None:
+                        r['lbl'].value = f"[{r.get('pl_done', 0)}/{item.get('entries')}] Mục {item['entry'] + 1}: {pct} | {speed}{eta}"
+                    else:
+                        r['bar'].value = p
+                        r['lbl'].value = f"Đang tải: {pct} | {speed}{eta}"
+                    r['lbl'].color = "orange"
+                    progress_seen = True
+                    any_update = True
+
+            elif t == 'playlist_progress':
+                r = job_rows.get(item.get('job_id'))
+                if r:
+                    total = item.get('total') or 1
+                    r['pl_done'] = item.get('done', 0)
+                    r['bar'].value = (item.get('done', 0) + item.get('failed', 0)) / total
+                    r['lbl'].value = f"Playlist: {item.get('done', 0)}/{total} xong" + (f", {item.get('failed')} lỗi" if item.get('failed') else "")
+                    any_update = True
+
+            elif t == 'entry_finished':
+                fname = item.get('filepath') or "file"
+                add_log(f"Xong: {fname}", job_id=item.get('job_id'))
+                show_history(item.get('history'))
+                any_update = True
+
+            elif t == 'playlist_done':
+                total = item.get('total', 0)
+                finish_job_row(item.get('job_id'), f"✅ Playlist: {item.get('done', 0)}/{total} xong" + (f", {item.get('failed')} lỗi" if item.get('failed') else ""), "green" if not item.get('failed') else "orange")
+                lbl_status.value = "✅ HOÀN TẤT PLAYLIST!"; lbl_status.color = "green"
+                page.show_snack_bar(ft.SnackBar(content=ft.Text(f"Đã tải {item.get('done', 0)}/{total} video!"), bgcolor="green"))
+                any_update = True
                         
+            elif t == 'finished' and item.get('duplicate'):
+                finish_job_row(item.get('job_id'), "⏭ Đã có sẵn, không tải lại", "blue")
+                r = job_rows.get(item.get('job_id'))
+                if r: r['bar'].value = 1
+                lbl_status.value = "⏭ Video đã tải trước đó"; lbl_status.color = "blue"
+                any_update = True
+
             elif t == 'finished':
                 lbl_status.value = "✅ HOÀN TẤT!"; lbl_status.color = "green"
-                prg_bar.value = 1
+                finish_job_row(item.get('job_id'), "✅ Hoàn tất", "green")
+                r = job_rows.get(item.get('job_id'))
+                if r: r['bar'].value = 1
                 fname = item.get('filepath') or "file"
-                add_log(f"Xong: {fname}")
+                add_log(f"Xong: {fname}", job_id=item.get('job_id'))
                 page.show_snack_bar(ft.SnackBar(content=ft.Text("Đã lưu thành công!"), bgcolor="green"))
-                save_history({
-                    "title": item.get('title', 'Unknown'),
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    "path": fname,
-                    "type": item.get('media_type', 'video')
-                })
+                show_history(item.get('history'))
                 any_update = True
                 
             elif t == 'cancelled':
-                lbl_status.value = "⛔ ĐÃ HỦY"; lbl_status.color = "grey"
-                add_log("User Cancelled")
+                finish_job_row(item.get('job_id'), "⛔ Đã hủy", "grey")
+                add_log("User Cancelled", job_id=item.get('job_id'))
                 any_update = True
                 
             elif t == 'error':
                 msg = str(item.get('msg'))
                 lbl_status.value = "❌ Lỗi (Xem Log)"; lbl_status.color = "red"
-                add_log(f"ERR: {msg}")
+                if item.get('job_id') is not None:
+                    finish_job_row(item.get('job_id'), "❌ Lỗi (Xem Log)", "red")
+                    add_log(msg, "ERROR", item.get('job_id'))
+                else:
+                    btn_analyze.disabled = False; prg_bar.visible = False
+                    add_log(msg, "ERROR")
                 any_update = True
                 
             elif t == 'log':
-                add_log(item.get('msg'))
+                add_log(item.get('msg'), item.get('level', "INFO"), item.get('job_id'))
                 any_update = True
                 
             elif t == 'worker_done':
-                btn_download.visible = True; btn_cancel.visible = False; btn_cancel.disabled = True
-                btn_analyze.visible = True; btn_analyze.disabled = False
-                dd_quality.disabled = False; prg_bar.visible = False
+                r = job_rows.get(item.get('job_id'))
+                if r:
+                    # Tải xong, file đang ghép/nhúng trên pool hậu kỳ -> chờ sự kiện finished (nút còn hiện = chưa có kết quả)
+                    if item.get('postprocessing') and r['btn'].visible: r['lbl'].value = "⚙ Đang hậu kỳ..."; r['lbl'].color = "orange"
+                    r['done'] = True; r['btn'].visible = False
+                refresh_summary()
                 any_update = True
 
-        if any_update: page.update()
+            elif t == 'postprocess_done':
+                refresh_summary()
+                any_update = True
 
-    timer = ft.Timer(0.15, poll_queue)
-    timer.autostart = True
-    page.overlay.append(timer)
+        if progress_seen: refresh_summary()
+        if sync_log_view(): any_update = True
+        if sync_clipboard(): any_update = True
+        if sync_history(): any_update = True
+        # Bảng Thống kê chỉ vẽ lại khi đang mở và có job đổi trạng thái (không theo từng tick progress)
+        if lazy_built.get(3) and tabs.selected_index == 3 and stats_view['version'] != engine.metrics.version:
+            update_stats_tab(); any_update = True
+        if any_update: page.update()
 
-ft.app(target=main)
\ No newline at end of file
+    pump = UIPump(drain_queue)
+    progress_queue.listener = pump.notify
+    log_store.listener = pump.notify
+    engine.prefetcher.listener = prefetch_ready
+    page.on_app_lifecycle_state_change = app_lifecycle_change
+    page.on_disconnect = stop_clipboard_watch
+    page.on_connect = start_clipboard_watch
+    start_clipboard_watch()
+
+if __name__ == "__main__":
+    ft.app(target=main)
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""Số đo theo job: thời gian chờ hàng đợi / phân tích / kết nối / tải / hậu kỳ, dung lượng, tốc độ TB + đỉnh, số lần thử lại.
+Thu từ sự kiện của engine (tap của EventChannel) cộng vài mốc engine báo trực tiếp; xuất CSV/JSON để so giữa các trang/mạng."""
+import csv
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+METRICS_CAPACITY = 500   # Số job gần nhất giữ trong RAM
+METRIC_FIELDS = ("job_id", "site", "url", "title", "state", "queued_at", "queue_s", "extract_s", "cache_hit", "connect_s",
+                 "download_s", "bytes", "avg_bps", "peak_bps", "retries", "fragment_retries", "post_s", "post_stages",
+                 "entries", "turbo", "error")
+
+
+class MetricsStore:
+    """Bảng số đo các job gần nhất. observe() nhận mọi sự kiện (kể cả từng tick progress) nên chỉ làm việc O(1);
+    các trường có tiền tố "_" là mốc thời gian nội bộ, không xuất ra ngoài."""
+    def __init__(self, capacity: int = METRICS_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self.version = 0  # Tăng mỗi khi có job đổi trạng thái, UI so sánh để biết cần vẽ lại
+
+    def _new_locked(self, job_id, url=None, title=None):
+        rec = self._jobs[job_id] = {'job_id': job_id, 'url': url, 'title': title, 'state': 'queued',
+                                    'queued_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'retries': 0, 'fragment_retries': 0,
+                                    'bytes': 0, 'peak_bps': 0, 'entries': 0, 'post_s': 0.0, 'post_stages': {},
+                                    '_t_queued': time.monotonic(), '_files': {}, '_done_bytes': 0}
+        while len(self._jobs) > self.capacity: self._jobs.popitem(last=False)
+        return rec
+
+    def begin(self, job_id, queued_t=None, **fields):
+        """Worker bắt đầu chạy job; queued_t: mốc time.monotonic() lúc job vào hàng đợi"""
+        now = time.monotonic()
+        with self._lock:
+            rec = self._jobs.get(job_id) or self._new_locked(job_id)
+            if queued_t is not None: rec['_t_queued'] = queued_t
+            rec.update(fields, state='running', queue_s=round(max(0.0, now - rec['_t_queued']), 3), _t_start=now, _t_dl_start=now)
+            self.version += 1
+
+    def extracted(self, job_id, site, seconds, cache_hit=False):
+        """Xong bước lấy info (extract hoặc dùng cache), bắt đầu tải"""
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is None: return
+            rec.update(site=site, extract_s=round(seconds, 3), cache_hit=cache_hit, _t_dl_start=time.monotonic())
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is not None: rec.update(fields)
+
+    def retry(self, job_id, fragment=False):
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if rec is not None: rec['fragment_retries' if fragment else 'retries'] += 1
+
+    def observe(self, item):
+        """Tap của EventChannel"""
+        job_id = item.get('job_id')
+        if job_id is None: return
+        t = item.get('type')
+        now = time.monotonic()
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            if t == 'queued':
+                if rec is None: self._new_locked(job_id, item.get('url'), item.get('title'))
+                self.version += 1
+                return
+            if rec is None: return
+            if t == 'progress':
+                if rec.get('_t_first') is None:
+                    rec['_t_first'] = now
+                    rec['connect_s'] = round(now - rec.get('_t_dl_start', now), 3)
+                # Tick mới nhỏ hơn tick trước của cùng mục -> đã sang file thành phần tiếp theo (video rồi audio)
+                key = item.get('entry')
+                got = item.get('downloaded') or 0
+                prev = rec['_files'].get(key, 0)
+                if got < prev: rec['_done_bytes'] += prev
+                rec['_files'][key] = got
+                if (item.get('speed') or 0) > rec['peak_bps']: rec['peak_bps'] = int(item['speed'])
+                rec['_t_last'] = now
+                return
+            if t in ('finished', 'entry_finished'):
+                if item.get('duplicate'): rec['state'] = 'duplicate'
+                elif t == 'finished': rec['state'] = 'finished'
+                else: rec['entries'] += 1
+                for stage, sec in (item.get('post') or {}).items():
+                    rec['post_stages'][stage] = round(rec['post_stages'].get(stage, 0) + sec, 3)
+                    rec['post_s'] = round(rec['post_s'] + sec, 3)
+            elif t == 'playlist_done':
+                rec['state'] = 'finished' if not item.get('failed') else 'partial'
+            elif t in ('error', 'cancelled'):
+                rec['state'] = t
+                if t == 'error': rec['error'] = item.get('msg')
+            elif t == 'worker_done':
+                self._close_locked(rec, now)
+                if rec['state'] == 'running': rec['state'] = 'postprocessing' if item.get('postprocessing') else 'finished'
+            else:
+                return
+            self.version += 1
+
+    def _close_locked(self, rec, now):
+        rec['bytes'] = rec['_done_bytes'] + sum(rec['_files'].values())
+        if rec.get('_t_first') is not None:
+            elapsed = max(rec.get('_t_last', now) - rec['_t_first'], 1e-6)
+            rec['download_s'] = round(elapsed, 3)
+            rec['avg_bps'] = int(rec['bytes'] / elapsed)
+
+    def snapshot(self):
+        """Bản sao các job (mới nhất trước), bỏ trường nội bộ"""
+        with self._lock:
+            return [{k: v for k, v in rec.items() if not k.startswith("_")} for rec in reversed(self._jobs.values())]
+
+    def by_site(self):
+        """Gộp theo trang (extractor): số job, lỗi, trung bình phân tích / kết nối / tốc độ, tổng retry"""
+        sites = {}
+        for rec in self.snapshot():
+            s = sites.setdefault(rec.get('site') or "?", {'site': rec.get('site') or "?", 'jobs': 0, 'errors': 0, 'retries': 0,
+                                                            'bytes': 0, '_extract': [], '_connect': [], '_rate': []})
+            s['jobs'] += 1
+            s['errors'] += rec['state'] == 'error'
+            s['retries'] += rec['retries'] + rec['fragment_retries']
+            s['bytes'] += rec['bytes']
+            for key, field in (('_extract', 'extract_s'), ('_connect', 'connect_s'), ('_rate', 'avg_bps')):
+                if rec.get(field) is not None: s[key].append(rec[field])
+        out = []
+        for s in sites.values():
+            for key, field in (('_extract', 'extract_s'), ('_connect', 'connect_s'), ('_rate', 'avg_bps')):
+                values = s.pop(key)
+                s[field] = round(sum(values) / len(values), 3) if values else None
+            out.append(s)
+        out.sort(key=lambda s: s['jobs'], reverse=True)
+        return out
+
+    def to_json(self):
+        return json.dumps({'jobs': self.snapshot(), 'sites': self.by_site()}, ensure_ascii=False, indent=2, default=str)
+
+    def to_csv(self):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=METRIC_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for rec in self.snapshot():
+            writer.writerow(dict(rec, post_stages=" ".join(f"{k}={v}" for k, v in rec['post_stages'].items())))
+        return buf.getvalue()
+
+    def export(self, path):
+        """Ghi ra file, định dạng theo đuôi (.json, còn lại CSV)"""
+        text = self.to_json() if path.lower().endswith(".json") else self.to_csv()
+        with open(path, "w", encoding="utf-8", newline="") as f: f.write(text)
+        return path
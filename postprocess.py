@@ -0,0 +1,227 @@
+"""Hậu kỳ sau khi tải: ghép video+audio, chuyển audio (m4a/mp3), nhúng metadata + ảnh bìa, đổi tên.
+Chạy trên pool riêng nên thread tải nhận job tiếp theo ngay trong lúc file trước còn đang được ghép."""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from storage import move_to
+
+POSTPROC_WORKERS = 1        # FFmpeg ăn CPU/đĩa: 1 luồng để không tranh tài nguyên với các job đang tải
+FFMPEG_TIMEOUT = 3600       # Giây, ghép/chuyển file rất dài vẫn đủ
+THUMB_TIMEOUT = 15
+THUMB_MAX_BYTES = 5 * 1024 * 1024
+HEAVY_STAGES = {"merge", "audio", "embed", "move"}  # Các bước gọi FFmpeg / chép sang ổ khác -> chạy trên pool hậu kỳ
+COVER_EXTS = {".mp4", ".m4a", ".mov", ".mp3"}  # Container nhúng được ảnh bìa
+PART_SUFFIX = re.compile(r"\.f[\w-]+$")     # Đuôi .f<format_id> của file thành phần
+
+
+class PostProcessError(Exception):
+    """FFmpeg lỗi ở một bước hậu kỳ"""
+
+
+class PostProcessCancelled(Exception):
+    """Job bị hủy giữa các bước hậu kỳ"""
+
+
+class PostTask:
+    """Một file cần hậu kỳ: parts là [file] hoặc [video, audio] chờ ghép, stages chạy theo thứ tự"""
+    def __init__(self, parts, stages, audio_format=None, meta=None, media_type="video", cancel_evt=None, dest=None):
+        self.parts = list(parts)
+        self.stages = list(stages)
+        self.audio_format = audio_format  # "m4a" / "mp3" cho bước audio
+        self.meta = meta or {}            # title, artist, date, url, thumbnail
+        self.media_type = media_type
+        self.cancel_evt = cancel_evt
+        self.dest = dest                  # Thư mục lưu cho bước move (file đang nằm trong thư mục tạm)
+        self.timings = []                 # [(stage, giây)]
+        self.warnings = []
+
+    @property
+    def heavy(self):
+        return any(s in HEAVY_STAGES for s in self.stages)
+
+
+def media_meta(info):
+    """Metadata để nhúng, lấy từ info của yt-dlp"""
+    info = info or {}
+    date = info.get('upload_date') or ""
+    return {'title': info.get('track') or info.get('title'),
+            'artist': info.get('artist') or info.get('uploader') or info.get('channel'),
+            'date': f"{date[:4]}-{date[4:6]}-{date[6:8]}" if len(date) == 8 else None,
+            'url': info.get('webpage_url'),
+            'thumbnail': info.get('thumbnail')}
+
+
+def merged_name(video, audio):
+    """Tên file sau khi ghép: bỏ đuôi .f<format_id>, container theo cặp codec (mp4+m4a, webm+webm, còn lại mkv)"""
+    base, vext = os.path.splitext(video)
+    aext = os.path.splitext(audio)[1].lower()
+    vext = vext.lower()
+    if vext == ".mp4" and aext in (".m4a", ".mp4"): ext = ".mp4"
+    elif vext == ".webm" and aext == ".webm": ext = ".webm"
+    else: ext = ".mkv"
+    return PART_SUFFIX.sub("", base) + ext
+
+
+def temp_output(path):
+    """File tạm cùng thư mục, giữ đuôi để FFmpeg nhận đúng container"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.pp{ext}"
+
+
+def format_timings(timings):
+    return " | ".join(f"{stage} {sec:.1f}s" for stage, sec in timings)
+
+
+class PostProcessor:
+    """Pool hậu kỳ dùng chung cho mọi job. Bước nặng (FFmpeg) chạy trên thread riêng của pool,
+    bước nhẹ (chỉ đổi tên) chạy luôn trên thread gọi qua run(). Mỗi bước được đo thời gian."""
+    def __init__(self, workers: int = POSTPROC_WORKERS, rename=None):
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.rename = rename
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="postproc")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.closed = False
+
+    def pending(self):
+        with self._lock: return self._pending
+
+    def submit(self, task, on_done):
+        """Đưa task vào pool; on_done(path, task, error) được gọi trên thread hậu kỳ.
+        Pool đã đóng (Ctrl+C ở --batch) -> PostProcessCancelled, job đang tải dở được báo là hủy."""
+        if self.closed: raise PostProcessCancelled("HUST_CANCELLED")
+        with self._lock: self._pending += 1
+        try:
+            self._pool.submit(self._run_async, task, on_done)
+        except RuntimeError:
+            # shutdown() chen vào giữa lúc kiểm tra closed và submit
+            with self._lock: self._pending -= 1
+            raise PostProcessCancelled("HUST_CANCELLED")
+
+    def _run_async(self, task, on_done):
+        try:
+            try: path, error = self.run(task), None
+            except Exception as e: path, error = None, e
+            on_done(path, task, error)
+        finally:
+            with self._lock: self._pending -= 1
+
+    def shutdown(self, wait=False):
+        self.closed = True
+        self._pool.shutdown(wait=wait)
+
+    def run(self, task):
+        """Chạy lần lượt các bước, trả về đường dẫn file cuối cùng"""
+        path = task.parts[0] if task.parts else None
+        for stage in task.stages:
+            if self.closed or (task.cancel_evt and task.cancel_evt.is_set()):
+                raise PostProcessCancelled("HUST_CANCELLED")
+            t0 = time.perf_counter()
+            path = getattr(self, "stage_" + stage)(task, path)
+            task.timings.append((stage, time.perf_counter() - t0))
+        return path
+
+    # --- CÁC BƯỚC ---
+
+    def ffmpeg_run(self, args, output):
+        """Chạy FFmpeg ghi ra file tạm rồi thay thế output; lỗi thì xóa file tạm và ném PostProcessError"""
+        tmp = temp_output(output)
+        cmd = [self.ffmpeg, "-y", "-hide_banner", "-nostdin", "-loglevel", "error"] + args + [tmp]
+        try:
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT)
+            if proc.returncode != 0:
+                err = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+                raise PostProcessError(err[-1] if err else f"FFmpeg thoát với mã {proc.returncode}")
+            os.replace(tmp, output)
+        except subprocess.TimeoutExpired:
+            raise PostProcessError("FFmpeg quá thời gian")
+        finally:
+            if os.path.exists(tmp):
+                try: os.remove(tmp)
+                except: pass
+        return output
+
+    def stage_merge(self, task, path):
+        """Ghép video-only + audio bằng copy stream (không encode lại), xóa file thành phần"""
+        video, audio = task.parts[0], task.parts[1]
+        output = merged_name(video, audio)
+        self.ffmpeg_run(["-i", video, "-i", audio, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy"], output)
+        for part in (video, audio):
+            if part != output:
+                try: os.remove(part)
+                except OSError: pass
+        return output
+
+    def stage_audio(self, task, path):
+        """Chuyển sang m4a (copy nếu đã là AAC) hoặc mp3"""
+        fmt = task.audio_format or "m4a"
+        output = os.path.splitext(path)[0] + "." + fmt
+        if output == path: return path
+        if fmt == "mp3": codec = ["-c:a", "libmp3lame", "-q:a", "2"]
+        elif os.path.splitext(path)[1].lower() in (".m4a", ".mp4", ".aac"): codec = ["-c:a", "copy"]
+        else: codec = ["-c:a", "aac", "-b:a", "192k"]
+        self.ffmpeg_run(["-i", path, "-vn", "-map", "0:a:0"] + codec, output)
+        try: os.remove(path)
+        except OSError: pass
+        return output
+
+    def fetch_thumbnail(self, url, folder):
+        """Tải ảnh bìa về file tạm; không được thì trả None (nhúng metadata vẫn chạy)"""
+        if not url: return None
+        try:
+            req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'})
+            with urllib.request.urlopen(req, timeout=THUMB_TIMEOUT) as resp:
+                data = resp.read(THUMB_MAX_BYTES + 1)
+            if not data or len(data) > THUMB_MAX_BYTES: return None
+            fd, thumb = tempfile.mkstemp(prefix=".hust_thumb_", dir=folder or ".")
+            with os.fdopen(fd, "wb") as f: f.write(data)
+            return thumb
+        except Exception:
+            return None
+
+    def stage_embed(self, task, path):
+        """Nhúng tiêu đề/kênh/ngày/link và ảnh bìa (mp4/m4a/mp3). Lỗi thì giữ nguyên file, chỉ cảnh báo"""
+        meta = task.meta
+        tags = []
+        for key, value in (("title", meta.get('title')), ("artist", meta.get('artist')), ("date", meta.get('date')), ("comment", meta.get('url'))):
+            if value: tags += ["-metadata", f"{key}={value}"]
+        ext = os.path.splitext(path)[1].lower()
+        thumb = self.fetch_thumbnail(meta.get('thumbnail'), os.path.dirname(path)) if ext in COVER_EXTS else None
+        try:
+            if thumb:
+                try:
+                    return self.ffmpeg_run(self.cover_args(path, thumb, ext, task.media_type) + tags, path)
+                except PostProcessError as e:
+                    task.warnings.append(f"Không nhúng được ảnh bìa: {e}")
+            if not tags: return path
+            return self.ffmpeg_run(["-i", path, "-map", "0", "-c", "copy"] + tags, path)
+        except PostProcessError as e:
+            task.warnings.append(f"Không nhúng được metadata: {e}")
+            return path
+        finally:
+            if thumb:
+                try: os.remove(thumb)
+                except OSError: pass
+
+    @staticmethod
+    def cover_args(path, thumb, ext, media_type):
+        if ext == ".mp3":
+            return ["-i", path, "-i", thumb, "-map", "0:a", "-map", "1:0", "-c:a", "copy", "-c:v", "mjpeg",
+                    "-id3v2_version", "3", "-disposition:v", "attached_pic"]
+        # Ảnh bìa là stream video thứ hai (sau video chính) hoặc duy nhất (file audio)
+        cover = 0 if media_type == "audio" else 1
+        return ["-i", path, "-i", thumb, "-map", "0", "-map", "1:0", "-c", "copy",
+                f"-c:v:{cover}", "mjpeg", f"-disposition:v:{cover}", "attached_pic"]
+
+    def stage_rename(self, task, path):
+        return self.rename(path) if self.rename and path else path
+
+    def stage_move(self, task, path):
+        """Chuyển file từ thư mục tạm sang thư mục lưu (một lần, sau khi mọi bước khác đã xong)"""
+        return move_to(path, task.dest) if path and task.dest else path
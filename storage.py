@@ -0,0 +1,130 @@
+"""Lớp lưu trữ cho job tải: kiểm tra quyền ghi (có cache theo thư mục), dung lượng trống so với file sắp tải,
+cấp phát trước file đích, và thư mục tạm nhanh (bộ nhớ trong) rồi chuyển một lần sang thư mục lưu (thẻ nhớ/USB)."""
+import errno
+import itertools
+import os
+import shutil
+import threading
+import time
+
+WRITABLE_TTL = 300                   # Giây, thư mục đã ghi thử được thì không thử lại trong khoảng này
+SPACE_RESERVE = 64 * 1024 * 1024     # Chừa lại khi kiểm tra dung lượng (Android gần đầy thì app khác lỗi theo)
+WRITE_BUFFER = 1024 * 1024           # Bộ đệm ghi cho Turbo: ghi khối lớn ít lần, hợp với bộ nhớ flash
+YDL_BUFFER_SIZE = 64 * 1024          # Block đọc/ghi ban đầu của yt-dlp (tự co giãn theo tốc độ, mặc định chỉ 1 KiB)
+MOVE_BUFFER = 4 * 1024 * 1024        # Bộ đệm chép khi chuyển file sang ổ khác
+
+_writable = {}
+_writable_lock = threading.Lock()
+
+
+class NotEnoughSpace(Exception):
+    """Không đủ dung lượng trống cho file sắp tải"""
+
+
+def prepare_save_path(path: str, refresh=False):
+    """Tạo thư mục nếu chưa có và kiểm tra quyền ghi; kết quả thành công được nhớ WRITABLE_TTL giây
+    (UI và worker cùng gọi cho một job nên chỉ ghi file thử một lần). Trả (True, path) hoặc (False, lỗi)."""
+    if not path: path = "."
+    key = os.path.abspath(path)
+    now = time.monotonic()
+    with _writable_lock:
+        if not refresh and now - _writable.get(key, -WRITABLE_TTL) < WRITABLE_TTL: return True, path
+    try:
+        os.makedirs(path, exist_ok=True)
+        # Test quyền ghi
+        testfile = os.path.join(path, ".hust_write_test")
+        with open(testfile, "w") as f: f.write("ok")
+        os.remove(testfile)
+    except Exception as ex:
+        forget_writable(path)
+        return False, str(ex)
+    with _writable_lock: _writable[key] = now
+    return True, path
+
+
+def forget_writable(path):
+    """Bỏ kết quả đã nhớ (vd ghi lỗi giữa chừng: thẻ nhớ bị rút)"""
+    with _writable_lock: _writable.pop(os.path.abspath(path or "."), None)
+
+
+def free_space(path):
+    try: return shutil.disk_usage(path or ".").free
+    except OSError: return None
+
+
+def expected_size(info, format_ids=None):
+    """Dung lượng dự kiến (byte) từ info yt-dlp: info đã chọn format, hoặc info thô + các format_id sẽ tải riêng.
+    Chỉ cộng các phần trang báo dung lượng (cận dưới); None nếu không phần nào có."""
+    if not isinstance(info, dict): return None
+    if format_ids:
+        by_id = {f.get('format_id'): f for f in info.get('formats') or [] if isinstance(f, dict)}
+        formats = [by_id.get(i) or {} for i in format_ids]
+    else:
+        formats = info.get('requested_formats') or [info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    sizes = [n for n in sizes if n]
+    return int(sum(sizes)) if sizes else None
+
+
+def ensure_space(path, need):
+    """Ném NotEnoughSpace nếu thư mục không còn đủ need byte (cộng phần chừa lại); need=None thì bỏ qua"""
+    if not need: return
+    free = free_space(path)
+    if free is not None and free < need + SPACE_RESERVE:
+        raise NotEnoughSpace(f"Không đủ dung lượng trống trong {path}: cần ~{need // (1024 * 1024)} MiB, còn {free // (1024 * 1024)} MiB")
+
+
+def preallocate(f, size):
+    """Cấp phát trước size byte cho file đang mở: posix_fallocate giữ chỗ thật trên đĩa (ít phân mảnh,
+    hết chỗ thì lỗi ngay từ đầu); hệ thống không hỗ trợ (Windows, FAT) thì chỉ đặt độ dài file"""
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except AttributeError:
+        f.truncate(size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC: raise
+        f.truncate(size)
+
+
+def same_device(a, b):
+    try: return os.stat(a).st_dev == os.stat(b).st_dev
+    except OSError: return False
+
+
+def unique_path(path):
+    """path nếu chưa có file, không thì thêm hậu tố _1, _2..."""
+    if not os.path.exists(path): return path
+    base, ext = os.path.splitext(path)
+    for i in itertools.count(1):
+        candidate = f"{base}_{i}{ext}"
+        if not os.path.exists(candidate): return candidate
+
+
+def move_to(path, folder):
+    """Chuyển file từ thư mục tạm sang thư mục lưu: cùng ổ thì đổi tên, khác ổ thì chép một lượt
+    qua file tạm (bộ đệm lớn) rồi đổi tên, để thư mục lưu không bao giờ có file dở."""
+    dest = unique_path(os.path.join(folder, os.path.basename(path)))
+    if same_device(os.path.dirname(path) or ".", folder):
+        os.replace(path, dest)
+        return dest
+    tmp = dest + ".moving"
+    try:
+        with open(path, "rb") as src, open(tmp, "wb", buffering=MOVE_BUFFER) as dst:
+            preallocate(dst, os.fstat(src.fileno()).st_size)
+            shutil.copyfileobj(src, dst, MOVE_BUFFER)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            try: os.remove(tmp)
+            except OSError: pass
+        raise
+    os.remove(path)
+    return dest
+
+
+def scratch_for(save_path, scratch_dir):
+    """Thư mục tạm dùng cho job, None nếu không bật / trùng thư mục lưu / không ghi được"""
+    if not scratch_dir: return None
+    if os.path.abspath(scratch_dir) == os.path.abspath(save_path or "."): return None
+    ok, _ = prepare_save_path(scratch_dir)
+    return scratch_dir if ok else None
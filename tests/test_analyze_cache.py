@@ -0,0 +1,55 @@
+"""Info lấy từ cache phân tích (đã chọn format mặc định) phải chọn lại format được như info thô."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+from engine import AnalyzeCache, reusable_info
+
+URL = "https://example.com/watch?v=x"
+
+
+def fake_info():
+    return {'id': 'x', 'title': 'Test', 'extractor': 'generic', 'extractor_key': 'Generic', 'webpage_url': URL,
+            'formats': [{'format_id': 'v1', 'url': 'http://h/v.mp4', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720, 'protocol': 'http', 'filesize': 1000},
+                        {'format_id': 'a1', 'url': 'http://h/a.m4a', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'protocol': 'http', 'filesize': 100},
+                        {'format_id': 'm1', 'url': 'http://h/m.mp4', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 360, 'protocol': 'http', 'filesize': 500}]}
+
+
+def process(info, spec):
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'format': spec}) as ydl:
+        return ydl.process_ie_result(info, download=False)
+
+
+class CachedInfoReselectTest(unittest.TestCase):
+    def setUp(self):
+        # Như DownloadEngine.analyze: info đã chọn cặp mặc định v1+a1 rồi mới vào cache
+        analyzed = process(fake_info(), "v1+a1")
+        self.assertEqual([f['format_id'] for f in analyzed['requested_formats']], ['v1', 'a1'])
+        self.cache = AnalyzeCache()
+        self.cache.put(URL, {'title': 'Test'}, info=reusable_info(analyzed))
+
+    def reprocess(self, spec):
+        # Như run_download khi trúng cache
+        return process(reusable_info(self.cache.get_info(URL)), spec)
+
+    def test_audio_only_drops_stale_pair(self):
+        info = self.reprocess("bestaudio[ext=m4a]/bestaudio/best")
+        self.assertEqual(info['format_id'], 'a1')
+        self.assertNotIn('requested_formats', info)
+        self.assertEqual(info['url'], 'http://h/a.m4a')
+
+    def test_muxed_format_drops_stale_pair(self):
+        info = self.reprocess("m1")
+        self.assertEqual(info['format_id'], 'm1')
+        self.assertNotIn('requested_formats', info)
+
+    def test_pair_still_selectable(self):
+        info = self.reprocess("v1+a1")
+        self.assertEqual([f['format_id'] for f in info['requested_formats']], ['v1', 'a1'])
+
+
+if __name__ == "__main__":
+    unittest.main()
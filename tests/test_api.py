@@ -0,0 +1,180 @@
+"""API điều khiển chạy thật trên MediaServer cục bộ + extractor giả hustbench: xác thực, kiểm tra request,
+gửi job, luồng SSE (kể cả nối lại bằng Last-Event-ID) và hủy job."""
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, ROOT)
+# benchmarks/ trong sys.path để yt-dlp nạp extractor giả trong yt_dlp_plugins/ (hustbench://)
+if BENCH_DIR not in sys.path: sys.path.insert(0, BENCH_DIR)
+
+import yt_dlp  # noqa: E402
+from api import ControlServer, EventHub  # noqa: E402
+from engine import DownloadEngine, DEFAULT_SETTINGS, reusable_info  # noqa: E402
+from media_server import MediaServer  # noqa: E402
+
+TOKEN = "test-token"
+KIB = 1024
+
+
+class ControlServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="hust_api_")
+        cls.out = os.path.join(cls.tmp, "out")
+        os.makedirs(cls.out)
+        # 512 KiB/s mỗi kết nối: file nhỏ tải xong ngay, file lớn đủ lâu để kịp hủy giữa chừng
+        cls.media = MediaServer({"small.mp4": 256 * KIB, "big.mp4": 16 * 1024 * KIB}, per_conn_bps=512 * KIB).__enter__()
+        cls.engine = DownloadEngine(dict(DEFAULT_SETTINGS, dup_policy="off", embed_metadata=False, max_workers=2),
+                                    data_dir=os.path.join(cls.tmp, "data"))
+        cls.server = ControlServer(cls.engine, port=0, token=TOKEN, save_path=cls.out).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.engine.close()
+        cls.media.__exit__(None, None, None)
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def media_url(self, name, video_id):
+        """Link http của file trên MediaServer; info lấy bằng extractor hustbench được đưa sẵn vào cache phân tích
+        như khi người dùng đã bấm Phân tích (API chỉ nhận link http(s))"""
+        port = self.media._httpd.server_address[1]
+        url = f"http://127.0.0.1:{port}/{name}?id={video_id}"
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            info = ydl.extract_info(f"hustbench://127.0.0.1:{port}/{name}?id={video_id}", download=False, process=False)
+        self.engine.analyze_cache.put(url, {'title': info['title']}, info=reusable_info(info))
+        return url
+
+    def request(self, method, path, body=None, headers=None, token=TOKEN):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server._httpd.server_address[1], timeout=10)
+        headers = dict(headers or {})
+        if token: headers["Authorization"] = f"Bearer {token}"
+        if isinstance(body, dict):
+            body = json.dumps(body)
+            headers.setdefault("Content-Type", "application/json")
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return resp.status, json.loads(data) if data else None
+
+    def open_events(self, last_event_id=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server._httpd.server_address[1], timeout=30)
+        headers = {"Authorization": f"Bearer {TOKEN}"}
+        if last_event_id is not None: headers["Last-Event-ID"] = str(last_event_id)
+        conn.request("GET", "/api/events", headers=headers)
+        resp = conn.getresponse()
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.getheader("Content-Type"), "text/event-stream")
+        return conn, resp
+
+    def read_events(self, resp, until, timeout=30):
+        """Đọc sự kiện SSE (seq, tên, data) tới khi until(tên, data) đúng"""
+        events, fields = [], {}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = resp.fp.readline().decode("utf-8").rstrip("\n")
+            if line.startswith(":"): continue
+            if line:
+                name, _, value = line.partition(": ")
+                fields[name] = value
+                continue
+            if not fields: continue
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+            fields = {}
+            if until(events[-1][1], events[-1][2]): return events
+        self.fail(f"Hết giờ chờ sự kiện SSE, đã nhận: {[e[1] for e in events]}")
+
+    def test_rejects_bad_token(self):
+        self.assertEqual(self.request("GET", "/api/jobs", token="sai")[0], 401)
+        self.assertEqual(self.request("GET", "/api/jobs", token=None)[0], 401)
+        self.assertEqual(self.request("GET", f"/api/jobs?token={TOKEN}", token=None)[0], 200)
+
+    def test_rejects_non_json(self):
+        body = json.dumps({'url': "http://127.0.0.1/x.mp4"})
+        status, _ = self.request("POST", "/api/jobs", body=body, headers={"Content-Type": "text/plain"})
+        self.assertEqual(status, 415)
+
+    def test_rejects_save_path_outside_output(self):
+        for path in ("..", os.path.dirname(self.out), "../khac"):
+            status, _ = self.request("POST", "/api/jobs", {'url': "http://127.0.0.1/x.mp4", 'save_path': path})
+            self.assertEqual(status, 403, path)
+
+    def test_job_flow_and_replay(self):
+        conn, resp = self.open_events()
+        try:
+            snapshot = self.read_events(resp, lambda name, data: name == 'snapshot')
+            url = self.media_url("small.mp4", "flow1")
+            status, body = self.request("POST", "/api/jobs", {'url': url, 'format': "360p", 'save_path': "api"})
+            self.assertEqual(status, 201)
+            job_id = body['id']
+            events = self.read_events(resp, lambda name, data: name == 'worker_done' and data.get('job_id') == job_id)
+        finally:
+            conn.close()
+        mine = [(seq, name, data) for seq, name, data in events if data.get('job_id') == job_id]
+        names = [name for _, name, _ in mine]
+        self.assertEqual(names[0], 'queued')
+        self.assertIn('finished', names)
+        finished = next(data for _, name, data in mine if name == 'finished')
+        self.assertEqual(os.path.dirname(finished['filepath']), os.path.join(os.path.realpath(self.out), "api"))
+        self.assertTrue(os.path.exists(finished['filepath']))
+        seqs = [seq for seq, _, _ in events]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertGreater(seqs[0], snapshot[0][0])
+
+        # Nối lại từ sự kiện 'queued': nhận lại đúng các sự kiện sau đó, không kèm snapshot
+        queued_seq = mine[0][0]
+        conn, resp = self.open_events(last_event_id=queued_seq)
+        try:
+            replay = self.read_events(resp, lambda name, data: name == 'worker_done' and data.get('job_id') == job_id)
+        finally:
+            conn.close()
+        self.assertNotIn('snapshot', [name for _, name, _ in replay])
+        self.assertTrue(all(seq > queued_seq for seq, _, _ in replay))
+        self.assertIn('finished', [name for _, name, data in replay if data.get('job_id') == job_id])
+
+        status, job = self.request("GET", f"/api/jobs/{job_id}")
+        self.assertEqual(status, 200)
+        self.assertEqual(job['state'], 'finished')
+
+    def test_cancel_running_job(self):
+        conn, resp = self.open_events()
+        try:
+            url = self.media_url("big.mp4", "cancel1")
+            status, body = self.request("POST", "/api/jobs", {'url': url, 'format': "360p"})
+            self.assertEqual(status, 201)
+            job_id = body['id']
+            self.read_events(resp, lambda name, data: name == 'progress' and data.get('job_id') == job_id)
+            self.assertEqual(self.request("DELETE", f"/api/jobs/{job_id}")[0], 202)
+            self.read_events(resp, lambda name, data: name == 'cancelled' and data.get('job_id') == job_id)
+        finally:
+            conn.close()
+        self.assertEqual(self.request("GET", f"/api/jobs/{job_id}")[1]['state'], 'cancelled')
+        self.assertEqual(self.request("DELETE", f"/api/jobs/{job_id}")[0], 404)
+
+
+class EventHubStateTest(unittest.TestCase):
+    def playlist_state(self, done, failed, total):
+        hub = EventHub()
+        hub.publish({'type': 'queued', 'job_id': 1, 'url': "http://x/list"})
+        hub.publish({'type': 'playlist_progress', 'job_id': 1, 'done': done, 'failed': failed, 'total': total})
+        hub.publish({'type': 'playlist_done', 'job_id': 1, 'done': done, 'failed': failed, 'total': total})
+        hub.publish({'type': 'worker_done', 'job_id': 1})
+        return hub.job(1)['state']
+
+    def test_playlist_done_reports_failures(self):
+        self.assertEqual(self.playlist_state(3, 0, 3), 'finished')
+        self.assertEqual(self.playlist_state(2, 1, 3), 'finished_with_errors')
+        self.assertEqual(self.playlist_state(0, 3, 3), 'error')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""BandwidthScheduler: giới hạn chung chỉ chia cho các job đang thực sự nhận dữ liệu."""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import BandwidthScheduler
+
+KIB = 1024
+LIMIT = 1024 * KIB
+BLOCK = 16 * KIB
+DURATION = 2.0
+
+
+def transfer(bw, key, duration, totals):
+    """Worker giả: consume() từng block như đường tải thật trong khoảng duration giây"""
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        bw.consume(key, BLOCK)
+        totals[key] = totals.get(key, 0) + BLOCK
+
+
+class BandwidthSchedulerTest(unittest.TestCase):
+    def run_jobs(self, bw, keys, duration=DURATION):
+        totals = {}
+        threads = [threading.Thread(target=transfer, args=(bw, key, duration, totals)) for key in keys]
+        t0 = time.monotonic()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return totals, time.monotonic() - t0
+
+    def test_split_only_among_transferring_jobs(self):
+        bw = BandwidthScheduler(LIMIT)
+        for key in ("a", "b", "idle"): bw.register(key)  # "idle" đăng ký nhưng còn đang extract, không tải
+        totals, elapsed = self.run_jobs(bw, ("a", "b"))
+        share = LIMIT / 2 * elapsed
+        for key in ("a", "b"):
+            # Chia 3 thì mỗi job chỉ được ~2/3 mức này
+            self.assertGreater(totals[key], share * 0.85, key)
+            self.assertLess(totals[key], share * 1.15 + BLOCK, key)
+        self.assertLess(sum(totals.values()), LIMIT * elapsed * 1.1 + 2 * BLOCK)
+
+    def test_fair_between_active_jobs(self):
+        bw = BandwidthScheduler(LIMIT)
+        for key in ("a", "b", "c"): bw.register(key)
+        totals, elapsed = self.run_jobs(bw, ("a", "b", "c"))
+        self.assertLess(max(totals.values()) / min(totals.values()), 1.25)
+        self.assertLess(sum(totals.values()), LIMIT * elapsed * 1.1 + 3 * BLOCK)
+
+    def test_unlimited_never_waits(self):
+        bw = BandwidthScheduler(0)
+        bw.register("a")
+        t0 = time.monotonic()
+        for _ in range(1000): bw.consume("a", BLOCK)
+        self.assertLess(time.monotonic() - t0, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""EventChannel: progress dồn dập chỉ giữ tick mới nhất, control event không bao giờ bị bỏ hay đảo thứ tự."""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import EventChannel
+
+JOBS = 4
+TICKS = 5000
+
+
+class EventChannelTest(unittest.TestCase):
+    def test_progress_coalesced_per_key(self):
+        ch = EventChannel()
+        for i in range(100):
+            ch.put_progress((1, None), {'type': 'progress', 'job_id': 1, 'downloaded': i})
+            ch.put_progress((1, 0), {'type': 'progress', 'job_id': 1, 'entry': 0, 'downloaded': i})
+        ch.put({'type': 'finished', 'job_id': 1})
+        items = ch.drain()
+        self.assertEqual([(e['type'], e.get('entry'), e.get('downloaded')) for e in items],
+                         [('progress', None, 99), ('progress', 0, 99), ('finished', None, None)])
+        self.assertEqual(ch.drain(), [])
+
+    def test_control_events_survive_backpressure(self):
+        # Nhiều worker bắn progress dày đặc xen control event trong khi UI (thread này) xả chậm
+        ch = EventChannel()
+        tapped = []
+        ch.taps.append(tapped.append)
+        start = threading.Barrier(JOBS + 1)
+
+        def worker(job):
+            start.wait()
+            for i in range(TICKS):
+                ch.put_progress((job, None), {'type': 'progress', 'job_id': job, 'downloaded': i})
+                if i % 100 == 0: ch.put({'type': 'log', 'job_id': job, 'n': i})
+            ch.put({'type': 'finished', 'job_id': job})
+            ch.put({'type': 'worker_done', 'job_id': job})
+
+        threads = [threading.Thread(target=worker, args=(job,)) for job in range(JOBS)]
+        for t in threads: t.start()
+        start.wait()
+        received = []
+        while any(t.is_alive() for t in threads):
+            batch = ch.drain()
+            # Kênh không phình theo số tick: mỗi lần xả tối đa 1 progress cho mỗi job
+            self.assertLessEqual(sum(1 for e in batch if e['type'] == 'progress'), JOBS)
+            received.extend(batch)
+        for t in threads: t.join()
+        received.extend(ch.drain())
+
+        for job in range(JOBS):
+            control = [e for e in received if e['job_id'] == job and e['type'] != 'progress']
+            self.assertEqual([e.get('n') for e in control if e['type'] == 'log'], list(range(0, TICKS, 100)))
+            self.assertEqual([e['type'] for e in control[-2:]], ['finished', 'worker_done'])
+            # Tick cuối cùng luôn tới nơi, trước 'finished' của job đó
+            last = max(i for i, e in enumerate(received) if e['job_id'] == job and e['type'] == 'progress')
+            self.assertEqual(received[last]['downloaded'], TICKS - 1)
+            self.assertLess(last, received.index(control[-2]))
+        # taps nhận đủ mọi sự kiện, kể cả progress đã bị gộp
+        self.assertEqual(sum(1 for e in tapped if e['type'] == 'progress'), JOBS * TICKS)
+
+
+if __name__ == "__main__":
+    unittest.main()
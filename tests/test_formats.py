@@ -0,0 +1,101 @@
+"""rank_formats: xếp hạng format theo chính sách (độ phân giải tối đa, ngân sách dung lượng, codec, có/không FFmpeg)."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formats import FormatPolicy, rank_formats, build_options
+
+MIB = 1024 * 1024
+
+
+def video(format_id, height, vcodec="avc1.640028", ext="mp4", size=None, fps=30, acodec="none", tbr=None):
+    return {'format_id': format_id, 'height': height, 'width': height * 16 // 9, 'vcodec': vcodec, 'acodec': acodec,
+            'ext': ext, 'filesize': size, 'fps': fps, 'tbr': tbr}
+
+
+FORMATS = [
+    {'format_id': 'a-m4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'ext': 'm4a', 'abr': 128, 'filesize': 2 * MIB},
+    {'format_id': 'a-opus', 'vcodec': 'none', 'acodec': 'opus', 'ext': 'webm', 'abr': 160, 'filesize': 3 * MIB},
+    video('360-avc', 360, size=10 * MIB),
+    video('480-muxed', 480, acodec='mp4a.40.2', size=25 * MIB),
+    video('720-avc', 720, size=40 * MIB),
+    video('720-vp9', 720, vcodec='vp09.00.40.08', ext='webm', size=30 * MIB),
+    video('1080-avc', 1080, size=90 * MIB),
+    video('1080-av1', 1080, vcodec='av01.0.08M.08', size=70 * MIB),
+    video('2160-vp9', 2160, vcodec='vp9', ext='webm', size=400 * MIB),
+    video('tiny', 96, size=1 * MIB),
+]
+
+
+def ids(ranked):
+    return [r['format']['format_id'] for r in ranked]
+
+
+class RankFormatsTest(unittest.TestCase):
+    def test_unconstrained_prefers_height_then_hw_codec(self):
+        ranked = rank_formats(FORMATS, FormatPolicy())
+        self.assertEqual(ids(ranked)[:3], ['2160-vp9', '1080-avc', '1080-av1'])
+        self.assertNotIn('tiny', ids(ranked))
+        self.assertNotIn('a-m4a', ids(ranked))
+
+    def test_audio_paired_by_container(self):
+        by_id = {r['format']['format_id']: r for r in rank_formats(FORMATS, FormatPolicy())}
+        self.assertEqual(by_id['720-avc']['spec'], '720-avc+a-m4a')
+        self.assertEqual(by_id['720-vp9']['spec'], '720-vp9+a-opus')
+        self.assertEqual(by_id['720-avc']['size'], 42 * MIB)
+        self.assertEqual(by_id['480-muxed']['spec'], '480-muxed')
+        self.assertIsNone(by_id['480-muxed']['audio'])
+
+    def test_max_height(self):
+        ranked = rank_formats(FORMATS, FormatPolicy(max_height=720))
+        self.assertEqual(ids(ranked)[:2], ['720-avc', '720-vp9'])
+        # Mọi format vượt giới hạn đứng sau, cái vượt ít nhất trước
+        over = [r['format']['format_id'] for r in ranked if r['format']['height'] > 720]
+        self.assertEqual(ids(ranked)[-len(over):], over)
+        self.assertEqual(over[0], '1080-avc')
+
+    def test_size_budget(self):
+        ranked = rank_formats(FORMATS, FormatPolicy(size_budget=50 * MIB))
+        self.assertEqual(ids(ranked)[0], '720-avc')
+        # Không có gì vừa ngân sách -> chọn bản nhỏ nhất
+        ranked = rank_formats(FORMATS, FormatPolicy(size_budget=5 * MIB))
+        self.assertEqual(ids(ranked)[0], '360-avc')
+
+    def test_codec_preference(self):
+        ranked = rank_formats(FORMATS, FormatPolicy(max_height=1080, codec="av1"))
+        self.assertEqual(ids(ranked)[0], '1080-av1')
+        ranked = rank_formats(FORMATS, FormatPolicy(max_height=720, codec="vp9"))
+        self.assertEqual(ids(ranked)[0], '720-vp9')
+
+    def test_learned_ext(self):
+        ranked = rank_formats(FORMATS, FormatPolicy(max_height=720, codec="auto", ext="webm"))
+        # Codec vẫn được xét trước container đã học
+        self.assertEqual(ids(ranked)[0], '720-avc')
+        same_codec = [video('720-mp4', 720, size=40 * MIB), video('720-webm', 720, ext='webm', size=40 * MIB)]
+        self.assertEqual(ids(rank_formats(same_codec + FORMATS[:2], FormatPolicy(ext="webm")))[0], '720-webm')
+
+    def test_without_ffmpeg_only_muxed(self):
+        self.assertEqual(ids(rank_formats(FORMATS, FormatPolicy(), has_ffmpeg=False)), ['480-muxed'])
+
+    def test_size_from_bitrate(self):
+        fmts = [video('v', 720, tbr=800)]
+        ranked = rank_formats(fmts, FormatPolicy(), has_ffmpeg=False, duration=10)
+        self.assertEqual(ranked, [])
+        fmts = [video('v', 720, acodec='mp4a.40.2', tbr=800)]
+        self.assertEqual(rank_formats(fmts, FormatPolicy(), duration=10)[0]['size'], 800 * 10 * 125)
+
+    def test_build_options_marks_recommended(self):
+        options, recommended = build_options({'formats': FORMATS, 'duration': 60}, FormatPolicy(max_height=720), has_ffmpeg=True)
+        self.assertEqual(recommended, '720-avc')
+        keys = [o['key'] for o in options]
+        self.assertEqual(keys[:2], ['audio', 'audio_mp3'])
+        self.assertEqual(keys[2:], ['2160-vp9', '1080-avc', '720-avc', '480-muxed', '360-avc'])
+        text = {o['key']: o['text'] for o in options}
+        self.assertTrue(text['720-avc'].startswith("⭐"))
+        self.assertIn("vượt giới hạn", text['1080-avc'])
+
+
+if __name__ == "__main__":
+    unittest.main()
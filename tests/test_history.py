@@ -0,0 +1,52 @@
+"""Lịch sử: tìm theo tiêu đề (FTS trigram / LIKE) và matches() cho dòng mới phải cho cùng kết quả với query()."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import HistoryStore
+
+TITLES = ["Sơn Tùng M-TP - Lạc Trôi", "SƠN TÙNG live", "100%_sale video", 'Quote "MTP" test', "ab", "Audio clip"]
+SEARCHES = ["sơn tùng", "Tùng", "100%_", '"MTP"', "ab", "a", "video", "zzz", "live"]
+
+
+class HistorySearchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(os.path.join(self.tmp.name, "history.db"))
+        self.items = []
+        for i, title in enumerate(TITLES):
+            item = {'title': title, 'date': f"2026-01-{i + 1:02d} 10:00", 'path': f"/x/{i}.mp4", 'type': 'audio' if 'Audio' in title else 'video'}
+            item['id'] = self.store.add(item)
+            self.items.append(item)
+
+    def tearDown(self):
+        self.store._db.close()
+        self.tmp.cleanup()
+
+    def check_matches_query(self):
+        for search in SEARCHES:
+            for media_type in (None, 'video', 'audio'):
+                found = {r['id'] for r in self.store.query(search, media_type)}
+                self.assertEqual(self.store.count(search, media_type), len(found), (search, media_type))
+                for item in self.items:
+                    self.assertEqual(self.store.matches(item, search, media_type), item['id'] in found, (search, media_type, item['title']))
+
+    def test_matches_agrees_with_query(self):
+        self.assertTrue(self.store.fts)
+        self.check_matches_query()
+
+    def test_like_fallback_agrees_with_query(self):
+        self.store.fts = False
+        self.check_matches_query()
+
+    def test_unsaved_row_matches_only_without_filter(self):
+        item = {'title': 'Sơn Tùng', 'type': 'video'}
+        self.assertTrue(self.store.matches(item))
+        self.assertFalse(self.store.matches(item, "Tùng"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""MediaIndex: phát hiện video đã tải, bản khác chất lượng của cùng video không bị coi là trùng."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from engine import MediaIndex, quality_outtmpl, quick_hash, remote_quick_hash  # noqa: E402
+from media_server import MediaServer  # noqa: E402
+
+
+class MediaIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="hust_index_")
+        self.index = MediaIndex(os.path.join(self.tmp, "media_index.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def touch(self, name, data=b"x" * 100):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f: f.write(data)
+        return path
+
+    def test_same_id_other_quality_not_duplicate(self):
+        path = self.touch("Clip-abc.mp4")
+        self.index.add("Youtube", "abc", "video", path, format_id="18", height=360)
+        self.assertEqual(self.index.lookup("Youtube", "abc", "video", "22", 720), None)
+        self.assertEqual(self.index.lookup("Youtube", "abc", "video", "18", 360), path)
+        # Format khác nhưng cùng độ phân giải (vd mp4/webm 360p) vẫn là trùng
+        self.assertEqual(self.index.lookup("Youtube", "abc", "video", "243", 360), path)
+        # Không chọn chất lượng rõ ràng -> bản nào cũng được
+        self.assertEqual(self.index.lookup("Youtube", "abc", "video"), path)
+
+    def test_type_and_extractor_are_part_of_key(self):
+        path = self.touch("Clip-abc.m4a")
+        self.index.add("Youtube", "abc", "audio", path)
+        self.assertIsNone(self.index.lookup("Youtube", "abc", "video"))
+        self.assertIsNone(self.index.lookup("Vimeo", "abc", "audio"))
+        self.assertEqual(self.index.lookup("Youtube", "abc", "audio"), path)
+
+    def test_scanned_file_matches_by_stem(self):
+        path = self.touch("Old_Clip-x_z.mp4")
+        self.touch("Other-xaz.mp4")
+        self.assertEqual(self.index.ensure_scanned(self.tmp), 2)
+        self.assertEqual(self.index.ensure_scanned(self.tmp), 0)
+        # Tên quét không rõ chất lượng: chỉ trùng khi người dùng không chọn chất lượng cụ thể
+        self.assertIsNone(self.index.lookup("Youtube", "x_z", "video", "22", 720))
+        self.assertEqual(self.index.lookup("Youtube", "x_z", "video"), path)
+        # "_" trong id không phải ký tự đại diện của LIKE
+        os.remove(path)
+        self.assertIsNone(self.index.lookup("Youtube", "x_z", "video"))
+
+    def test_scanned_file_renamed_with_suffix(self):
+        # safe_rename_downloaded_file thêm "_N" khi trùng tên
+        path = self.touch("Clip-abc_2.mp4")
+        self.touch("Clip-abcd.mp4")
+        self.touch("Clip-abc_x.mp4")
+        self.index.ensure_scanned(self.tmp)
+        self.assertEqual(self.index.lookup("Youtube", "abc", "video"), path)
+        os.remove(path)
+        self.assertIsNone(self.index.lookup("Youtube", "abc", "video"))
+
+    def test_lookup_hash(self):
+        path = self.touch("Clip-abc.mp4", b"data" * 100)
+        self.index.add("Youtube", "abc", "video", path, content_hash=quick_hash(path))
+        self.assertEqual(self.index.lookup_hash(quick_hash(path)), path)
+        self.assertIsNone(self.index.lookup_hash(quick_hash(path), exclude_path=path))
+        self.assertIsNone(self.index.lookup_hash("0" * 40))
+
+    def test_remote_hash_matches_local(self):
+        sizes = {"small.mp4": 1000, "mid.mp4": 100 * 1024, "big.mp4": 3 * 1024 * 1024}
+        with MediaServer(sizes) as server:
+            for name, size in sizes.items():
+                path = self.touch(name, server.files[name][:size])
+                self.assertEqual(remote_quick_hash(server.url(name)), quick_hash(path), name)
+            self.assertIsNone(remote_quick_hash(server.url("missing.mp4")))
+
+    def test_missing_file_is_forgotten(self):
+        path = self.touch("Gone-abc.mp4")
+        self.index.add("Youtube", "abc", "video", path)
+        os.remove(path)
+        self.assertIsNone(self.index.lookup("Youtube", "abc", "video"))
+
+    def test_quality_outtmpl_keeps_old_copy(self):
+        outtmpl = os.path.join(self.tmp, "%(title).50s-%(id)s.%(ext)s")
+        self.assertEqual(quality_outtmpl(outtmpl, {'height': 720, 'format_id': '22'}),
+                         os.path.join(self.tmp, "%(title).50s_720p-%(id)s.%(ext)s"))
+        self.assertEqual(quality_outtmpl(outtmpl, {'format_id': 'hls-1.2'}),
+                         os.path.join(self.tmp, "%(title).50s_hls12-%(id)s.%(ext)s"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Pool hậu kỳ: submit sau shutdown phải báo hủy và không để lại tác vụ treo (--batch chờ pending() về 0)."""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from postprocess import PostProcessor, PostTask, PostProcessCancelled
+
+
+class PostProcessorShutdownTest(unittest.TestCase):
+    def test_submit_after_shutdown_is_cancelled(self):
+        pp = PostProcessor(workers=1)
+        pp.shutdown()
+        with self.assertRaises(PostProcessCancelled) as ctx:
+            pp.submit(PostTask(["x.mp4"], ["rename"]), lambda *a: None)
+        self.assertIn("HUST_CANCELLED", str(ctx.exception))
+        self.assertEqual(pp.pending(), 0)
+
+    def test_pool_closed_behind_flag_is_cancelled(self):
+        # shutdown() của executor chen giữa lúc kiểm tra closed và submit
+        pp = PostProcessor(workers=1)
+        pp._pool.shutdown()
+        with self.assertRaises(PostProcessCancelled):
+            pp.submit(PostTask(["x.mp4"], ["rename"]), lambda *a: None)
+        self.assertEqual(pp.pending(), 0)
+
+    def test_pending_returns_to_zero_after_run(self):
+        pp = PostProcessor(workers=1)
+        done = threading.Event()
+        results = []
+        pp.submit(PostTask(["x.mp4"], ["rename"]), lambda path, task, error: (results.append((path, error)), done.set()))
+        self.assertTrue(done.wait(5))
+        pp.shutdown(wait=True)
+        self.assertEqual(results, [("x.mp4", None)])
+        self.assertEqual(pp.pending(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
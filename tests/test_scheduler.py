@@ -0,0 +1,112 @@
+"""JobScheduler: thứ tự ưu tiên/FIFO, hủy job đang chờ và đang chạy, giảm số worker khi đang chạy."""
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import JobScheduler
+
+WAIT = 5
+
+
+def wait_until(cond, timeout=WAIT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond(): return True
+        time.sleep(0.01)
+    return cond()
+
+
+class Runner:
+    """runner(job) giả: ghi lại thứ tự chạy, job có url 'block' thì chờ tới khi được thả (hoặc bị hủy)"""
+    def __init__(self):
+        self.order = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, job):
+        with self.lock:
+            self.order.append(job.url)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if job.url.startswith("block"):
+                while not self.release.is_set() and not job.cancel_event.is_set(): time.sleep(0.01)
+            else:
+                time.sleep(0.02)
+        finally:
+            with self.lock: self.active -= 1
+
+
+class JobSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner()
+        self.events = queue.Queue()
+        self.discarded = []
+        self.sched = JobScheduler(self.runner, self.events, max_workers=1, on_discard=self.discarded.append)
+
+    def tearDown(self):
+        self.runner.release.set()
+        self.sched.cancel_all()
+
+    def drain(self):
+        out = []
+        while True:
+            try: out.append(self.events.get_nowait())
+            except queue.Empty: return out
+
+    def test_priority_then_fifo(self):
+        self.sched.submit("block")
+        self.assertTrue(wait_until(lambda: self.runner.order == ["block"]))
+        for url, priority in (("low-1", 1), ("high-1", 0), ("low-2", 1), ("high-2", 0), ("low-3", 1)):
+            self.sched.submit(url, priority=priority)
+        self.runner.release.set()
+        self.assertTrue(wait_until(lambda: len(self.runner.order) == 6))
+        self.assertEqual(self.runner.order, ["block", "high-1", "high-2", "low-1", "low-2", "low-3"])
+
+    def test_cancel_queued_job(self):
+        self.sched.submit("block")
+        self.assertTrue(wait_until(lambda: self.sched.stats()['running'] == 1))
+        job_id = self.sched.submit("queued")
+        self.assertTrue(self.sched.cancel(job_id))
+        self.assertFalse(self.sched.cancel(job_id))
+        self.assertEqual([job.job_id for job in self.discarded], [job_id])
+        mine = [e['type'] for e in self.drain() if e['job_id'] == job_id]
+        self.assertEqual(mine, ['queued', 'cancelled', 'worker_done'])
+        self.runner.release.set()
+        self.assertTrue(wait_until(lambda: self.sched.stats()['running'] == 0))
+        self.assertNotIn("queued", self.runner.order)
+
+    def test_cancel_running_job(self):
+        job_id = self.sched.submit("block")
+        self.assertTrue(wait_until(lambda: self.sched.stats()['running'] == 1))
+        self.assertTrue(self.sched.cancel(job_id))
+        # Job đang chạy do runner tự dừng khi thấy cancel_event, không bị bỏ khỏi hàng đợi như job đang chờ
+        self.assertEqual(self.discarded, [])
+        self.assertTrue(wait_until(lambda: self.sched.stats()['running'] == 0))
+        self.assertFalse(self.sched.cancel(job_id))
+        self.sched.submit("after")
+        self.assertTrue(wait_until(lambda: self.runner.order == ["block", "after"]))
+
+    def test_shrink_workers(self):
+        self.sched.set_max_workers(3)
+        for i in range(3): self.sched.submit(f"block-{i}")
+        self.assertTrue(wait_until(lambda: self.sched.stats()['running'] == 3))
+        self.sched.set_max_workers(1)
+        self.runner.release.set()
+        self.assertTrue(wait_until(lambda: self.sched.stats()['workers'] == 1))
+        self.runner.peak = 0
+        for i in range(4): self.sched.submit(f"job-{i}")
+        self.assertTrue(wait_until(lambda: len(self.runner.order) == 7 and self.sched.stats()['running'] == 0))
+        self.assertEqual(self.runner.peak, 1)
+        self.assertEqual(self.runner.order[3:], [f"job-{i}" for i in range(4)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+"""Pool YoutubeDL: khóa session chỉ theo cookie + option mạng, option của job gắn khi mượn và gỡ khi trả."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import YDLSessionPool, ANALYZE_OPTS, YDL_NET_OPTS
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = YDLSessionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_key_ignores_job_options(self):
+        download = dict(YDL_NET_OPTS, outtmpl="/tmp/x/%(id)s.%(ext)s", format="18", noplaylist=True, retries=10)
+        self.assertEqual(YDLSessionPool.make_key(ANALYZE_OPTS, "c"), YDLSessionPool.make_key(download, "c"))
+        self.assertNotEqual(YDLSessionPool.make_key(download, "c"), YDLSessionPool.make_key(download, "khác"))
+        self.assertNotEqual(YDLSessionPool.make_key(download), YDLSessionPool.make_key(dict(download, proxy="http://p")))
+
+    def test_job_options_applied_while_borrowed(self):
+        with self.pool.session(ANALYZE_OPTS) as ydl:
+            self.assertTrue(ydl.params.get('extract_flat'))
+            first = ydl
+        with self.pool.session(dict(YDL_NET_OPTS, outtmpl="/tmp/x/%(id)s.%(ext)s", format="18")) as ydl:
+            self.assertIs(ydl, first)
+            self.assertIsNone(ydl.params.get('extract_flat'))
+            self.assertEqual(ydl.params['outtmpl']['default'], "/tmp/x/%(id)s.%(ext)s")
+            self.assertIn('chapter', ydl.params['outtmpl'])
+            self.assertIsNotNone(ydl.format_selector)
+        self.assertIsNone(first.format_selector)
+        self.assertNotIn('format', first.params)
+        self.assertNotEqual(first.params['outtmpl']['default'], "/tmp/x/%(id)s.%(ext)s")
+
+
+if __name__ == "__main__":
+    unittest.main()
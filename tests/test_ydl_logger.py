@@ -0,0 +1,45 @@
+"""YDLLogger: lần thử lại được tính cho đúng job kể cả khi yt-dlp ghi log từ thread khác (tải fragment song song)."""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import YDLLogger, LogStore, LOG_CONTEXT
+
+RETRY = "[download] Got error: HTTP Error 503: Service Unavailable. Retrying (1/10)..."
+FRAGMENT_RETRY = "[download] Got error: The read operation timed out. Retrying fragment 12 (2/10)..."
+
+
+class YDLLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.retries = []
+        self.store = LogStore()
+        self.logger = YDLLogger(self.store, {"verbose_log": True}, on_retry=lambda job_id, fragment: self.retries.append((job_id, fragment)))
+
+    def log_from_thread(self, logger, msg):
+        t = threading.Thread(target=logger.debug, args=(msg,))
+        t.start(); t.join()
+
+    def test_job_logger_counts_from_any_thread(self):
+        job = self.logger.for_job(7)
+        self.log_from_thread(job, RETRY)
+        self.log_from_thread(job, FRAGMENT_RETRY)
+        self.log_from_thread(job, "[download]  42.0% of 10.00MiB")
+        self.assertEqual(self.retries, [(7, False), (7, True)])
+        self.assertEqual({r['job_id'] for r in self.store.tail(10)}, {7})
+
+    def test_shared_logger_uses_thread_context(self):
+        LOG_CONTEXT.job_id = 3
+        try:
+            self.logger.debug(RETRY)
+        finally:
+            LOG_CONTEXT.job_id = None
+        # Thread không có LOG_CONTEXT (vd thread tải fragment) -> không biết job
+        self.log_from_thread(self.logger, RETRY)
+        self.assertEqual(self.retries, [(3, False), (None, False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+"""Chế độ Turbo: tải file progressive (MP4 một luồng) bằng nhiều kết nối song song,
+mỗi kết nối lấy một đoạn Range riêng rồi ghi thẳng vào đúng vị trí trong file.
+Vị trí đã ghi của từng đoạn được lưu cạnh file tạm nên app bị kill vẫn tải tiếp được."""
+import json
+import os
+import threading
+import time
+import urllib.request
+from storage import preallocate, WRITE_BUFFER
+
+TURBO_MIN_SIZE = 4 * 1024 * 1024   # File nhỏ hơn thì tải 1 luồng là đủ
+TURBO_CHUNK = 256 * 1024
+TURBO_TEMP_SUFFIX = ".turbo"       # Không dùng .part để yt-dlp không nhầm khi tải tiếp
+TURBO_STATE_SUFFIX = ".json"       # Vị trí đã ghi của từng đoạn (cạnh file tạm)
+TURBO_STATE_BYTES = 4 * 1024 * 1024  # Mỗi kết nối flush + cập nhật vị trí đã ghi sau chừng này byte
+TURBO_STATE_INTERVAL = 1.0         # Giây, chu kỳ ghi file trạng thái
+DEFAULT_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+
+
+class TurboUnsupported(Exception):
+    """Server không hỗ trợ Range hoặc không rõ dung lượng -> quay về đường tải thường"""
+
+
+class TurboCancelled(Exception):
+    """Người dùng hủy trong lúc tải Turbo"""
+
+
+def _request(url, headers, start=None, end=None):
+    h = {'User-Agent': DEFAULT_UA}
+    h.update(headers or {})
+    if start is not None:
+        h['Range'] = f"bytes={start}-{'' if end is None else end}"
+    return urllib.request.Request(url, headers=h)
+
+
+def probe_size(url, headers=None, timeout=30):
+    """Kiểm tra server có trả 206 cho Range không và lấy tổng dung lượng file"""
+    try:
+        with urllib.request.urlopen(_request(url, headers, 0, 0), timeout=timeout) as resp:
+            content_range = resp.headers.get('Content-Range') or ""
+            if resp.status != 206 or '/' not in content_range:
+                raise TurboUnsupported("Server không hỗ trợ Range")
+            total = content_range.rsplit('/', 1)[1].strip()
+            if not total.isdigit():
+                raise TurboUnsupported("Không rõ dung lượng file")
+            return int(total)
+    except TurboUnsupported:
+        raise
+    except Exception as e:
+        raise TurboUnsupported(str(e))
+
+
+def read_range(url, start, end, headers=None, timeout=30):
+    """Đọc byte [start, end] của url bằng một request Range, trả (dữ liệu, tổng dung lượng file).
+    Ném TurboUnsupported nếu server không trả 206 kèm dung lượng."""
+    with urllib.request.urlopen(_request(url, headers, start, end), timeout=timeout) as resp:
+        total = (resp.headers.get('Content-Range') or "").rsplit('/', 1)[-1].strip()
+        if resp.status != 206 or not total.isdigit():
+            raise TurboUnsupported("Server không hỗ trợ Range")
+        return resp.read(), int(total)
+
+
+def load_state(tmp, size):
+    """Các đoạn [start, pos, end] của lần tải trước cùng dung lượng, None nếu không tải tiếp được"""
+    try:
+        with open(tmp + TURBO_STATE_SUFFIX, encoding="utf-8") as f: state = json.load(f)
+        if state.get('size') != size or os.path.getsize(tmp) != size: return None
+        ranges = [[int(a), int(b), int(c)] for a, b, c in state['ranges']]
+        return ranges if all(a <= b <= c + 1 for a, b, c in ranges) else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_state(tmp, size, ranges):
+    try:
+        with open(tmp + TURBO_STATE_SUFFIX + ".tmp", "w", encoding="utf-8") as f: json.dump({'size': size, 'ranges': ranges}, f)
+        os.replace(tmp + TURBO_STATE_SUFFIX + ".tmp", tmp + TURBO_STATE_SUFFIX)
+    except OSError:
+        pass
+
+
+def discard_partial(dest):
+    """Xóa file tạm + trạng thái Turbo dở của dest (lần này không tải bằng Turbo nên không dùng lại được)"""
+    tmp = dest + TURBO_TEMP_SUFFIX
+    for path in (tmp, tmp + TURBO_STATE_SUFFIX, tmp + TURBO_STATE_SUFFIX + ".tmp"):
+        if os.path.exists(path):
+            try: os.remove(path)
+            except OSError: pass
+
+
+def split_ranges(size, connections):
+    """Chia [0, size) thành các đoạn (start, end) gần bằng nhau, end tính cả"""
+    connections = max(1, min(int(connections), size // TURBO_CHUNK or 1))
+    step = size // connections
+    ranges = []
+    for i in range(connections):
+        start = i * step
+        end = size - 1 if i == connections - 1 else start + step - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def segmented_download(url, dest, connections=4, headers=None, cancel_evt=None, progress_cb=None,
+                       timeout=30, retries=3, min_size=TURBO_MIN_SIZE, report_interval=0.25, throttle=None, on_retry=None):
+    """Tải url về dest bằng nhiều kết nối Range song song.
+    progress_cb nhận dict cùng dạng progress hook của yt-dlp (status, downloaded_bytes, total_bytes,
+    speed, eta, tmpfilename, filename); exception từ progress_cb sẽ dừng toàn bộ các kết nối.
+    throttle(nbytes), nếu có, được mỗi kết nối gọi sau mỗi block để giới hạn băng thông.
+    on_retry(), nếu có, được gọi mỗi lần một kết nối nối lại sau lỗi (từ thread của kết nối đó).
+    File tạm dở của lần trước (app bị kill) có trạng thái khớp dung lượng thì tải tiếp từng đoạn từ vị trí đã ghi.
+    Ném TurboUnsupported nếu nên dùng đường tải thường."""
+    tmp = dest + TURBO_TEMP_SUFFIX
+    try:
+        size = probe_size(url, headers, timeout)
+        if size < min_size:
+            raise TurboUnsupported("File nhỏ, không cần Turbo")
+    except TurboUnsupported:
+        discard_partial(dest)  # Sẽ tải thường từ đầu, file tạm cũ (đã cấp phát đủ dung lượng) thành rác
+        raise
+
+    ranges = load_state(tmp, size)
+    if ranges is None:
+        ranges = [[start, start, end] for start, end in split_ranges(size, connections)]
+        with open(tmp, "wb") as f:
+            preallocate(f, size)  # Cấp phát trước để mỗi kết nối ghi đúng vị trí
+        save_state(tmp, size, ranges)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    resumed = sum(pos - start for start, pos, _ in ranges)
+    done = [resumed]
+    errors = []
+
+    def worker(i, start, pos, end):
+        attempt = 0
+        try:
+            with open(tmp, "r+b", buffering=WRITE_BUFFER) as f:
+                try:
+                    while pos <= end and not stop.is_set():
+                        try:
+                            with urllib.request.urlopen(_request(url, headers, pos, end), timeout=timeout) as resp:
+                                if resp.status != 206:
+                                    raise TurboUnsupported("Server bỏ qua Range giữa chừng")
+                                f.seek(pos)
+                                while pos <= end:
+                                    if stop.is_set() or (cancel_evt and cancel_evt.is_set()): return
+                                    buf = resp.read(min(TURBO_CHUNK, end - pos + 1))
+                                    if not buf: break
+                                    f.write(buf)
+                                    pos += len(buf)
+                                    with lock: done[0] += len(buf)
+                                    attempt = 0
+                                    if throttle: throttle(len(buf))
+                                    # Vị trí trong file trạng thái chỉ tiến sau khi flush: không bao giờ vượt dữ liệu đã ghi thật
+                                    if pos - ranges[i][1] >= TURBO_STATE_BYTES:
+                                        f.flush(); ranges[i][1] = pos
+                        except TurboUnsupported:
+                            raise
+                        except Exception:
+                            # Rớt mạng: nối lại từ byte đang dở của đoạn này
+                            attempt += 1
+                            if attempt > retries: raise
+                            if on_retry: on_retry()
+                            stop.wait(attempt)
+                finally:
+                    f.flush(); ranges[i][1] = pos
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=worker, args=(i, start, pos, end), daemon=True)
+               for i, (start, pos, end) in enumerate(ranges) if pos <= end]
+    t0 = time.monotonic()
+    last_save = t0
+    try:
+        for t in threads: t.start()
+        while any(t.is_alive() for t in threads):
+            for t in threads: t.join(report_interval)
+            if cancel_evt and cancel_evt.is_set():
+                raise TurboCancelled("HUST_CANCELLED")
+            now = time.monotonic()
+            if now - last_save >= TURBO_STATE_INTERVAL:
+                save_state(tmp, size, ranges); last_save = now
+            if progress_cb:
+                elapsed = max(now - t0, 1e-6)
+                got = done[0]
+                speed = (got - resumed) / elapsed
+                progress_cb({'status': 'downloading', 'downloaded_bytes': got, 'total_bytes': size,
+                             'speed': speed, 'eta': (size - got) / speed if speed else None,
+                             'tmpfilename': tmp, 'filename': dest})
+        if errors: raise errors[0]
+        if done[0] < size: raise TurboUnsupported("Thiếu dữ liệu sau khi tải")
+        os.replace(tmp, dest)
+    finally:
+        stop.set()
+        for t in threads: t.join(timeout)
+        # Lỗi/hủy trong phiên này -> bỏ file dở; app bị kill thì không tới đây nên file tạm + trạng thái còn để tải tiếp
+        discard_partial(dest)
+
+    if progress_cb:
+        progress_cb({'status': 'finished', 'downloaded_bytes': size, 'total_bytes': size,
+                     'elapsed': time.monotonic() - t0, 'filename': dest})
+    return dest